@@ -0,0 +1,192 @@
+"""Client-side caches of the results of check requests.
+
+Mailing lists deliver the same message to many recipients within minutes,
+so the same digest is often checked many times. The client can keep the
+(count, whitelist count) result of every check for a while, and answer the
+following checks of the digest with the same server from the cache.
+
+The digests that were found on the server ("hits") and the ones that were
+not ("misses") have separate TTLs, and the cached results of a digest are
+dropped when it is reported or whitelisted by the same client.
+
+MemoryCache keeps the results for a single process, while FileCache keeps
+them in an SQLite database file that can be shared by many processes, for
+example short-lived pyzor commands.
+"""
+
+import time
+import random
+import logging
+import threading
+import collections
+
+try:
+    import sqlite3
+    _has_sqlite = True
+except ImportError:
+    _has_sqlite = False
+
+__all__ = ["MemoryCache", "FileCache"]
+
+
+class BaseCache(object):
+    """Keeps the results of the check requests to each server (as a
+    "host:port" string) for `hit_ttl` seconds if the digest was found, and
+    for `miss_ttl` seconds otherwise.
+    """
+    hit_ttl = 300  # seconds
+    miss_ttl = 60  # seconds
+
+    def __init__(self, hit_ttl=None, miss_ttl=None):
+        if hit_ttl is not None:
+            self.hit_ttl = hit_ttl
+        if miss_ttl is not None:
+            self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        self.log = logging.getLogger("pyzor")
+
+    def _expires(self, count, wl_count):
+        if count or wl_count:
+            return time.time() + self.hit_ttl
+        return time.time() + self.miss_ttl
+
+    def get(self, server, digest):
+        """Return the cached (count, wl_count) of the digest, or None."""
+        raise NotImplementedError()
+
+    def set(self, server, digest, count, wl_count):
+        raise NotImplementedError()
+
+    def invalidate(self, server, digest):
+        """Drop the cached result of the digest."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class MemoryCache(BaseCache):
+    """A cache of at most `max_size` results in memory, dropping the least
+    recently used ones first.
+    """
+    max_size = 10000
+
+    def __init__(self, hit_ttl=None, miss_ttl=None, max_size=None):
+        BaseCache.__init__(self, hit_ttl, miss_ttl)
+        if max_size is not None:
+            self.max_size = max_size
+        self._lock = threading.Lock()
+        # (server, digest) -> (expiry time, count, wl_count), from the
+        # least to the most recently used.
+        self._results = collections.OrderedDict()
+
+    def get(self, server, digest):
+        key = (server, digest)
+        with self._lock:
+            try:
+                expires, count, wl_count = self._results.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires <= time.time():
+                self.misses += 1
+                return None
+            self._results[key] = (expires, count, wl_count)
+            self.hits += 1
+            return count, wl_count
+
+    def set(self, server, digest, count, wl_count):
+        key = (server, digest)
+        expires = self._expires(count, wl_count)
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = (expires, count, wl_count)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def invalidate(self, server, digest):
+        with self._lock:
+            self._results.pop((server, digest), None)
+
+    def __len__(self):
+        return len(self._results)
+
+
+class FileCache(BaseCache):
+    """A cache in an SQLite database file, that can be shared by several
+    processes. The expired results are deleted after about one in
+    `prune_every` new results.
+
+    The cache is only an optimization, so database errors are logged and
+    handled as missing results. If the database cannot be opened, the cache
+    is disabled.
+    """
+    prune_every = 100
+    busy_timeout = 1  # seconds
+
+    def __init__(self, path, hit_ttl=None, miss_ttl=None):
+        BaseCache.__init__(self, hit_ttl, miss_ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path, timeout=self.busy_timeout,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                             "server TEXT NOT NULL, "
+                             "digest TEXT NOT NULL, "
+                             "r_count INTEGER NOT NULL, "
+                             "wl_count INTEGER NOT NULL, "
+                             "expires REAL NOT NULL, "
+                             "PRIMARY KEY (server, digest))")
+            self._db.commit()
+        except sqlite3.Error as e:
+            self.log.warning("Unable to create the cache in %s, not using "
+                             "it: %s", path, e)
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _execute(self, query, args, fetch=False):
+        with self._lock:
+            if self._db is None:
+                return None
+            try:
+                cursor = self._db.execute(query, args)
+                row = cursor.fetchone() if fetch else None
+                self._db.commit()
+                return row
+            except sqlite3.Error as e:
+                self.log.warning("Cache error in %s: %s", self.path, e)
+                return None
+
+    def get(self, server, digest):
+        row = self._execute("SELECT r_count, wl_count FROM results "
+                            "WHERE server=? AND digest=? AND expires>?",
+                            (server, digest, time.time()), fetch=True)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(row)
+
+    def set(self, server, digest, count, wl_count):
+        self._execute("INSERT OR REPLACE INTO results (server, digest, "
+                      "r_count, wl_count, expires) VALUES (?, ?, ?, ?, ?)",
+                      (server, digest, count, wl_count,
+                       self._expires(count, wl_count)))
+        if random.randrange(self.prune_every) == 0:
+            self._execute("DELETE FROM results WHERE expires<=?",
+                          (time.time(),))
+
+    def invalidate(self, server, digest):
+        self._execute("DELETE FROM results WHERE server=? AND digest=?",
+                      (server, digest))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
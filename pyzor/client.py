@@ -28,6 +28,15 @@ To query a server (where address is a (host, port) pair):
 >>> client.report(digest, address)
 >>> client.whitelist(digest, address)
 >>> client.check(digest, address)
+>>> client.check_many(digests, address)
+
+To send many requests, to any number of servers, at the same time:
+
+>>> multiplexer = pyzor.client.Multiplexer(client)
+>>> requests = ((digest, pyzor.message.CheckRequest(digest), address)
+...             for digest in digests)
+>>> for digest, response, error in multiplexer.run(requests):
+...     pass
 
 To query the default server (public.pyzor.org):
 
@@ -49,16 +58,22 @@ All responses will have:
 `info` and `check` responses will also contain:
 - '[WL-]Count' Whitelist/Blacklist count
 
+`check_many` responses have these counts for every digest, use
+get_counts() to get them as a list of (count, wl_count) pairs.
+
 `info` responses will also have:
 - '[WL-]Entered' timestamp when message was first whitelisted/blacklisted
 - '[WL-]Updated' timestamp when message was last whitelisted/blacklisted
 """
 
+import math
 import time
-import email
+import heapq
+import select
 import socket
 import logging
 import functools
+import threading
 import collections
 
 import pyzor.digest
@@ -71,10 +86,44 @@ pyzor.hacks.py26.hack_email()
 
 
 class Client(object):
-    timeout = 5
+    """Sends requests to pyzor servers, and reads their responses.
+
+    The addresses of the servers are looked up at most once every
+    `address_ttl` seconds, and up to `max_idle_sockets` sockets connected
+    to each server are kept open and reused for the following requests.
+    A client can be shared by several threads.
+
+    A request that has no response after the retransmission timeout is
+    sent again, up to `retries` times, doubling the timeout each time,
+    unless it would change the result (reports and whitelists). The
+    retransmission timeout is computed from the round-trip times of each
+    server, as in RFC 6298. `timeout` is the total time a request can take,
+    including all the retransmissions.
+
+    check_hedged() sends a check to the fastest server, and to the next one
+    only if there is no response after the `hedge_percentile` of the recent
+    round-trip times of the first.
+
+    If a `cache` (see pyzor.cache) is given, the results of the checks are
+    kept in it, and the cached results of the digests reported or
+    whitelisted by the client are dropped.
+    """
+    timeout = 5  # seconds
     max_packet_size = 8192
-
-    def __init__(self, accounts=None, timeout=None, spec=None):
+    address_ttl = 300  # seconds
+    max_idle_sockets = 4
+    retries = 0
+    initial_rto = 1  # seconds
+    min_rto = 0.2  # seconds
+    # The number of thread ids of retransmitted requests remembered on
+    # each socket, to drop the duplicate responses.
+    max_late = 16
+    hedge_percentile = 95
+    # The number of round-trip times kept for each server.
+    latency_samples = 100
+
+    def __init__(self, accounts=None, timeout=None, spec=None, retries=None,
+                 cache=None):
         if accounts is None:
             accounts = {}
         self.accounts = dict(((host, int(port)), account)
@@ -84,7 +133,26 @@ class Client(object):
         self.spec = spec
         if timeout is not None:
             self.timeout = timeout
+        if retries is not None:
+            self.retries = retries
+        self.cache = cache
         self.log = logging.getLogger("pyzor")
+        self._lock = threading.Lock()
+        # (host, port) -> (expiry time, [(af, socktype, proto, sockaddr)])
+        self._addresses = {}
+        # (host, port) -> sockets connected to the server, not in use.
+        self._idle = {}
+        # Socket -> ((host, port), request data or None if it cannot be
+        # retransmitted), of the sockets waiting for a response.
+        self._busy = {}
+        # Socket -> thread ids of the retransmitted requests, whose
+        # duplicate responses might still arrive.
+        self._late = {}
+        # (host, port) -> (smoothed round-trip time, round-trip time
+        # variation)
+        self._rtt = {}
+        # (host, port) -> the recent round-trip times.
+        self._latencies = {}
 
     def ping(self, address=("public.pyzor.org", 24441)):
         msg = pyzor.message.PingRequest()
@@ -112,19 +180,98 @@ class Client(object):
         return self.read_response(sock, msg.get_thread())
 
     def check(self, digest, address=("public.pyzor.org", 24441)):
+        address = (address[0], int(address[1]))
         msg = pyzor.message.CheckRequest(digest)
+        response = self._cached(msg, address)
+        if response is not None:
+            return response
         sock = self.send(msg, address)
-        return self.read_response(sock, msg.get_thread())
+        response = self.read_response(sock, msg.get_thread())
+        self._store(msg, address, response)
+        return response
+
+    def check_many(self, digests, address=("public.pyzor.org", 24441)):
+        msg = pyzor.message.CheckManyRequest(digests)
+        sock = self.send(msg, address)
+        response = self.read_response(sock, msg.get_thread(),
+                                      pyzor.message.CheckManyResponse)
+        if response.is_ok() and len(response.get_counts()) != len(digests):
+            raise pyzor.ProtocolError("received %d counts for %d digests" %
+                                      (len(response.get_counts()),
+                                       len(digests)))
+        return response
+
+    def check_hedged(self, digest, addresses):
+        """Check the digest with the first server of `addresses` that
+        answers, starting with the fastest one, and return the
+        (address, response) pair.
+        """
+        multiplexer = Multiplexer(self)
+        try:
+            requests = [(digest, functools.partial(pyzor.message.CheckRequest,
+                                                   digest), addresses)]
+            for key, address, response, error in \
+                    multiplexer.run_hedged(requests):
+                if error is not None:
+                    raise error
+                return address, response
+        finally:
+            multiplexer.close()
 
     def _mock_check(self, digests, address=None):
-        msg = (u"Code: %s\nDiag: OK\nPV: %s\nThread: 1024\nCount: 0\n"
-               u"WL-Count: 0" % (pyzor.message.Response.ok_code,
-                                 pyzor.proto_version)).encode('ascii')
-        return email.message_from_bytes(msg, _class=pyzor.message.Response)
+        return self._check_response(0, 0)
+
+    @staticmethod
+    def _check_response(count, wl_count):
+        msg = (u"Code: %s\nDiag: OK\nPV: %s\nThread: 1024\nCount: %d\n"
+               u"WL-Count: %d" % (pyzor.message.Response.ok_code,
+                                  pyzor.proto_version, count,
+                                  wl_count)).encode('ascii')
+        return pyzor.message.message_from_bytes(msg, pyzor.message.Response)
+
+    def _cached(self, msg, address):
+        """Return the response to the check request from the cache, or
+        None.
+        """
+        if self.cache is None or not getattr(msg, "cacheable", False):
+            return None
+        counts = self.cache.get("%s:%s" % address, msg["Op-Digest"])
+        if counts is None:
+            return None
+        self.log.debug("cached result for %s from %s:%s", msg["Op-Digest"],
+                       address[0], address[1])
+        return self._check_response(*counts)
+
+    def _store(self, msg, address, response):
+        """Keep the result of the check request in the cache."""
+        if (self.cache is None or not getattr(msg, "cacheable", False) or
+                not response.is_ok()):
+            return
+        try:
+            counts = int(response["Count"]), int(response["WL-Count"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.cache.set("%s:%s" % address, msg["Op-Digest"], *counts)
+
+    def _forget(self, msg, address):
+        """Drop the cached results of the digests whose counts are changed
+        by the request.
+        """
+        if self.cache is None or getattr(msg, "idempotent", True):
+            return
+        for digest in msg.get_all("Op-Digest", ()):
+            self.cache.invalidate("%s:%s" % address, digest)
 
     def send(self, msg, address=("public.pyzor.org", 24441)):
         address = (address[0], int(address[1]))
+        self._forget(msg, address)
         msg.init_for_sending()
+        self._sign(msg, address)
+        self.log.debug("sending: %r", msg.as_string())
+        return self._send(msg, address)
+
+    def _sign(self, msg, address):
+        """Sign the message with the account used for this address."""
         try:
             account = self.accounts[address]
         except KeyError:
@@ -134,68 +281,238 @@ class Client(object):
         msg["Time"] = str(timestamp)
         msg["Sig"] = pyzor.account.sign_msg(pyzor.account.hash_key(
             account.key, account.username), timestamp, msg)
-        self.log.debug("sending: %r", msg.as_string())
-        return self._send(msg, address)
 
-    @staticmethod
-    def _send(msg, addr):
-        sock = None
-        for res in socket.getaddrinfo(addr[0], addr[1], 0, socket.SOCK_DGRAM,
-                                      socket.IPPROTO_UDP):
-            af, socktype, proto, _, sa = res
+    def _resolve(self, address):
+        """Return the (af, socktype, proto, sockaddr) of the server, looked
+        up again once they expire.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                expires, infos = self._addresses[address]
+            except KeyError:
+                infos = None
+            else:
+                if expires > now:
+                    return infos
+        new_infos = [(af, socktype, proto, sa)
+                     for af, socktype, proto, _, sa in
+                     socket.getaddrinfo(address[0], address[1], 0,
+                                        socket.SOCK_DGRAM, socket.IPPROTO_UDP)]
+        with self._lock:
+            self._addresses[address] = (now + self.address_ttl, new_infos)
+            stale = self._idle.pop(address, []) if new_infos != infos else []
+        for sock in stale:
+            sock.close()
+        return new_infos
+
+    def _rto(self, address):
+        """Return the retransmission timeout for the server."""
+        with self._lock:
+            try:
+                srtt, rttvar = self._rtt[address]
+            except KeyError:
+                return min(self.initial_rto, self.timeout)
+        return min(max(srtt + 4 * rttvar, self.min_rto), self.timeout)
+
+    def _update_rtt(self, address, rtt):
+        """Add a round-trip time measured for the server (only for requests
+        that were not retransmitted, since the response could be to any of
+        the transmissions).
+        """
+        with self._lock:
+            try:
+                srtt, rttvar = self._rtt[address]
+            except KeyError:
+                self._rtt[address] = (rtt, rtt / 2)
+            else:
+                rttvar = 0.75 * rttvar + 0.25 * abs(srtt - rtt)
+                self._rtt[address] = (0.875 * srtt + 0.125 * rtt, rttvar)
+            try:
+                latencies = self._latencies[address]
+            except KeyError:
+                latencies = self._latencies[address] = collections.deque(
+                    maxlen=self.latency_samples)
+            latencies.append(rtt)
+
+    def _latency(self, address):
+        """Return the smoothed round-trip time of the server, or
+        `initial_rto` if it is not known yet.
+        """
+        with self._lock:
+            try:
+                return self._rtt[address][0]
+            except KeyError:
+                return self.initial_rto
+
+    def _hedge_delay(self, address):
+        """Return how long to wait for a response from the server before
+        sending the request to another one as well.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(address, ()))
+        # Until there are enough samples for the percentile to be lower than
+        # the slowest one, use the more cautious retransmission timeout.
+        if len(latencies) * (100 - self.hedge_percentile) < 100:
+            return self._rto(address)
+        i = int(math.ceil(len(latencies) * self.hedge_percentile / 100.0)) - 1
+        return min(latencies[i], self.timeout)
+
+    def _send(self, msg, addr):
+        data = msg.as_string().encode("utf8")
+        request = (addr, data if getattr(msg, "idempotent", False) else None)
+        # This also closes the idle sockets if the address changed.
+        infos = self._resolve(addr)
+        with self._lock:
+            try:
+                sock = self._idle[addr].pop()
+            except (KeyError, IndexError):
+                sock = None
+        if sock is not None:
+            try:
+                sock.send(data)
+            except socket.error:
+                # Probably an error left by a previous request, start over
+                # with a new socket.
+                sock.close()
+            else:
+                with self._lock:
+                    self._busy[sock] = request
+                return sock
+        for af, socktype, proto, sa in infos:
             try:
                 sock = socket.socket(af, socktype, proto)
             except socket.error:
-                sock = None
                 continue
             try:
-                sock.sendto(msg.as_string().encode("utf8"), 0, sa)
+                sock.connect(sa)
+                sock.send(data)
             except socket.timeout:
                 sock.close()
-                raise pyzor.TimeoutError("Sending to %s time-outed" % sa)
+                raise pyzor.TimeoutError("Sending to %s time-outed" % (sa,))
             except socket.error:
                 sock.close()
-                sock = None
                 continue
-            break
-        if sock is None:
-            raise pyzor.CommError("Unable to send to %s:%s" % addr)
-        return sock
-
-    def read_response(self, sock, expected_id):
-        sock.settimeout(self.timeout)
-        try:
-            packet, address = sock.recvfrom(self.max_packet_size)
-        except socket.timeout as ex:
-            sock.close()
-            raise pyzor.TimeoutError("Reading response timed-out.")
-        except socket.error as ex:
-            sock.close()
-            raise pyzor.CommError("Socket error while reading response: %s" %
-                                  ex)
+            with self._lock:
+                self._busy[sock] = request
+            return sock
+        with self._lock:
+            self._addresses.pop(addr, None)
+        raise pyzor.CommError("Unable to send to %s:%s" % addr)
+
+    def _release(self, sock, broken=False):
+        """Keep the socket for the next request to the same server, unless
+        it is `broken` or enough sockets are already kept.
+        """
+        with self._lock:
+            address = self._busy.pop(sock, (None, None))[0]
+            if address is not None and not broken:
+                idle = self._idle.setdefault(address, [])
+                if len(idle) < self.max_idle_sockets:
+                    idle.append(sock)
+                    return
+            self._late.pop(sock, None)
+        sock.close()
+
+    def close(self):
+        """Close the sockets kept for the following requests."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._addresses = {}
+            for sockets in idle.values():
+                for sock in sockets:
+                    self._late.pop(sock, None)
+        for sockets in idle.values():
+            for sock in sockets:
+                sock.close()
 
-        self.log.debug("received: %r/%r", packet, address)
-        msg = email.message_from_bytes(packet, _class=pyzor.message.Response)
-        msg.ensure_complete()
+    def read_response(self, sock, expected_id,
+                      response_class=pyzor.message.Response):
+        with self._lock:
+            address, data = self._busy.get(sock, (None, None))
+            late = self._late.get(sock, ())
+        retries = self.retries if data is not None else 0
+        rto = self._rto(address) if retries else self.timeout
+        # The times are relative to the first transmission.
+        start = time.time()
+        elapsed = 0
+        retransmit_at = rto
+        sent = 1
+        # The socket is only reused if a valid response is received, so
+        # that a late response can never be read as the response to the
+        # next request.
+        broken = True
         try:
-            thread_id = msg.get_thread()
-            if thread_id != expected_id:
-                if thread_id.in_ok_range():
-                    raise pyzor.ProtocolError(
-                        "received unexpected thread id %d (expected %d)" %
-                        (thread_id, expected_id))
-                self.log.warn("received error thread id %d (expected %d)",
-                              thread_id, expected_id)
-        except KeyError:
-            self.log.warn("no thread id received")
-        return msg
+            while True:
+                if sent <= retries and elapsed >= retransmit_at:
+                    self.log.debug("retransmitting to %s:%s", *address)
+                    try:
+                        sock.send(data)
+                    except socket.error as ex:
+                        raise pyzor.CommError("Socket error while "
+                                              "retransmitting: %s" % ex)
+                    sent += 1
+                    rto *= 2
+                    retransmit_at = elapsed + rto
+                remaining = self.timeout - elapsed
+                if remaining <= 0:
+                    raise pyzor.TimeoutError("Reading response timed-out.")
+                if sent <= retries:
+                    sock.settimeout(min(retransmit_at - elapsed, remaining))
+                else:
+                    sock.settimeout(remaining)
+                try:
+                    packet, address_from = sock.recvfrom(self.max_packet_size)
+                except socket.timeout as ex:
+                    if sent > retries:
+                        raise pyzor.TimeoutError("Reading response "
+                                                 "timed-out.")
+                    elapsed = max(time.time() - start, retransmit_at)
+                    continue
+                except socket.error as ex:
+                    raise pyzor.CommError("Socket error while reading "
+                                          "response: %s" % ex)
+
+                self.log.debug("received: %r/%r", packet, address_from)
+                msg = pyzor.message.message_from_bytes(packet, response_class)
+                msg.ensure_complete()
+                try:
+                    thread_id = msg.get_thread()
+                    if thread_id != expected_id:
+                        if thread_id in late:
+                            self.log.debug("dropped duplicate response to "
+                                           "thread id %d", thread_id)
+                            elapsed = time.time() - start
+                            continue
+                        if thread_id.in_ok_range():
+                            raise pyzor.ProtocolError(
+                                "received unexpected thread id %d "
+                                "(expected %d)" % (thread_id, expected_id))
+                        self.log.warn("received error thread id %d "
+                                      "(expected %d)", thread_id, expected_id)
+                except KeyError:
+                    self.log.warn("no thread id received")
+                if sent == 1:
+                    if address is not None:
+                        self._update_rtt(address, time.time() - start)
+                else:
+                    with self._lock:
+                        self._late.setdefault(
+                            sock, collections.deque(maxlen=self.max_late)
+                        ).append(expected_id)
+                broken = False
+                return msg
+        finally:
+            self._release(sock, broken)
 
 
 class BatchClient(Client):
     """Like the normal Client but with support for batching reports."""
 
-    def __init__(self, accounts=None, timeout=None, spec=None, batch_size=10):
-        Client.__init__(self, accounts=accounts, timeout=timeout, spec=spec)
+    def __init__(self, accounts=None, timeout=None, spec=None, batch_size=10,
+                 cache=None):
+        Client.__init__(self, accounts=accounts, timeout=timeout, spec=spec,
+                        cache=cache)
         self.batch_size = batch_size
         self.r_requests = {}
         self.w_requests = {}
@@ -214,7 +531,7 @@ class BatchClient(Client):
         msg.add_digest(digest)
         if msg.digest_count >= self.batch_size:
             try:
-                return self.send(msg, address)
+                self._release(self.send(msg, address), broken=True)
             finally:
                 del requests[address]
 
@@ -229,12 +546,12 @@ class BatchClient(Client):
         """Force send any remaining reports."""
         for address, msg in self.r_requests.items():
             try:
-                self.send(msg, address)
+                self._release(self.send(msg, address), broken=True)
             except:
                 continue
         for address, msg in self.w_requests.items():
             try:
-                self.send(msg, address)
+                self._release(self.send(msg, address), broken=True)
             except:
                 continue
 
@@ -242,6 +559,340 @@ class BatchClient(Client):
         self.force()
 
 
+class _Group(object):
+    """The requests sent by the Multiplexer for the same key, to one server
+    after the other. The first successful response is used.
+    """
+
+    def __init__(self, key, make_request, addresses):
+        self.key = key
+        self.make_request = make_request
+        # The servers that were not tried yet.
+        self.addresses = collections.deque(addresses)
+        # The thread ids of the requests waiting for a response.
+        self.threads = set()
+        # The (address, response, error) result of the last request that
+        # failed.
+        self.failed = None
+
+
+class _Request(object):
+    """A request sent by the Multiplexer, waiting for a response."""
+
+    def __init__(self, group, thread, sequence, address, sock, sockaddr, msg,
+                 deadline):
+        self.group = group
+        self.thread = thread
+        self.sequence = sequence
+        self.address = address
+        self.sock = sock
+        self.sockaddr = sockaddr
+        self.msg = msg
+        self.data = msg.as_string().encode("utf8")
+        self.deadline = deadline
+        self.start = time.time()
+        self.sent = 0
+        self.rto = None
+        # The time of the next retransmission, and of sending the request
+        # to the next server as well (None if there will be none).
+        self.retransmit_at = None
+        self.hedge_at = None
+
+
+class Multiplexer(object):
+    """Sends requests to any number of servers at the same time, from a
+    single socket for each address family, and collects the responses as
+    they arrive. The responses are matched with the requests by their
+    Thread id, which is unique among the requests waiting for a response.
+
+    At most `window` requests (or hedged groups of requests) are waiting
+    for a response at any time, each for up to the timeout of the `client`,
+    which is also used to sign the requests. The requests are retransmitted
+    like the client does.
+
+    A multiplexer runs one set of requests at a time.
+    """
+    window = 64
+    # The number of thread ids of the requests that might still get a
+    # response (retransmitted, timed-out or hedged requests) that are not
+    # reused, to drop these responses.
+    max_late = 1024
+
+    def __init__(self, client, window=None):
+        self.client = client
+        if window is not None:
+            self.window = window
+        self.log = logging.getLogger("pyzor")
+        # Address family -> socket.
+        self._sockets = {}
+        self._sequence = 0
+        self._late = collections.deque(maxlen=self.max_late)
+        # Thread id -> _Request, of the requests waiting for a response.
+        self._pending = {}
+        # A heap of the (time, sequence, thread id) of the next timer of
+        # each pending request. The sequence tells apart requests that used
+        # the same thread id.
+        self._timers = []
+
+    def _resolve(self, address):
+        try:
+            infos = self.client._resolve(address)
+        except socket.error:
+            infos = []
+        for af, socktype, proto, sa in infos:
+            if af not in self._sockets:
+                try:
+                    self._sockets[af] = socket.socket(af, socktype, proto)
+                except socket.error:
+                    continue
+            return af, sa
+        raise pyzor.CommError("Unable to send to %s:%s" % address)
+
+    def _send(self, group, msg, address, hedge):
+        """Send the message and start waiting for its response."""
+        address = (address[0], int(address[1]))
+        af, sa = self._resolve(address)
+        thread = pyzor.message.ThreadId.generate()
+        while thread in self._pending or thread in self._late:
+            thread = pyzor.message.ThreadId.generate()
+        del msg["Thread"]
+        msg.set_thread(thread)
+        self.client._forget(msg, address)
+        msg.init_for_sending()
+        self.client._sign(msg, address)
+        self.log.debug("sending: %r", msg.as_string())
+        self._sequence += 1
+        request = _Request(group, thread, self._sequence, address,
+                           self._sockets[af], sa, msg,
+                           time.time() + self.client.timeout)
+        self._transmit(request)
+        if self.client.retries and getattr(msg, "idempotent", False):
+            request.rto = self.client._rto(address)
+            request.retransmit_at = request.start + request.rto
+        if hedge and group.addresses:
+            request.hedge_at = (request.start +
+                                self.client._hedge_delay(address))
+        self._pending[thread] = request
+        group.threads.add(thread)
+        self._schedule(request)
+
+    def _transmit(self, request):
+        try:
+            request.sock.sendto(request.data, 0, request.sockaddr)
+        except socket.error as ex:
+            raise pyzor.CommError("Unable to send to %s:%s: %s" %
+                                  (request.address[0], request.address[1],
+                                   ex))
+        request.sent += 1
+
+    def _schedule(self, request):
+        when = min(t for t in (request.retransmit_at, request.hedge_at,
+                               request.deadline) if t is not None)
+        heapq.heappush(self._timers, (when, request.sequence, request.thread))
+
+    def _send_next(self, group, hedge):
+        """Send the request of the group to the next server, and return
+        False if there are none left.
+        """
+        while group.addresses:
+            address = group.addresses.popleft()
+            try:
+                self._send(group, group.make_request(), address, hedge)
+            except pyzor.CommError as ex:
+                group.failed = (address, None, ex)
+                continue
+            return True
+        return False
+
+    def _fail(self, request, response, error, hedge):
+        """The request failed, try the next server of its group. Return the
+        result of the group if there are none left.
+        """
+        group = request.group
+        self._pending.pop(request.thread, None)
+        group.threads.discard(request.thread)
+        if response is None:
+            self._late.append(request.thread)
+        group.failed = (request.address, response, error)
+        if group.threads or self._send_next(group, hedge):
+            return None
+        return (group.key,) + group.failed
+
+    def _succeed(self, request, response):
+        """Return the result of the group of the request, and stop waiting
+        for the other requests of the group.
+        """
+        group = request.group
+        group.threads.discard(request.thread)
+        for thread in group.threads:
+            self._pending.pop(thread, None)
+            self._late.append(thread)
+        group.threads.clear()
+        return group.key, request.address, response, None
+
+    def _timer(self, request, now, hedge):
+        """Handle the next timer of the request, and return the result of
+        its group if it is finished.
+        """
+        if request.deadline <= now:
+            return self._fail(request, None, pyzor.TimeoutError(
+                "Reading response timed-out."), hedge)
+        if request.hedge_at is not None and request.hedge_at <= now:
+            request.hedge_at = None
+            self.log.debug("no response yet from %s:%s, sending to the "
+                           "next server", *request.address)
+            self._send_next(request.group, hedge)
+        if request.retransmit_at is not None and request.retransmit_at <= now:
+            self.log.debug("retransmitting to %s:%s", *request.address)
+            try:
+                self._transmit(request)
+            except pyzor.CommError as ex:
+                return self._fail(request, None, ex, hedge)
+            if request.sent > self.client.retries:
+                request.retransmit_at = None
+            else:
+                request.rto *= 2
+                request.retransmit_at = now + request.rto
+        self._schedule(request)
+        return None
+
+    def _receive(self, sock, hedge):
+        """Read a response, and return the result of the group of the
+        request it answers, if it is finished.
+        """
+        try:
+            packet, address = sock.recvfrom(self.client.max_packet_size)
+        except socket.error as ex:
+            self.log.debug("socket error while reading response: %s", ex)
+            return None
+        self.log.debug("received: %r/%r", packet, address)
+        try:
+            msg = pyzor.message.message_from_bytes(packet,
+                                                   pyzor.message.Response)
+            msg.ensure_complete()
+            thread = msg.get_thread()
+        except (pyzor.ProtocolError, KeyError, ValueError) as ex:
+            self.log.warning("invalid response from %s: %s", address, ex)
+            return None
+        try:
+            request = self._pending[thread]
+        except KeyError:
+            # Usually the response to a request that timed out, or a
+            # duplicate response to a retransmitted request.
+            self.log.debug("received unexpected thread id %d", thread)
+            return None
+        if request.sent == 1:
+            self.client._update_rtt(request.address,
+                                    time.time() - request.start)
+        else:
+            self._late.append(thread)
+        self._pending.pop(thread)
+        if not msg.is_ok():
+            return self._fail(request, msg, None, hedge)
+        self.client._store(request.msg, request.address, msg)
+        return self._succeed(request, msg)
+
+    def _cached(self, group):
+        """Return the result of the group from the cache of the client, or
+        None.
+        """
+        if self.client.cache is None:
+            return None
+        msg = group.make_request()
+        for address in group.addresses:
+            address = (address[0], int(address[1]))
+            response = self.client._cached(msg, address)
+            if response is not None:
+                return group.key, address, response, None
+        return None
+
+    def _run(self, groups, hedge):
+        """Yield the (key, address, response, error) result of each group,
+        as they are finished.
+        """
+        groups = iter(groups)
+        self._pending = {}
+        self._timers = []
+        active = 0
+        exhausted = False
+        while True:
+            while not exhausted and active < self.window:
+                try:
+                    group = next(groups)
+                except StopIteration:
+                    exhausted = True
+                    break
+                result = self._cached(group)
+                if result is not None:
+                    yield result
+                elif self._send_next(group, hedge):
+                    active += 1
+                else:
+                    yield (group.key,) + group.failed
+            if not active:
+                if exhausted:
+                    return
+                continue
+            now = time.time()
+            while self._timers:
+                when, sequence, thread = self._timers[0]
+                request = self._pending.get(thread)
+                if request is None or request.sequence != sequence:
+                    # Already answered.
+                    heapq.heappop(self._timers)
+                    continue
+                if when > now:
+                    break
+                heapq.heappop(self._timers)
+                result = self._timer(request, now, hedge)
+                if result is not None:
+                    active -= 1
+                    yield result
+            if not self._timers:
+                continue
+            readable = select.select(list(self._sockets.values()), [], [],
+                                     max(self._timers[0][0] - now, 0))[0]
+            for sock in readable:
+                result = self._receive(sock, hedge)
+                if result is not None:
+                    active -= 1
+                    yield result
+
+    def run(self, requests):
+        """Send the (key, request message, address) requests, and yield a
+        (key, response, error) triple for each of them as the responses
+        arrive. `error` is a pyzor.CommError (for example a
+        pyzor.TimeoutError) if no response was received.
+
+        The requests are read as they can be sent, so `requests` can be a
+        generator.
+        """
+        groups = (_Group(key, lambda msg=msg: msg, [address])
+                  for key, msg, address in requests)
+        for key, address, response, error in self._run(groups, False):
+            yield key, response, error
+
+    def run_hedged(self, requests):
+        """Send each of the (key, request factory, addresses) requests to
+        the fastest of the servers, and to the next one if there is no
+        response after its hedging delay, or the request fails. Yield a
+        (key, address, response, error) result for each of them, with the
+        first successful response, or the last failure.
+
+        `request factory` is called with no arguments to create the request
+        message for each server.
+        """
+        groups = (_Group(key, make_request,
+                         sorted(addresses, key=self.client._latency))
+                  for key, make_request, addresses in requests)
+        return self._run(groups, True)
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets = {}
+
+
 class ClientRunner(object):
     def __init__(self, routine):
         self.log = logging.getLogger("pyzor")
@@ -252,15 +903,27 @@ class ClientRunner(object):
     def run(self, server, args, kwargs=None):
         if kwargs is None:
             kwargs = {}
-        message = "%s:%s\t" % server
-        response = None
         try:
             response = self.routine(*args, **kwargs)
+        except (pyzor.CommError, KeyError, ValueError) as e:
+            self.handle_error(server, e)
+        else:
+            self.handle(server, response)
+
+    def handle(self, server, response):
+        """Add the result of a response received from this server."""
+        message = "%s:%s\t" % server
+        try:
             self.handle_response(response, message)
         except (pyzor.CommError, KeyError, ValueError) as e:
-            self.results.append("%s%s\n" % (message, (e.code, str(e))))
-            self.log.error("%s\t%s: %s", server, e.__class__.__name__, e)
-            self.all_ok = False
+            self.handle_error(server, e)
+
+    def handle_error(self, server, e):
+        """Add the result of a request to this server that failed."""
+        message = "%s:%s\t" % server
+        self.results.append("%s%s\n" % (message, (e.code, str(e))))
+        self.log.error("%s\t%s: %s", server, e.__class__.__name__, e)
+        self.all_ok = False
 
     def handle_response(self, response, message):
         """mesaage is a string we've built up so far"""
@@ -3,6 +3,7 @@
 import os
 import re
 import logging
+import threading
 import collections
 
 try:
@@ -208,10 +209,127 @@ def load_local_whitelist(filepath):
 
 
 # Common configurations
+class QueuedHandler(logging.Handler):
+    """Hands the records over to a background thread that writes them to
+    the `target` handler, so that logging doesn't block the caller.
+
+    The thread wakes up every `interval` seconds and writes all the waiting
+    records at once, with a single flush. If more than `queue_size` records
+    are waiting the new ones are dropped and counted in `dropped`, and a
+    warning with the number of dropped records is written with the next
+    batch.
+
+    The thread is (re)started by the first record logged in each process,
+    so the handler can be used by forked workers. Records still queued
+    when a process exits with os._exit() are lost.
+    """
+
+    def __init__(self, target, queue_size=10000, interval=0.05):
+        logging.Handler.__init__(self, target.level)
+        self.target = target
+        self.queue_size = queue_size
+        self.interval = interval
+        self.dropped = 0
+        self._reported = 0
+        self._pid = None
+        self.queue = None
+        self.thread = None
+        self._stop = None
+        self._write_lock = threading.Lock()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self.queue = collections.deque()
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        # This is called with the handler lock held.
+        if self._pid != os.getpid():
+            self._start()
+        if len(self.queue) < self.queue_size:
+            self.queue.append(record)
+        else:
+            self.dropped += 1
+
+    def _write_loop(self):
+        stop = self._stop
+        while True:
+            stopping = stop.wait(self.interval)
+            self._write_queued()
+            if stopping:
+                return
+
+    def _write_queued(self):
+        with self._write_lock:
+            records = []
+            popleft = self.queue.popleft
+            try:
+                while True:
+                    records.append(popleft())
+            except IndexError:
+                pass
+            self.write(records)
+
+    def write(self, records):
+        """Write these records to the target handler, flushing only once
+        if it's a stream.
+        """
+        dropped = self.dropped
+        if dropped != self._reported:
+            records.append(logging.makeLogRecord({
+                "name": records[0].name if records else "pyzor",
+                "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": "%d log records dropped because the queue was full",
+                "args": (dropped - self._reported,)}))
+            self._reported = dropped
+        target = self.target
+        if not isinstance(target, logging.StreamHandler):
+            for record in records:
+                target.handle(record)
+            return
+        terminator = getattr(target, "terminator", "\n")
+        lines = []
+        for record in records:
+            if not target.filter(record):
+                continue
+            try:
+                lines.append(target.format(record) + terminator)
+            except Exception:
+                target.handleError(record)
+        if not lines:
+            return
+        with target.lock:
+            try:
+                target.stream.write("".join(lines))
+                target.flush()
+            except Exception:
+                target.handleError(records[-1])
+
+    def flush(self):
+        """Write all the queued records now."""
+        if self._pid == os.getpid():
+            self._write_queued()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._stop.set()
+            self.thread.join()
+            self._pid = None
+        self.target.close()
+        logging.Handler.close(self)
+
+
 def setup_logging(log_name, filepath, debug, sentry_dsn=None,
-                  sentry_lvl="WARN"):
+                  sentry_lvl="WARN", queue_size=0):
     """Setup logging according to the specified options. Return the Logger
     object.
+
+    If `queue_size` is set the log file is written from a background
+    thread, see QueuedHandler.
     """
     fmt = logging.Formatter('%(asctime)s (%(process)d) %(levelname)s '
                             '%(message)s')
@@ -236,6 +354,8 @@ def setup_logging(log_name, filepath, debug, sentry_dsn=None,
         file_handler = logging.FileHandler(filepath)
         file_handler.setLevel(file_log_level)
         file_handler.setFormatter(fmt)
+        if queue_size:
+            file_handler = QueuedHandler(file_handler, queue_size)
         logger.addHandler(file_handler)
 
     if sentry_dsn and _has_raven:
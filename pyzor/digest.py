@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import re
+import sys
 import hashlib
 
 try:
@@ -16,6 +17,13 @@ digest_spec = ([(20, 3), (60, 3)])
 HASH = hashlib.sha1
 HASH_SIZE = len(HASH(b"").hexdigest())
 
+if sys.version_info[0] < 3:
+    # The patterns aren't compiled with re.UNICODE, so they only consider
+    # ASCII characters as whitespace, unlike unicode.split().
+    _split_ws = re.compile(r"\S+").findall
+else:
+    _split_ws = str.split
+
 
 class HTMLStripper(HTMLParser.HTMLParser):
     """Strip all tags from the HTML."""
@@ -71,6 +79,11 @@ class DataDigester(object):
     # Note that an empty string will always be used to remove whitespace.
     unwanted_txt_repl = ''
 
+    # normalize() gets the same result as applying the patterns above in a
+    # single pass, but this only holds as long as they are not changed.
+    _fused_patterns = (longstr_ptrn, email_ptrn, url_ptrn, ws_ptrn,
+                       unwanted_txt_repl)
+
     def __init__(self, msg, spec=None):
         if spec is None:
             spec = digest_spec
@@ -118,6 +131,29 @@ class DataDigester(object):
 
     @classmethod
     def normalize(cls, s):
+        if (cls.longstr_ptrn, cls.email_ptrn, cls.url_ptrn, cls.ws_ptrn,
+                cls.unwanted_txt_repl) != cls._fused_patterns:
+            return cls.normalize_patterns(s)
+        # None of the patterns match across whitespace, so they can be
+        # applied to every word on its own.
+        words = []
+        for word in _split_ws(s.replace("\x00", "")):
+            # longstr_ptrn matches the whole word if it's at least 10
+            # characters long, and so does email_ptrn if there is a @ that
+            # isn't the first or the last character.
+            if len(word) >= 10 or "@" in word[1:-1]:
+                continue
+            if ":" in word:
+                # url_ptrn matches from its start to the end of the word.
+                match = cls.url_ptrn.search(word)
+                if match:
+                    word = word[:match.start()]
+            words.append(word)
+        return "".join(words)
+
+    @classmethod
+    def normalize_patterns(cls, s):
+        """Normalize the line by applying the patterns one by one."""
         s = s.replace("\x00", "")
         repl = cls.unwanted_txt_repl
         s = cls.longstr_ptrn.sub(repl, s)
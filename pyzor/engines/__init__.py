@@ -13,15 +13,19 @@ appropriate interval.
 """
 
 from pyzor.engines import gdbm_
+from pyzor.engines import lmdb_
 from pyzor.engines import mysql
 from pyzor.engines import redis_
 from pyzor.engines import redis_v0
+from pyzor.engines import sqlite
 
 
 __all__ = ["database_classes"]
 
 database_classes = {"gdbm": gdbm_.handle,
+                    "lmdb": lmdb_.handle,
                     "mysql": mysql.handle,
                     "redis_v0": redis_v0.handle,
                     "redis": redis_.handle,
+                    "sqlite": sqlite.handle,
                     }
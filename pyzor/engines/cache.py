@@ -0,0 +1,180 @@
+"""In-process read cache that can be placed in front of any engine."""
+
+import time
+import logging
+import threading
+import collections
+
+from pyzor.engines.common import BaseEngine, Record
+
+__all__ = ["CachedDBHandle"]
+
+
+class CachedDBHandle(BaseEngine):
+    """Wraps another engine and serves __getitem__ from a bounded LRU
+    cache, where entries also expire after `ttl` seconds.
+
+    Missing records are cached as well. Reports, whitelists and writes made
+    through this handle invalidate or update the cached entries, but
+    changes made by other processes are only seen once the entry expires.
+
+    The hits and misses are counted in `hits` and `misses`, and also in
+    `metrics` (a pyzor.metrics.Metrics instance) if it is set.
+    """
+    log = logging.getLogger("pyzord")
+    metrics = None
+
+    def __init__(self, engine, max_size=10000, ttl=60):
+        self.engine = engine
+        self.max_size = max_size
+        self.ttl = ttl
+        self.absolute_source = engine.absolute_source
+        self.handles_one_step = engine.handles_one_step
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented on every invalidation, so that records read from the
+        # engine before the invalidation are not stored in the cache.
+        self._generation = 0
+
+    def __getattr__(self, name):
+        if name == "engine":
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def __iter__(self):
+        return iter(self.engine)
+
+    def iteritems(self):
+        return self.engine.iteritems()
+
+    def items(self):
+        return self.engine.items()
+
+    def _store(self, key, record, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._cache.pop(key, None)
+            self._cache[key] = (time.time() + self.ttl, record)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._cache.pop(key, None)
+            return self._generation
+
+    def _cached(self, key):
+        """Return the cached entry for this key (None for a missing record),
+        or raise KeyError if there is no valid entry. The lock must be held.
+        """
+        expires, record = self._cache.pop(key)
+        if expires <= time.time():
+            raise KeyError(key)
+        # Move the entry to the end, as the most recently used.
+        self._cache[key] = (expires, record)
+        return record
+
+    def _record(self, hits, misses):
+        if self.metrics is not None:
+            self.metrics.record_cache(hits, misses)
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                record = self._cached(key)
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+                hit = False
+            else:
+                self.hits += 1
+                hit = True
+        if hit:
+            self._record(1, 0)
+            if record is None:
+                raise KeyError(key)
+            return record
+        self._record(0, 1)
+        try:
+            record = self.engine[key]
+        except KeyError:
+            self._store(key, None, generation)
+            raise
+        self._store(key, record, generation)
+        return record
+
+    def get_many(self, keys):
+        records = {}
+        missing = []
+        seen = set()
+        with self._lock:
+            for key in keys:
+                if key in seen:
+                    continue
+                seen.add(key)
+                try:
+                    records[key] = self._cached(key) or Record()
+                except KeyError:
+                    missing.append(key)
+            self.hits += len(records)
+            self.misses += len(missing)
+            generation = self._generation
+        self._record(len(records), len(missing))
+        if missing:
+            for key, record in zip(missing, self.engine.get_many(missing)):
+                # The engines return a blank record for a missing key, that
+                # is cached as missing like in __getitem__.
+                if (record.r_count or record.wl_count or
+                        record.r_entered is not None or
+                        record.wl_entered is not None):
+                    self._store(key, record, generation)
+                else:
+                    self._store(key, None, generation)
+                records[key] = record
+        return [records[key] for key in keys]
+
+    def __setitem__(self, key, value):
+        generation = self._invalidate((key,))
+        self.engine[key] = value
+        self._store(key, value, generation)
+
+    def set_many(self, items):
+        items = list(items)
+        generation = self._invalidate([key for key, value in items])
+        self.engine.set_many(items)
+        for key, value in items:
+            self._store(key, value, generation)
+
+    def __delitem__(self, key):
+        self._invalidate((key,))
+        del self.engine[key]
+
+    def increment_many(self, items):
+        items = list(items)
+        try:
+            return self.engine.increment_many(items)
+        finally:
+            self._invalidate([key for key, delta in items])
+
+    def report(self, keys):
+        try:
+            return self.engine.report(keys)
+        finally:
+            self._invalidate(keys)
+
+    def whitelist(self, keys):
+        try:
+            return self.engine.whitelist(keys)
+        finally:
+            self._invalidate(keys)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
@@ -1,11 +1,23 @@
 """Common library shared by different engines."""
 
 import sys
+import struct
 import datetime
 
 from collections import namedtuple
 
-__all__ = ["DBHandle", "DatabaseError", "Record", "BaseEngine"]
+__all__ = ["DBHandle", "DatabaseError", "Record", "BaseEngine",
+           "pack_record", "unpack_record", "is_packed_record"]
+
+# Packed records are the version byte followed by the counts and the
+# timestamps as 64 bit integers, in the order of _PACKED_FIELDS. The
+# timestamps are the number of microseconds since the epoch, in the same
+# (local) time as the datetime objects.
+_PACKED_VERSION = b"\x02"
+_PACKED_RECORD = struct.Struct("<c6q")
+_EPOCH = datetime.datetime(1970, 1, 1)
+# Stored instead of a timestamp that isn't set.
+_NO_TIMESTAMP = -2 ** 63
 
 DBHandle = namedtuple("DBHandle", ["single_threaded", "multi_threaded",
                                    "multi_processing", "prefork"])
@@ -51,6 +63,65 @@ class Record(object):
     def wl_update(self):
         self.wl_updated = datetime.datetime.now()
 
+    def add(self, delta):
+        """Add the counts of the `delta` record to this one. The timestamps
+        of `delta` are used for the counts that it changes, except for an
+        entered timestamp that is already set.
+        """
+        if delta.r_count:
+            self.r_count = min(self.r_count + delta.r_count, sys.maxsize)
+            if self.r_entered is None:
+                self.r_entered = delta.r_entered
+            self.r_updated = delta.r_updated
+        if delta.wl_count:
+            self.wl_count = min(self.wl_count + delta.wl_count, sys.maxsize)
+            if self.wl_entered is None:
+                self.wl_entered = delta.wl_entered
+            self.wl_updated = delta.wl_updated
+
+
+def _ts_encode(value):
+    """Encode a datetime object into microseconds since the epoch."""
+    if value is None:
+        return _NO_TIMESTAMP
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _ts_decode(value):
+    """Decode microseconds since the epoch into a datetime object."""
+    if value == _NO_TIMESTAMP:
+        return None
+    return _EPOCH + datetime.timedelta(microseconds=value)
+
+
+def pack_record(record):
+    """Encode the record into a compact fixed size byte string."""
+    return _PACKED_RECORD.pack(_PACKED_VERSION,
+                               record.r_count,
+                               _ts_encode(record.r_entered),
+                               _ts_encode(record.r_updated),
+                               record.wl_count,
+                               _ts_encode(record.wl_entered),
+                               _ts_encode(record.wl_updated))
+
+
+def is_packed_record(data):
+    """Check if the byte string was encoded with pack_record."""
+    return data[:1] == _PACKED_VERSION and len(data) == _PACKED_RECORD.size
+
+
+def unpack_record(data):
+    """Decode a byte string encoded with pack_record."""
+    (version, r_count, r_entered, r_updated,
+     wl_count, wl_entered, wl_updated) = _PACKED_RECORD.unpack(data)
+    if version != _PACKED_VERSION:
+        raise ValueError("don't know how to handle db value %s" %
+                         repr(data))
+    return Record(r_count, wl_count,
+                  _ts_decode(r_entered), _ts_decode(r_updated),
+                  _ts_decode(wl_entered), _ts_decode(wl_updated))
+
 
 class BaseEngine(object):
     """Base class for Pyzor engines."""
@@ -73,16 +144,53 @@ class BaseEngine(object):
         """Get the record for this corresponding key."""
         raise NotImplementedError()
 
+    def get_many(self, keys):
+        """Return a list with the records for these keys, in the same order.
+        A blank ``Record`` is returned for the keys that don't exist.
+
+        Engines that can fetch several records at once should override this.
+        """
+        records = []
+        for key in keys:
+            try:
+                records.append(self[key])
+            except KeyError:
+                records.append(Record())
+        return records
+
     def __setitem__(self, key, value):
         """Set the record for this corresponding key. 'value' should be a
         instance of the ``Record`` class.
         """
         raise NotImplementedError()
 
+    def set_many(self, items):
+        """Set the records for these (key, record) pairs.
+
+        Engines that can write several records at once should override this.
+        """
+        for key, value in items:
+            self[key] = value
+
     def __delitem__(self, key):
         """Remove the corresponding record from the database."""
         raise NotImplementedError()
 
+    def increment_many(self, items):
+        """Add the counts of the records in these (key, record) pairs to
+        the stored records, see ``Record.add``.
+
+        The keys must be unique. Engines that can increment the counts in
+        place should override this, this implementation reads and writes
+        back the records and is not atomic.
+        """
+        items = list(items)
+        records = self.get_many([key for key, delta in items])
+        for record, (key, delta) in zip(records, items):
+            record.add(delta)
+        self.set_many((key, record)
+                      for record, (key, delta) in zip(records, items))
+
     def report(self, keys):
         """Report the corresponding key as spam, incrementing the report count.
 
@@ -10,22 +10,21 @@ except ImportError:
     except ImportError:
         _has_gdbm = False
 
-import time
 import logging
 import datetime
 import threading
 
-from pyzor.engines.common import Record, DBHandle, BaseEngine
+from pyzor.engines.common import Record, DBHandle, BaseEngine, \
+    pack_record, unpack_record, is_packed_record
 
 
 def _dt_decode(datetime_str):
     """Decode a string into a datetime object."""
     if datetime_str == 'None':
         return None
-    try:
+    if "." in datetime_str:
         return datetime.datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S.%f")
-    except ValueError:
-        return datetime.datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+    return datetime.datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
 
 
 class GdbmDBHandle(BaseEngine):
@@ -33,7 +32,11 @@ class GdbmDBHandle(BaseEngine):
     handles_one_step = False
 
     sync_period = 60
-    reorganize_period = 3600 * 24  # 1 day
+    # Expired records are removed incrementally: every `expire_period`
+    # seconds the next `expire_batch_size` keys are checked. The database
+    # file is only compacted by reorganize().
+    expire_period = 10
+    expire_batch_size = 1000
     fields = ('r_count', 'r_entered', 'r_updated',
               'wl_count', 'wl_entered', 'wl_updated')
     _fields = [('r_count', int),
@@ -42,15 +45,24 @@ class GdbmDBHandle(BaseEngine):
                ('wl_count', int),
                ('wl_entered', _dt_decode),
                ('wl_updated', _dt_decode)]
-    this_version = '1'
+    # Records are always written in this version. Records in older versions
+    # are still read, and are upgraded when they are next written.
+    this_version = '2'
     log = logging.getLogger("pyzord")
 
     def __init__(self, fn, mode, max_age=None):
         self.max_age = max_age
+        # The sync and expire timers use the database from their own
+        # threads, so every access is serialized even in a single-threaded
+        # server.
+        self.db_lock = threading.Lock()
         self.db = gdbm.open(fn, mode)
-        self.reorganize_timer = None
+        self.expire_timer = None
         self.sync_timer = None
-        self.start_reorganizing()
+        # The next key to check for expiry, None to start from the first key.
+        self._expire_cursor = None
+        self._expired = 0
+        self.start_expiring()
         self.start_syncing()
 
     def __iter__(self):
@@ -75,19 +87,49 @@ class GdbmDBHandle(BaseEngine):
     def apply_method(self, method, varargs=(), kwargs=None):
         if kwargs is None:
             kwargs = {}
-        return method(*varargs, **kwargs)
+        with self.db_lock:
+            return method(*varargs, **kwargs)
 
     def __getitem__(self, key):
         return self.apply_method(self._really_getitem, (key,))
 
     def _really_getitem(self, key):
-        return GdbmDBHandle.decode_record(self.db[key])
+        return self.decode_record(self.db[key])
+
+    def get_many(self, keys):
+        return self.apply_method(self._really_get_many, (keys,))
+
+    def _really_get_many(self, keys):
+        records = []
+        for key in keys:
+            try:
+                records.append(self._really_getitem(key))
+            except KeyError:
+                records.append(Record())
+        return records
 
     def __setitem__(self, key, value):
         self.apply_method(self._really_setitem, (key, value))
 
     def _really_setitem(self, key, value):
-        self.db[key] = GdbmDBHandle.encode_record(value)
+        self.db[key] = self.encode_record(value)
+
+    def set_many(self, items):
+        self.apply_method(self._really_set_many, (items,))
+
+    def _really_set_many(self, items):
+        for key, value in items:
+            self._really_setitem(key, value)
+
+    def increment_many(self, items):
+        self.apply_method(self._really_increment_many, (items,))
+
+    def _really_increment_many(self, items):
+        items = list(items)
+        records = self._really_get_many([key for key, delta in items])
+        for record, (key, delta) in zip(records, items):
+            record.add(delta)
+            self._really_setitem(key, record)
 
     def __delitem__(self, key):
         self.apply_method(self._really_delitem, (key,))
@@ -106,44 +148,97 @@ class GdbmDBHandle(BaseEngine):
     def _really_sync(self):
         self.db.sync()
 
-    def start_reorganizing(self):
+    def start_expiring(self):
         if not self.max_age:
             return
-        if self.db:
-            self.apply_method(self._really_reorganize)
-        self.reorganize_timer = threading.Timer(self.reorganize_period,
-                                                self.start_reorganizing)
-        self.reorganize_timer.setDaemon(True)
-        self.reorganize_timer.start()
+        self.apply_method(self._really_expire)
+        self.expire_timer = threading.Timer(self.expire_period,
+                                            self.start_expiring)
+        self.expire_timer.setDaemon(True)
+        self.expire_timer.start()
+
+    def _is_expired(self, key, oldest):
+        try:
+            rec = self._really_getitem(key)
+        except KeyError:
+            return False
+        except Exception as e:
+            self.log.warning("Invalid record %s: %s", key, e)
+            return False
+        return rec.r_updated is not None and rec.r_updated < oldest
+
+    def _really_expire(self):
+        """Check the next `expire_batch_size` keys, and delete the expired
+        records.
+        """
+        oldest = datetime.datetime.now() - datetime.timedelta(
+            seconds=self.max_age)
+        key = self._expire_cursor
+        if key is None:
+            key = self.db.firstkey()
+        expired = []
+        for dummy in range(self.expire_batch_size):
+            if key is None:
+                break
+            if self._is_expired(key, oldest):
+                expired.append(key)
+            key = self.db.nextkey(key)
+        # The cursor is moved past the expired keys before deleting them,
+        # so it always points to a key that is still in the database.
+        self._expire_cursor = key
+        for key in expired:
+            self.log.debug("deleting key %s", key)
+            self._really_delitem(key)
+        self._expired += len(expired)
+        if self._expire_cursor is None:
+            self.log.debug("expired %s records", self._expired)
+            self._expired = 0
+
+    def reorganize(self):
+        """Delete all the expired records and compact the database file.
+
+        The database is locked until this completes, which can take a long
+        time for a large database.
+        """
+        self.apply_method(self._really_reorganize)
 
     def _really_reorganize(self):
         self.log.debug("reorganizing the database")
-        key = self.db.firstkey()
-        breakpoint = time.time() - self.max_age
-        while key is not None:
-            rec = self._really_getitem(key)
-            delkey = None
-            if int(time.mktime(rec.r_updated.timetuple())) < breakpoint:
+        if self.max_age:
+            oldest = datetime.datetime.now() - datetime.timedelta(
+                seconds=self.max_age)
+            expired = [key for key in self if self._is_expired(key, oldest)]
+            for key in expired:
                 self.log.debug("deleting key %s", key)
-                delkey = key
-            key = self.db.nextkey(key)
-            if delkey:
-                self._really_delitem(delkey)
+                self._really_delitem(key)
+        self._expire_cursor = None
         self.db.reorganize()
 
     @classmethod
     def encode_record(cls, value):
-        values = [cls.this_version]
+        if cls.this_version == '1':
+            return cls.encode_record_1(value)
+        return cls.encode_record_2(value)
+
+    @classmethod
+    def encode_record_1(cls, value):
+        values = ['1']
         values.extend(["%s" % getattr(value, x) for x in cls.fields])
         return ",".join(values)
 
+    @staticmethod
+    def encode_record_2(value):
+        return pack_record(value)
+
     @classmethod
     def decode_record(cls, s):
+        if is_packed_record(s):
+            return cls.decode_record_2(s)
         try:
             s = s.decode("utf8")
         except UnicodeError:
-            raise StandardError("don't know how to handle db value %s" %
-                                repr(s))
+            raise ValueError("don't know how to handle db value %s" %
+                             repr(s))
         parts = s.split(',')
         version = parts[0]
         if len(parts) == 3:
@@ -151,19 +246,20 @@ class GdbmDBHandle(BaseEngine):
         elif version == '1':
             dispatch = cls.decode_record_1
         else:
-            raise StandardError("don't know how to handle db value %s" %
-                                repr(s))
+            raise ValueError("don't know how to handle db value %s" %
+                             repr(s))
         return dispatch(s)
 
     @staticmethod
     def decode_record_0(s):
-        r = Record()
         parts = s.split(',')
-        fields = ('r_count', 'r_entered', 'r_updated')
-        assert len(parts) == len(fields)
-        for i in range(len(parts)):
-            setattr(r, fields[i], int(parts[i]))
-        return r
+        assert len(parts) == 3
+        r_count, r_entered, r_updated = [int(part) for part in parts]
+        # The timestamps are in seconds since the epoch, and are converted
+        # so that the record can be written in the current version.
+        return Record(r_count=r_count,
+                      r_entered=datetime.datetime.fromtimestamp(r_entered),
+                      r_updated=datetime.datetime.fromtimestamp(r_updated))
 
     @classmethod
     def decode_record_1(cls, s):
@@ -175,21 +271,19 @@ class GdbmDBHandle(BaseEngine):
             setattr(r, f, decode(part))
         return r
 
+    @staticmethod
+    def decode_record_2(s):
+        return unpack_record(s)
+
 
 class ThreadedGdbmDBHandle(GdbmDBHandle):
-    """Like GdbmDBHandle, but handles multi-threaded access."""
+    """Like GdbmDBHandle, for the multi-threaded servers. The database
+    accesses are already serialized by GdbmDBHandle.
+    """
 
     def __init__(self, fn, mode, max_age=None, bound=None):
-        self.db_lock = threading.Lock()
         GdbmDBHandle.__init__(self, fn, mode, max_age=max_age)
 
-    def apply_method(self, method, varargs=(), kwargs=None):
-        if kwargs is None:
-            kwargs = {}
-        with self.db_lock:
-            return GdbmDBHandle.apply_method(self, method, varargs=varargs,
-                                             kwargs=kwargs)
-
 # This won't work because the gdbm object needs to be in shared memory of the
 # spawned processes.
 # class ProcessGdbmDBHandle(ThreadedGdbmDBHandle):
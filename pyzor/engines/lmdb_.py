@@ -0,0 +1,350 @@
+"""LMDB database engine."""
+
+import os
+import logging
+import datetime
+import functools
+import threading
+
+try:
+    import lmdb
+    _has_lmdb = True
+except ImportError:
+    lmdb = None
+    _has_lmdb = False
+
+from pyzor.engines.common import *
+
+# The environments inherited from the parent process. LMDB environments
+# must not be used at all after forking, not even closed, so they are kept
+# here to prevent them from being closed when they are garbage collected.
+_inherited_envs = []
+
+
+def safe_call(f):
+    """Decorator that wraps a method for handling database operations."""
+
+    def wrapped_f(self, *args, **kwargs):
+        try:
+            return f(self, *args, **kwargs)
+        except lmdb.Error as e:
+            self.log.error("LMDB error while calling %s: %s",
+                           f.__name__, e)
+            raise DatabaseError("Database temporarily unavailable.")
+
+    return wrapped_f
+
+
+def _encode_key(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode("utf8")
+
+
+class LMDBDBHandle(BaseEngine):
+    """Stores the records in a memory-mapped LMDB file.
+
+    Readers never block and don't need any locks, so the same database can
+    be used from several threads and processes at the same time. Writes are
+    serialized by LMDB, every report or whitelist request is applied in a
+    single write transaction.
+
+    Commits are not flushed to disk, instead the database is synced every
+    `sync_period` seconds. A crash of the server doesn't lose any data, but
+    a crash of the system loses the changes since the last sync.
+    """
+    absolute_source = True
+    handles_one_step = True
+
+    # The maximum size of the database file. This only reserves address
+    # space, the file grows as needed.
+    map_size = 2 ** 34  # 16 GiB
+    sync_period = 60
+    # Expired records are removed incrementally: every `expire_period`
+    # seconds the next `expire_batch_size` keys are checked, in a separate
+    # write transaction.
+    expire_period = 10
+    expire_batch_size = 1000
+    log = logging.getLogger("pyzord")
+
+    def __init__(self, fn, mode, max_age=None):
+        self.fn = fn
+        self.mode = mode
+        self.max_age = max_age
+        self.readonly = mode == "r"
+        self._open()
+        self.expire_timer = None
+        self.sync_timer = None
+        # The next key to check for expiry, None to start from the first key.
+        self._expire_cursor = None
+        self._expired = 0
+        self.start_expiring()
+        self.start_syncing()
+
+    def _open(self):
+        self.pid = os.getpid()
+        self._env = lmdb.open(self.fn, map_size=self.map_size, subdir=False,
+                              readonly=self.readonly,
+                              create=not self.readonly, sync=False,
+                              metasync=False, readahead=False,
+                              max_readers=1024)
+
+    @property
+    def env(self):
+        # LMDB environments cannot be used after forking, each process
+        # needs to open its own.
+        if self.pid != os.getpid():
+            _inherited_envs.append(self._env)
+            self._open()
+        return self._env
+
+    def __iter__(self):
+        with self.env.begin() as txn:
+            for key in txn.cursor().iternext(values=False):
+                yield key.decode("utf8")
+
+    def _iteritems(self):
+        with self.env.begin() as txn:
+            for key, value in txn.cursor():
+                key = key.decode("utf8")
+                try:
+                    yield key, unpack_record(value)
+                except Exception as e:
+                    self.log.warning("Invalid record %s: %s", key, e)
+
+    def iteritems(self):
+        return self._iteritems()
+
+    def items(self):
+        return list(self._iteritems())
+
+    @safe_call
+    def __getitem__(self, key):
+        with self.env.begin() as txn:
+            value = txn.get(_encode_key(key))
+        if value is None:
+            raise KeyError(key)
+        return unpack_record(value)
+
+    @safe_call
+    def get_many(self, keys):
+        with self.env.begin() as txn:
+            values = [txn.get(_encode_key(key)) for key in keys]
+        return [Record() if value is None else unpack_record(value)
+                for value in values]
+
+    @safe_call
+    def __setitem__(self, key, value):
+        with self.env.begin(write=True) as txn:
+            txn.put(_encode_key(key), pack_record(value))
+
+    @safe_call
+    def set_many(self, items):
+        with self.env.begin(write=True) as txn:
+            for key, value in items:
+                txn.put(_encode_key(key), pack_record(value))
+
+    @safe_call
+    def __delitem__(self, key):
+        with self.env.begin(write=True) as txn:
+            if not txn.delete(_encode_key(key)):
+                raise KeyError(key)
+
+    def _update(self, keys, update):
+        """Read, update and write back the records for these keys in a
+        single write transaction.
+        """
+        with self.env.begin(write=True) as txn:
+            for key in keys:
+                key = _encode_key(key)
+                value = txn.get(key)
+                record = Record() if value is None else unpack_record(value)
+                update(key, record)
+                txn.put(key, pack_record(record))
+
+    @safe_call
+    def increment_many(self, items):
+        deltas = dict((_encode_key(key), delta) for key, delta in items)
+        self._update(deltas, lambda key, record: record.add(deltas[key]))
+
+    @safe_call
+    def report(self, keys):
+        self._update(keys, lambda key, record: record.r_increment())
+
+    @safe_call
+    def whitelist(self, keys):
+        self._update(keys, lambda key, record: record.wl_increment())
+
+    def start_syncing(self):
+        if self.readonly:
+            return
+        try:
+            self.env.sync(True)
+        except lmdb.Error as e:
+            self.log.warning("Unable to sync the database: %s", e)
+        self.sync_timer = threading.Timer(self.sync_period,
+                                          self.start_syncing)
+        self.sync_timer.setDaemon(True)
+        self.sync_timer.start()
+
+    def start_expiring(self):
+        if not self.max_age or self.readonly:
+            return
+        try:
+            self._expire()
+        except lmdb.Error as e:
+            self.log.warning("Unable to expire records: %s", e)
+        self.expire_timer = threading.Timer(self.expire_period,
+                                            self.start_expiring)
+        self.expire_timer.setDaemon(True)
+        self.expire_timer.start()
+
+    def _expire(self):
+        """Check the next `expire_batch_size` keys, and delete the expired
+        records. Return True when all the keys have been checked.
+        """
+        oldest = datetime.datetime.now() - datetime.timedelta(
+            seconds=self.max_age)
+        expired = 0
+        with self.env.begin(write=True) as txn:
+            cursor = txn.cursor()
+            if self._expire_cursor is None:
+                found = cursor.first()
+            else:
+                found = cursor.set_range(self._expire_cursor)
+            for dummy in range(self.expire_batch_size):
+                if not found:
+                    break
+                try:
+                    record = unpack_record(cursor.value())
+                except Exception as e:
+                    self.log.warning("Invalid record %s: %s", cursor.key(), e)
+                    found = cursor.next()
+                    continue
+                if (record.r_updated is not None and
+                        record.r_updated < oldest):
+                    self.log.debug("deleting key %s", cursor.key())
+                    # Deleting moves the cursor to the next record, if
+                    # there is one.
+                    cursor.delete()
+                    found = bool(cursor.key())
+                    expired += 1
+                else:
+                    found = cursor.next()
+            self._expire_cursor = cursor.key() if found else None
+        self._expired += expired
+        if self._expire_cursor is None:
+            self.log.debug("expired %s records", self._expired)
+            self._expired = 0
+            return True
+        return False
+
+    @safe_call
+    def reorganize(self):
+        """Delete all the expired records. Every batch of keys is handled
+        in a separate transaction, so this doesn't block the readers or
+        keep the writers waiting for long.
+        """
+        if not self.max_age:
+            return
+        self._expire_cursor = None
+        while not self._expire():
+            pass
+
+    def close(self):
+        """Stop the timers, write the changes to disk and close the
+        database.
+        """
+        for timer in (self.expire_timer, self.sync_timer):
+            if timer is not None:
+                timer.cancel()
+        if self._env is not None and self.pid == os.getpid():
+            if not self.readonly:
+                self._env.sync(True)
+            self._env.close()
+
+    @classmethod
+    def get_prefork_connections(cls, fn, mode, max_age=None):
+        """Yields a number of database connections suitable for a Pyzor
+        pre-fork server.
+        """
+        # Only remove the expired records in the first child process.
+        yield functools.partial(cls, fn, mode, max_age=max_age)
+        while True:
+            yield functools.partial(cls, fn, mode, max_age=None)
+
+
+class ThreadedLMDBDBHandle(LMDBDBHandle):
+    """Like LMDBDBHandle, LMDB transactions are safe to use from multiple
+    threads without any locks.
+    """
+
+    def __init__(self, fn, mode, max_age=None, bound=None):
+        LMDBDBHandle.__init__(self, fn, mode, max_age=max_age)
+
+
+class ProcessLMDBDBHandle(LMDBDBHandle):
+    """Like LMDBDBHandle, but for a server that forks a new process for
+    each request. The environment inherited from the server cannot be used
+    by the children, and LMDB refuses to open the same environment again in
+    a process where it is still open. So the server only opens the
+    environment for the sync, the expiry and reorganize, and every child
+    opens its own.
+    """
+
+    def __init__(self, fn, mode, max_age=None):
+        self._env_lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # Don't fork while the server has the environment open.
+            os.register_at_fork(before=self._env_lock.acquire,
+                                after_in_parent=self._env_lock.release,
+                                after_in_child=self._env_lock.release)
+        LMDBDBHandle.__init__(self, fn, mode, max_age=max_age)
+
+    def _open(self):
+        # The environment is opened when it is first used.
+        self.pid = os.getpid()
+        self._env = None
+
+    @property
+    def env(self):
+        if self._env is not None and self.pid != os.getpid():
+            # Only if it was open while forking, see LMDBDBHandle.env.
+            _inherited_envs.append(self._env)
+            self._env = None
+        if self._env is None:
+            LMDBDBHandle._open(self)
+        return self._env
+
+    def _maintain(self, method):
+        """Call the method, and close the environment it opened so that it
+        isn't inherited by the children forked later.
+        """
+        with self._env_lock:
+            try:
+                return method(self)
+            finally:
+                if self._env is not None and self.pid == os.getpid():
+                    self._env.close()
+                    self._env = None
+
+    def start_syncing(self):
+        self._maintain(LMDBDBHandle.start_syncing)
+
+    def start_expiring(self):
+        self._maintain(LMDBDBHandle.start_expiring)
+
+    def reorganize(self):
+        self._maintain(LMDBDBHandle.reorganize)
+
+
+if not _has_lmdb:
+    handle = DBHandle(single_threaded=None,
+                      multi_threaded=None,
+                      multi_processing=None,
+                      prefork=None)
+else:
+    handle = DBHandle(single_threaded=LMDBDBHandle,
+                      multi_threaded=ThreadedLMDBDBHandle,
+                      multi_processing=ProcessLMDBDBHandle,
+                      prefork=LMDBDBHandle)
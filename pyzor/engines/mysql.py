@@ -6,11 +6,7 @@ import datetime
 import itertools
 import functools
 import threading
-
-try:
-    import Queue
-except ImportError:
-    import queue as Queue
+import collections
 
 try:
     import MySQLdb
@@ -21,6 +17,246 @@ except ImportError:
 
 from pyzor.engines.common import *
 
+# A free place in the pool, handed to a waiting thread that should open a
+# new connection.
+_NEW = object()
+
+
+class _Waiter(object):
+    """A thread waiting for a connection from the pool."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.db = None
+        self.used = None
+
+
+class ConnectionPool(object):
+    """A pool of database connections shared by the threads of a process.
+
+    At least `min_size` and at most `max_size` (None for no limit)
+    connections are kept open. A maintenance timer closes the connections
+    that were idle for more than `idle_timeout` seconds (0 closes them as
+    soon as they are released, None keeps them forever) and replaces the
+    broken connections. Connections that were not used in the last
+    `ping_after` seconds are pinged before being handed out.
+
+    When all the connections are in use the threads wait, for at most
+    `checkout_timeout` seconds, and are served in the order they asked. If
+    a connection cannot be opened no new attempt is made for the next
+    `retry_period` seconds.
+    """
+    maintenance_period = 30  # seconds
+    log = logging.getLogger("pyzord")
+
+    def __init__(self, connect, min_size=1, max_size=None, idle_timeout=300,
+                 ping_after=1, checkout_timeout=10, retry_period=60):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.checkout_timeout = checkout_timeout
+        self.retry_period = retry_period
+        self._lock = threading.Lock()
+        # (connection, last used) pairs, the most recently used last.
+        self._idle = []
+        self._waiters = collections.deque()
+        # The open connections, including the ones being opened.
+        self._size = 0
+        self._retry_after = 0
+        self._timer = None
+        self._closed = False
+        # Counters, see stats().
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.broken = 0
+        self.fill()
+        self._schedule_maintenance()
+
+    def acquire(self):
+        """Return a connection from the pool, waiting for one if needed.
+        The connection must be given back with release().
+        """
+        waiter = None
+        with self._lock:
+            self.checkouts += 1
+            if self._idle and not self._waiters:
+                db, used = self._idle.pop()
+            elif self.max_size is None or self._size < self.max_size:
+                self._size += 1
+                db, used = _NEW, None
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            db, used = self._wait(waiter)
+        if db is _NEW:
+            return self._open()
+        if time.time() - used > self.ping_after:
+            try:
+                db.ping()
+            except MySQLdb.Error as e:
+                self.log.warning("Replacing broken database connection: %s",
+                                 e)
+                self._close(db)
+                with self._lock:
+                    self.broken += 1
+                return self._open()
+        return db
+
+    def _wait(self, waiter):
+        start = time.time()
+        if not waiter.event.wait(self.checkout_timeout):
+            with self._lock:
+                # The connection might have been handed over just after
+                # the timeout.
+                if waiter.db is None:
+                    self._waiters.remove(waiter)
+                    self.timeouts += 1
+                    raise DatabaseError("Timed out waiting for a database "
+                                        "connection.")
+        elapsed = time.time() - start
+        with self._lock:
+            self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+        return waiter.db, waiter.used
+
+    def release(self, db, broken=False):
+        """Give back a connection, closing it if it is `broken`."""
+        if broken:
+            self._close(db)
+            with self._lock:
+                self.broken += 1
+            self._discard()
+            return
+        with self._lock:
+            if self._waiters:
+                self._hand_over(db)
+                return
+            if self.idle_timeout != 0 and not self._closed:
+                self._idle.append((db, time.time()))
+                return
+            self._size -= 1
+        self._close(db)
+
+    def _hand_over(self, db):
+        waiter = self._waiters.popleft()
+        waiter.db, waiter.used = db, time.time()
+        waiter.event.set()
+
+    def _discard(self, replace=True):
+        """Free the place of a connection that was closed, or could not be
+        opened. A new connection is opened in the background if there are
+        less than `min_size` and `replace` is true.
+        """
+        with self._lock:
+            if self._waiters:
+                self._hand_over(_NEW)
+                return
+            self._size -= 1
+            replace = (replace and not self._closed and
+                       self._size < self.min_size)
+        if replace:
+            timer = threading.Timer(0, self.fill)
+            timer.setDaemon(True)
+            timer.start()
+
+    def _open(self):
+        """Open a new connection, for a place already taken in the pool."""
+        try:
+            if time.time() < self._retry_after:
+                raise DatabaseError("Database temporarily unavailable.")
+            try:
+                db = self.connect()
+            except MySQLdb.Error:
+                self._retry_after = time.time() + self.retry_period
+                raise
+        except Exception:
+            self._discard(replace=False)
+            raise
+        with self._lock:
+            self.opened += 1
+        return db
+
+    def _close(self, db):
+        try:
+            db.close()
+        except MySQLdb.Error:
+            pass
+
+    def fill(self):
+        """Open connections until there are at least `min_size`."""
+        while True:
+            with self._lock:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                db = self._open()
+            except (MySQLdb.Error, DatabaseError) as e:
+                self.log.error("Unable to connect to database: %s", e)
+                return
+            self.release(db)
+
+    def _schedule_maintenance(self):
+        self._timer = threading.Timer(self.maintenance_period,
+                                      self._maintain)
+        self._timer.setDaemon(True)
+        self._timer.start()
+
+    def _maintain(self):
+        """Close the connections that were idle for too long, and open
+        new ones if there are less than `min_size`.
+        """
+        expired = []
+        with self._lock:
+            if self._closed:
+                return
+            if self.idle_timeout is not None:
+                oldest = time.time() - self.idle_timeout
+                while (self._idle and self._size > self.min_size and
+                       self._idle[0][1] < oldest):
+                    expired.append(self._idle.pop(0)[0])
+                    self._size -= 1
+        for db in expired:
+            self._close(db)
+        self.fill()
+        self.log.debug("Database connections: %s", self.stats())
+        self._schedule_maintenance()
+
+    def stats(self):
+        """Return the current size of the pool and its counters."""
+        with self._lock:
+            return {"size": self._size,
+                    "idle": len(self._idle),
+                    "waiting": len(self._waiters),
+                    "checkouts": self.checkouts,
+                    "waits": self.waits,
+                    "wait_time": self.wait_time,
+                    "max_wait_time": self.max_wait_time,
+                    "timeouts": self.timeouts,
+                    "opened": self.opened,
+                    "broken": self.broken}
+
+    def close(self):
+        """Close the idle connections, and the others when they are
+        released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+        if self._timer is not None:
+            self._timer.cancel()
+        for db, used in idle:
+            self._close(db)
+
 
 class MySQLDBHandle(BaseEngine):
     absolute_source = False
@@ -36,25 +272,42 @@ class MySQLDBHandle(BaseEngine):
     #   `wl_updated` datetime default NULL,
     #   PRIMARY KEY  (`digest`)
     #   )
-    # XXX Re-organising might be faster with a r_updated index.  However,
-    # XXX the re-organisation time isn't that important, and that would
-    # XXX (slightly) slow down all inserts, so we leave it for now.
+    # An index on `r_updated` is optional.  Without it the expired records
+    # are found by walking the primary key, a chunk at a time.  With it
+    # only the expired records are read, but all the updates are (slightly)
+    # slower.
+
+    # The connection pool, see ConnectionPool.  A single threaded server
+    # always uses the same connection.
+    pool_min_size = 1
+    pool_max_size = 1
+    pool_idle_timeout = None
     reorganize_period = 3600 * 24  # 1 day
+    # The expired records are deleted `expire_batch_size` rows at a time,
+    # with a pause between two chunks to let the replicas catch up.
+    expire_batch_size = 1000
+    expire_pause = 0.1  # seconds
     reconnect_period = 60  # seconds
     log = logging.getLogger("pyzord")
 
     def __init__(self, fn, mode, max_age=None):
         self.max_age = max_age
-        self.db = None
         # The 'fn' is host,user,password,db,table.  We ignore mode.
-        # We store the authentication details so that we can reconnect if
-        # necessary.
         self.host, self.user, self.passwd, self.db_name, \
             self.table_name = fn.split(",")
-        self.last_connect_attempt = 0  # We have never connected.
         self.reorganize_timer = None
-        self.reconnect()
-        self.start_reorganizing()
+        # The number of expired records deleted, and the time spent doing
+        # it, since the handle was created.
+        self.expired_count = 0
+        self.expire_time = 0.0
+        self.pool = ConnectionPool(self._get_new_connection,
+                                   min_size=self.pool_min_size,
+                                   max_size=self.pool_max_size,
+                                   idle_timeout=self.pool_idle_timeout,
+                                   retry_period=self.reconnect_period)
+        # The first expiry can take a while on a large table, so it is run
+        # in the background as well.
+        self._schedule_reorganizing(0)
 
     def _get_new_connection(self):
         """Returns a new db connection."""
@@ -63,31 +316,6 @@ class MySQLDBHandle(BaseEngine):
         db.autocommit(True)
         return db
 
-    def _check_reconnect_time(self):
-        if time.time() - self.last_connect_attempt < self.reconnect_period:
-            # Too soon to reconnect.
-            self.log.debug("Can't reconnect until %s",
-                           (time.ctime(self.last_connect_attempt +
-                                       self.reconnect_period)))
-            return False
-        return True
-
-    def reconnect(self):
-        if not self._check_reconnect_time():
-            return
-        if self.db:
-            try:
-                self.db.close()
-            except MySQLdb.Error:
-                pass
-        try:
-            self.db = self._get_new_connection()
-        except MySQLdb.Error as e:
-            self.log.error("Unable to connect to database: %s", e)
-            self.db = None
-        # Keep track of when we connected, so that we don't retry too often.
-        self.last_connect_attempt = time.time()
-
     def _iter(self, db):
         c = db.cursor(cursorclass=MySQLdb.cursors.SSCursor)
         c.execute("SELECT digest FROM %s" % self.table_name)
@@ -99,7 +327,7 @@ class MySQLDBHandle(BaseEngine):
         c.close()
 
     def __iter__(self):
-        return self._safe_call("iter", self._iter, ())
+        return self._safe_iter("iter", self._iter)
 
     def _iteritems(self, db):
         c = db.cursor(cursorclass=MySQLdb.cursors.SSCursor)
@@ -113,30 +341,58 @@ class MySQLDBHandle(BaseEngine):
         c.close()
 
     def iteritems(self):
-        return self._safe_call("iteritems", self._iteritems, ())
+        return self._safe_iter("iteritems", self._iteritems)
 
     def items(self):
-        return list(self._safe_call("iteritems", self._iteritems, ()))
+        return list(self._safe_iter("iteritems", self._iteritems))
 
     def __del__(self):
         """Close the database when the object is no longer needed."""
+        pool = getattr(self, "pool", None)
+        if pool is not None:
+            pool.close()
+
+    def _acquire(self, name):
         try:
-            if self.db:
-                self.db.close()
-        except MySQLdb.Error:
-            pass
+            return self.pool.acquire()
+        except MySQLdb.Error as ex:
+            self.log.error("%s failed: %s", name, ex)
+            raise DatabaseError("Database temporarily unavailable.")
 
     def _safe_call(self, name, method, args):
+        db = self._acquire(name)
+        broken = False
+        try:
+            return method(*args, db=db)
+        except (MySQLdb.Error, AttributeError) as ex:
+            self.log.error("%s failed: %s", name, ex)
+            # The connection is replaced in the background.  Retrying just
+            # complicates the logic - we don't really care if a single
+            # query fails (and it's possible that it would fail) on the
+            # second attempt anyway.  Any exceptions are caught by the
+            # server, and a 'nice' message provided to the caller.
+            broken = isinstance(ex, MySQLdb.Error)
+            raise DatabaseError("Database temporarily unavailable.")
+        finally:
+            # The connection is also returned on other errors, for example
+            # the KeyError of a missing digest.
+            self.pool.release(db, broken)
+
+    def _safe_iter(self, name, method):
+        """Like _safe_call, but the connection is kept until the iteration
+        is finished.
+        """
+        db = self._acquire(name)
+        broken = False
         try:
-            return method(*args, db=self.db)
+            for item in method(db=db):
+                yield item
         except (MySQLdb.Error, AttributeError) as ex:
             self.log.error("%s failed: %s", name, ex)
-            self.reconnect()
-            # Retrying just complicates the logic - we don't really care if
-            # a single query fails (and it's possible that it would fail)
-            # on the second attempt anyway.  Any exceptions are caught by
-            # the server, and a 'nice' message provided to the caller.
+            broken = isinstance(ex, MySQLdb.Error)
             raise DatabaseError("Database temporarily unavailable.")
+        finally:
+            self.pool.release(db, broken)
 
     def report(self, keys):
         return self._safe_call("report", self._report, (keys,))
@@ -147,13 +403,23 @@ class MySQLDBHandle(BaseEngine):
     def __getitem__(self, key):
         return self._safe_call("getitem", self._really__getitem__, (key,))
 
+    def get_many(self, keys):
+        return self._safe_call("get_many", self._get_many, (keys,))
+
     def __setitem__(self, key, value):
         return self._safe_call("setitem", self._really__setitem__,
                                (key, value))
 
+    def set_many(self, items):
+        return self._safe_call("set_many", self._set_many, (items,))
+
     def __delitem__(self, key):
         return self._safe_call("delitem", self._really__delitem__, (key,))
 
+    def increment_many(self, items):
+        return self._safe_call("increment_many", self._increment_many,
+                               (items,))
+
     def _report(self, keys, db=None):
         c = db.cursor()
         try:
@@ -195,6 +461,23 @@ class MySQLDBHandle(BaseEngine):
         finally:
             c.close()
 
+    def _get_many(self, keys, db=None):
+        """get_many without the exception handling."""
+        if not keys:
+            return []
+        c = db.cursor()
+        try:
+            c.execute("SELECT digest, r_count, wl_count, r_entered, "
+                      "r_updated, wl_entered, wl_updated FROM %s WHERE "
+                      "digest IN (%s)" % (self.table_name,
+                                          ", ".join(["%s"] * len(keys))),
+                      tuple(keys))
+            records = dict((row[0], Record(*row[1:]))
+                           for row in c.fetchall())
+        finally:
+            c.close()
+        return [records.get(key) or Record() for key in keys]
+
     def _really__setitem__(self, key, value, db=None):
         """__setitem__ without the exception handling."""
         c = db.cursor()
@@ -212,6 +495,53 @@ class MySQLDBHandle(BaseEngine):
         finally:
             c.close()
 
+    def _set_many(self, items, db=None):
+        """set_many without the exception handling."""
+        rows = [(key, value.r_count, value.wl_count, value.r_entered,
+                 value.r_updated, value.wl_entered, value.wl_updated)
+                for key, value in items]
+        if not rows:
+            return
+        c = db.cursor()
+        try:
+            c.executemany("INSERT INTO %s (digest, r_count, wl_count, "
+                          "r_entered, r_updated, wl_entered, wl_updated) "
+                          "VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s) ON "
+                          "DUPLICATE KEY UPDATE r_count=VALUES(r_count), "
+                          "wl_count=VALUES(wl_count), "
+                          "r_entered=VALUES(r_entered), "
+                          "r_updated=VALUES(r_updated), "
+                          "wl_entered=VALUES(wl_entered), "
+                          "wl_updated=VALUES(wl_updated)" % self.table_name,
+                          rows)
+        finally:
+            c.close()
+
+    def _increment_many(self, items, db=None):
+        """increment_many without the exception handling."""
+        rows = [(key, delta.r_count, delta.wl_count, delta.r_entered,
+                 delta.r_updated, delta.wl_entered, delta.wl_updated)
+                for key, delta in items]
+        if not rows:
+            return
+        c = db.cursor()
+        try:
+            c.executemany("INSERT INTO %s (digest, r_count, wl_count, "
+                          "r_entered, r_updated, wl_entered, wl_updated) "
+                          "VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s) ON "
+                          "DUPLICATE KEY UPDATE "
+                          "r_count=r_count+VALUES(r_count), "
+                          "wl_count=wl_count+VALUES(wl_count), "
+                          "r_entered=IFNULL(r_entered, VALUES(r_entered)), "
+                          "r_updated=IF(VALUES(r_count), VALUES(r_updated), "
+                          "r_updated), "
+                          "wl_entered=IFNULL(wl_entered, VALUES(wl_entered)), "
+                          "wl_updated=IF(VALUES(wl_count), "
+                          "VALUES(wl_updated), wl_updated)" % self.table_name,
+                          rows)
+        finally:
+            c.close()
+
     def _really__delitem__(self, key, db=None):
         """__delitem__ without the exception handling."""
         c = db.cursor()
@@ -221,26 +551,137 @@ class MySQLDBHandle(BaseEngine):
         finally:
             c.close()
 
+    def replication_lag(self):
+        """Return the number of seconds this database is behind its
+        primary, 0 if it is not a replica and None if the replication is
+        not running.
+        """
+        return self._safe_call("replication_lag", self._replication_lag, ())
+
+    def _replication_lag(self, db=None):
+        c = db.cursor()
+        try:
+            try:
+                c.execute("SHOW REPLICA STATUS")
+            except MySQLdb.Error:
+                # Before MySQL 8.0.22.
+                c.execute("SHOW SLAVE STATUS")
+            row = c.fetchone()
+            if not row:
+                return 0
+            status = dict(zip([column[0] for column in c.description], row))
+        finally:
+            c.close()
+        if "Seconds_Behind_Source" in status:
+            return status["Seconds_Behind_Source"]
+        return status.get("Seconds_Behind_Master")
+
+    def _schedule_reorganizing(self, delay):
+        if not self.max_age:
+            return
+        self.reorganize_timer = threading.Timer(delay,
+                                                self.start_reorganizing)
+        self.reorganize_timer.setDaemon(True)
+        self.reorganize_timer.start()
+
     def start_reorganizing(self):
         if not self.max_age:
             return
         self.log.debug("reorganizing the database")
+        try:
+            self.expire()
+        finally:
+            self._schedule_reorganizing(self.reorganize_period)
+
+    def expire(self):
+        """Delete the records that were not reported in the last `max_age`
+        seconds, in chunks of `expire_batch_size` rows. Returns the number
+        of deleted records.
+        """
         breakpoint = (datetime.datetime.now() -
                       datetime.timedelta(seconds=self.max_age))
-        db = self._get_new_connection()
-        c = db.cursor()
+        start = time.time()
+        deleted = 0
+        db = None
         try:
-            c.execute("DELETE FROM %s WHERE r_updated<%%s" %
-                      self.table_name, (breakpoint,))
+            db = self._get_new_connection()
+            c = db.cursor()
+            try:
+                if self._has_r_updated_index(c):
+                    chunks = self._expire_indexed(c, breakpoint)
+                else:
+                    chunks = self._expire_by_key(c, breakpoint)
+                for count in chunks:
+                    deleted += count
+                    # Each chunk is committed on its own, give the other
+                    # queries (and the replicas) a chance to catch up.
+                    time.sleep(self.expire_pause)
+            finally:
+                c.close()
         except (MySQLdb.Error, AttributeError) as e:
             self.log.warn("Unable to reorganise: %s", e)
         finally:
-            c.close()
-            db.close()
-        self.reorganize_timer = threading.Timer(self.reorganize_period,
-                                                self.start_reorganizing)
-        self.reorganize_timer.setDaemon(True)
-        self.reorganize_timer.start()
+            if db is not None:
+                db.close()
+        elapsed = time.time() - start
+        self.expired_count += deleted
+        self.expire_time += elapsed
+        self.log.info("Expired %s records in %.1f seconds (%s records in "
+                      "%.1f seconds in total)", deleted, elapsed,
+                      self.expired_count, self.expire_time)
+        return deleted
+
+    def _has_r_updated_index(self, c):
+        c.execute("SHOW INDEX FROM %s WHERE Column_name='r_updated' AND "
+                  "Seq_in_index=1" % self.table_name)
+        return bool(c.fetchall())
+
+    def _expire_by_key(self, c, breakpoint):
+        """Walk the primary key and delete the expired records from each
+        chunk of `expire_batch_size` digests. Yields the number of records
+        deleted from every chunk.
+        """
+        last = ""
+        while True:
+            # The upper bound of the chunk is found using only the primary
+            # key, and the delete only locks the rows in the chunk.
+            c.execute("SELECT digest FROM %s WHERE digest>%%s ORDER BY "
+                      "digest LIMIT %d, 1" % (self.table_name,
+                                              self.expire_batch_size - 1),
+                      (last,))
+            row = c.fetchone()
+            if row is None:
+                c.execute("DELETE FROM %s WHERE digest>%%s AND "
+                          "r_updated<%%s" % self.table_name,
+                          (last, breakpoint))
+                yield c.rowcount
+                return
+            c.execute("DELETE FROM %s WHERE digest>%%s AND digest<=%%s AND "
+                      "r_updated<%%s" % self.table_name,
+                      (last, row[0], breakpoint))
+            yield c.rowcount
+            last = row[0]
+
+    def _expire_indexed(self, c, breakpoint):
+        """Find the expired records with the `r_updated` index and delete
+        them by primary key, `expire_batch_size` at a time. Yields the
+        number of records deleted from every chunk.
+        """
+        while True:
+            c.execute("SELECT digest FROM %s WHERE r_updated<%%s LIMIT %d" %
+                      (self.table_name, self.expire_batch_size),
+                      (breakpoint,))
+            keys = [row[0] for row in c.fetchall()]
+            if not keys:
+                return
+            # The record might have been reported since it was selected.
+            c.execute("DELETE FROM %s WHERE digest IN (%s) AND "
+                      "r_updated<%%s" % (self.table_name,
+                                         ", ".join(["%s"] * len(keys))),
+                      tuple(keys) + (breakpoint,))
+            yield c.rowcount
+            if len(keys) < self.expire_batch_size:
+                return
 
     @classmethod
     def get_prefork_connections(cls, fn, mode, max_age=None):
@@ -254,90 +695,27 @@ class MySQLDBHandle(BaseEngine):
 
 
 class ThreadedMySQLDBHandle(MySQLDBHandle):
+    # Without a bound the pool grows with the number of threads, and the
+    # connections that are not needed any more are closed after a while.
+    pool_max_size = None
+    pool_idle_timeout = 300
+
     def __init__(self, fn, mode, max_age=None, bound=None):
         self.bound = bound
         if self.bound:
-            self.db_queue = Queue.Queue()
+            self.pool_min_size = self.pool_max_size = self.bound
         MySQLDBHandle.__init__(self, fn, mode, max_age=max_age)
 
-    def _get_connection(self):
-        if self.bound:
-            return self.db_queue.get()
-        else:
-            return self._get_new_connection()
-
-    def _release_connection(self, db):
-        if self.bound:
-            self.db_queue.put(db)
-        else:
-            db.close()
-
-    def _safe_call(self, name, method, args):
-        db = self._get_connection()
-        try:
-            return method(*args, db=db)
-        except (MySQLdb.Error, AttributeError) as ex:
-            self.log.error("%s failed: %s", name, ex)
-            if not self.bound:
-                raise DatabaseError("Database temporarily unavailable.")
-            try:
-                # Connection might be timeout, ping and retry
-                db.ping(True)
-                return method(*args, db=db)
-            except (MySQLdb.Error, AttributeError) as ex:
-                # attempt a new connection, if we can retry
-                db = self._reconnect(db)
-                raise DatabaseError("Database temporarily unavailable.")
-        finally:
-            self._release_connection(db)
-
-    def reconnect(self):
-        if not self.bound:
-            return
-        for _ in range(self.bound):
-            self.db_queue.put(self._get_new_connection())
-
-    def _reconnect(self, db):
-        if not self._check_reconnect_time():
-            return db
-        else:
-            self.last_connect_attempt = time.time()
-            return self._get_new_connection()
-
-    def __del__(self):
-        if not self.bound:
-            return
-        for db in iter(self.db_queue.get_nowait):
-            try:
-                db.close()
-            except MySQLdb.Error:
-                continue
-            except Queue.Empty:
-                break
-
 
 class ProcessMySQLDBHandle(MySQLDBHandle):
+    # Every request is handled in a new process, so the connections cannot
+    # be reused.  They are opened when needed and closed when released.
+    pool_min_size = 0
+    pool_idle_timeout = 0
+
     def __init__(self, fn, mode, max_age=None):
         MySQLDBHandle.__init__(self, fn, mode, max_age=max_age)
 
-    def reconnect(self):
-        pass
-
-    def __del__(self):
-        pass
-
-    def _safe_call(self, name, method, args):
-        db = None
-        try:
-            db = self._get_new_connection()
-            return method(*args, db=db)
-        except (MySQLdb.Error, AttributeError) as ex:
-            self.log.error("%s failed: %s", name, ex)
-            raise DatabaseError("Database temporarily unavailable.")
-        finally:
-            if db is not None:
-                db.close()
-
 if not _has_mysql:
     handle = DBHandle(single_threaded=None,
                       multi_threaded=None,
@@ -123,6 +123,13 @@ class RedisDBHandle(BaseEngine):
     def __getitem__(self, key):
         return self._decode_record(self.db.hgetall(self._real_key(key)))
 
+    @safe_call
+    def get_many(self, keys):
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(self._real_key(key))
+        return [self._decode_record(r) for r in pipe.execute()]
+
     @safe_call
     def __setitem__(self, key, value):
         real_key = self._real_key(key)
@@ -130,31 +137,75 @@ class RedisDBHandle(BaseEngine):
         if self.max_age is not None:
             self.db.expire(real_key, self.max_age)
 
+    @safe_call
+    def set_many(self, items):
+        pipe = self.db.pipeline(transaction=False)
+        for key, value in items:
+            real_key = self._real_key(key)
+            pipe.hmset(real_key, self._encode_record(value))
+            if self.max_age is not None:
+                pipe.expire(real_key, self.max_age)
+        pipe.execute()
+
     @safe_call
     def __delitem__(self, key):
         self.db.delete(self._real_key(key))
 
-    @safe_call
-    def report(self, keys):
+    def _increment(self, keys, prefix):
+        """Increment the count and set the timestamps for all the keys in a
+        single round-trip.
+        """
         now = int(time.time())
+        pipe = self.db.pipeline(transaction=False)
         for key in keys:
             real_key = self._real_key(key)
-            self.db.hincrby(real_key, "r_count")
-            self.db.hsetnx(real_key, "r_entered", now)
-            self.db.hset(real_key, "r_updated", now)
+            pipe.hincrby(real_key, "%s_count" % prefix)
+            pipe.hsetnx(real_key, "%s_entered" % prefix, now)
+            pipe.hset(real_key, "%s_updated" % prefix, now)
             if self.max_age:
-                self.db.expire(real_key, self.max_age)
+                pipe.expire(real_key, self.max_age)
+        pipe.execute()
 
     @safe_call
-    def whitelist(self, keys):
-        now = int(time.time())
-        for key in keys:
+    def increment_many(self, items):
+        pipe = self.db.pipeline(transaction=False)
+        for key, delta in items:
             real_key = self._real_key(key)
-            self.db.hincrby(real_key, "wl_count")
-            self.db.hsetnx(real_key, "wl_entered", now)
-            self.db.hset(real_key, "wl_updated", now)
+            for prefix in ("r", "wl"):
+                count = getattr(delta, "%s_count" % prefix)
+                if not count:
+                    continue
+                entered = getattr(delta, "%s_entered" % prefix)
+                updated = getattr(delta, "%s_updated" % prefix)
+                pipe.hincrby(real_key, "%s_count" % prefix, count)
+                pipe.hsetnx(real_key, "%s_entered" % prefix,
+                            encode_date(entered))
+                pipe.hset(real_key, "%s_updated" % prefix,
+                          encode_date(updated))
             if self.max_age:
-                self.db.expire(real_key, self.max_age)
+                pipe.expire(real_key, self.max_age)
+        pipe.execute()
+
+    @safe_call
+    def report(self, keys):
+        self._increment(keys, "r")
+
+    @safe_call
+    def whitelist(self, keys):
+        self._increment(keys, "wl")
+
+    @safe_call
+    def replication_lag(self):
+        """Return the number of seconds since this replica last heard from
+        its primary, 0 if it is not a replica and None if the link with the
+        primary is down.
+        """
+        info = self.db.info("replication")
+        if info.get("role") != "slave":
+            return 0
+        if info.get("master_link_status") != "up":
+            return None
+        return int(info.get("master_last_io_seconds_ago", 0))
 
     @classmethod
     def get_prefork_connections(cls, fn, mode, max_age=None):
@@ -0,0 +1,165 @@
+"""Route the reads to read replicas of the database, for the engines that
+support it.
+"""
+
+import time
+import logging
+import threading
+
+from pyzor.engines.common import BaseEngine, DatabaseError
+
+__all__ = ["ReplicatedDBHandle"]
+
+
+class ReplicatedDBHandle(BaseEngine):
+    """Wraps an engine and serves __getitem__ and get_many from a number of
+    read replicas of its database, in turn. Everything else, including all
+    the writes, goes to the primary `engine`.
+
+    The replicas must be handles of the same engine, that implement
+    ``replication_lag()``. The lag of every replica is checked every
+    `check_period` seconds, and the replicas that are more than `max_lag`
+    seconds behind, or whose lag is unknown, are not used until they catch
+    up (0 disables the check). The first check is run in the background as
+    well, and the replicas are only used once it is done. A replica that
+    fails is skipped for
+    `retry_period` seconds and the read is retried on the next one, and
+    finally on the primary.
+    """
+    check_period = 5  # seconds
+    retry_period = 30  # seconds
+    log = logging.getLogger("pyzord")
+
+    def __init__(self, engine, replicas, max_lag=30):
+        self.engine = engine
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.absolute_source = engine.absolute_source
+        self.handles_one_step = engine.handles_one_step
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._next = 0
+        # The lag is unknown until the first check.
+        self._stale = [bool(max_lag)] * len(self.replicas)
+        # The time until which each replica should not be used, after
+        # failing.
+        self._failed_until = [0] * len(self.replicas)
+        self._timer = None
+        if self.max_lag:
+            # A slow replica must not delay the start of the server.
+            self._schedule_check(0)
+
+    def __getattr__(self, name):
+        if name == "engine":
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def __iter__(self):
+        return iter(self.engine)
+
+    def iteritems(self):
+        return self.engine.iteritems()
+
+    def items(self):
+        return self.engine.items()
+
+    def _schedule_check(self, delay):
+        self._timer = threading.Timer(delay, self.check_replicas)
+        self._timer.setDaemon(True)
+        self._timer.start()
+
+    def check_replicas(self):
+        """Check the replication lag of all the replicas, and schedule the
+        next check.
+        """
+        try:
+            for i, replica in enumerate(self.replicas):
+                try:
+                    lag = replica.replication_lag()
+                except DatabaseError:
+                    lag = None
+                except Exception as e:
+                    self.log.error("Unable to check read replica %s: %s", i,
+                                   e, exc_info=True)
+                    lag = None
+                stale = lag is None or lag > self.max_lag
+                if stale != self._stale[i]:
+                    if stale:
+                        self.log.warning("Not using read replica %s, "
+                                         "replication lag: %s", i, lag)
+                    else:
+                        self.log.info("Using read replica %s, "
+                                      "replication lag: %s", i, lag)
+                with self._lock:
+                    self._stale[i] = stale
+        except Exception as e:
+            # The checks must go on, whatever happens.
+            self.log.error("Unable to check the read replicas: %s", e,
+                           exc_info=True)
+        finally:
+            self._schedule_check(self.check_period)
+
+    def _available(self):
+        """Return the replicas that can be used, starting with the next
+        one in turn.
+        """
+        now = time.time()
+        with self._lock:
+            count = len(self.replicas)
+            start = self._next
+            self._next = (start + 1) % count
+            return [i for i in ((start + j) % count for j in range(count))
+                    if not self._stale[i] and self._failed_until[i] <= now]
+
+    def _read(self, name, *args):
+        for i in self._available():
+            try:
+                result = getattr(self.replicas[i], name)(*args)
+            except DatabaseError:
+                # The error was already logged by the engine.
+                with self._lock:
+                    self._failed_until[i] = time.time() + self.retry_period
+                    self.failovers += 1
+                continue
+            with self._lock:
+                self.replica_reads += 1
+            return result
+        with self._lock:
+            self.primary_reads += 1
+        return getattr(self.engine, name)(*args)
+
+    def __getitem__(self, key):
+        # A KeyError from a replica is an answer, and is not retried.
+        return self._read("__getitem__", key)
+
+    def get_many(self, keys):
+        return self._read("get_many", keys)
+
+    def __setitem__(self, key, value):
+        self.engine[key] = value
+
+    def set_many(self, items):
+        self.engine.set_many(items)
+
+    def __delitem__(self, key):
+        del self.engine[key]
+
+    def increment_many(self, items):
+        self.engine.increment_many(items)
+
+    def report(self, keys):
+        self.engine.report(keys)
+
+    def whitelist(self, keys):
+        self.engine.whitelist(keys)
+
+    def close(self):
+        """Stop checking the replicas, and close all the handles."""
+        if self._timer is not None:
+            self._timer.cancel()
+        for handle in [self.engine] + self.replicas:
+            close = getattr(handle, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,414 @@
+"""SQLite database engine."""
+
+import logging
+import datetime
+import functools
+import threading
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+try:
+    import sqlite3
+    # UPSERT is only available since SQLite 3.24.
+    _has_sqlite = sqlite3.sqlite_version_info >= (3, 24, 0)
+except ImportError:
+    _has_sqlite = False
+
+from pyzor.engines.common import *
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_date(date):
+    """Convert the date to microseconds since the epoch."""
+    if date is None:
+        return None
+    delta = date - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def decode_date(stamp):
+    """Return a datetime object from microseconds since the epoch."""
+    if stamp is None:
+        return None
+    return _EPOCH + datetime.timedelta(microseconds=stamp)
+
+
+def _decode_row(row):
+    """Return a Record from a (r_count, wl_count, r_entered, r_updated,
+    wl_entered, wl_updated) row.
+    """
+    return Record(row[0], row[1], decode_date(row[2]), decode_date(row[3]),
+                  decode_date(row[4]), decode_date(row[5]))
+
+
+class SQLiteDBHandle(BaseEngine):
+    """Stores the records in a SQLite database file, with the same columns
+    as the MySQL engine. The table is created if it doesn't exist, the
+    timestamps are stored as microseconds since the epoch.
+
+    The database uses write-ahead logging, so reads are never blocked by
+    writes, even from other processes.
+    """
+    absolute_source = True
+    handles_one_step = True
+    table_name = "digests"
+    schema = ("CREATE TABLE IF NOT EXISTS %(table)s ("
+              "digest TEXT PRIMARY KEY NOT NULL, "
+              "r_count INTEGER NOT NULL DEFAULT 0, "
+              "wl_count INTEGER NOT NULL DEFAULT 0, "
+              "r_entered INTEGER, "
+              "wl_entered INTEGER, "
+              "r_updated INTEGER, "
+              "wl_updated INTEGER"
+              ") WITHOUT ROWID",
+              "CREATE INDEX IF NOT EXISTS %(table)s_r_updated "
+              "ON %(table)s (r_updated)")
+    reorganize_period = 3600 * 24  # 1 day
+    # Expired records are deleted in batches of this size, each in its own
+    # transaction, so that the writers are not blocked for long.
+    expire_batch_size = 1000
+    # The number of seconds to wait for a lock held by another connection.
+    busy_timeout = 10
+    # The maximum number of parameters in a query.
+    max_variables = 500
+    log = logging.getLogger("pyzord")
+
+    def __init__(self, fn, mode, max_age=None):
+        self.fn = fn
+        self.readonly = mode == "r"
+        self.max_age = max_age
+        self.reorganize_timer = None
+        self.db = None
+        db = self._get_new_connection()
+        if not self.readonly:
+            db.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                db.execute(statement % {"table": self.table_name})
+        self.db = db
+        self.start_reorganizing()
+
+    def _get_new_connection(self):
+        """Returns a new db connection."""
+        db = sqlite3.connect(self.fn, timeout=self.busy_timeout,
+                             isolation_level=None, check_same_thread=False,
+                             cached_statements=256)
+        # Safe with write-ahead logging, the changes are only synced to
+        # disk on checkpoints.
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _get_connection(self):
+        return self.db
+
+    def _release_connection(self, db):
+        pass
+
+    def _safe_call(self, name, method, args):
+        try:
+            db = self._get_connection()
+        except sqlite3.Error as ex:
+            self.log.error("%s failed: %s", name, ex)
+            raise DatabaseError("Database temporarily unavailable.")
+        try:
+            return method(*args, db=db)
+        except sqlite3.Error as ex:
+            self.log.error("%s failed: %s", name, ex)
+            raise DatabaseError("Database temporarily unavailable.")
+        finally:
+            self._release_connection(db)
+
+    def _maintenance_call(self, name, method):
+        """Run the method on a separate short-lived connection, as it is
+        called from the timer and the signal threads, while the request
+        thread might be using the shared connection.
+        """
+        try:
+            db = self._get_new_connection()
+        except sqlite3.Error as ex:
+            self.log.error("%s failed: %s", name, ex)
+            raise DatabaseError("Database temporarily unavailable.")
+        try:
+            return method(db=db)
+        except sqlite3.Error as ex:
+            self.log.error("%s failed: %s", name, ex)
+            raise DatabaseError("Database temporarily unavailable.")
+        finally:
+            db.close()
+
+    def _write(self, db, query, rows):
+        """Run the query for all the rows in a single transaction."""
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(query, rows)
+        except Exception:
+            # SQLite might have already rolled back the transaction.
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _rows(self, query):
+        # A separate connection is used, so that the other connections are
+        # not kept busy while iterating.
+        db = self._get_new_connection()
+        try:
+            for row in db.execute(query):
+                yield row
+        except sqlite3.Error as ex:
+            self.log.error("iteration failed: %s", ex)
+            raise DatabaseError("Database temporarily unavailable.")
+        finally:
+            db.close()
+
+    def __iter__(self):
+        for row in self._rows("SELECT digest FROM %s" % self.table_name):
+            yield row[0]
+
+    def _iteritems(self):
+        for row in self._rows("SELECT digest, r_count, wl_count, r_entered, "
+                              "r_updated, wl_entered, wl_updated FROM %s" %
+                              self.table_name):
+            yield row[0], _decode_row(row[1:])
+
+    def iteritems(self):
+        return self._iteritems()
+
+    def items(self):
+        return list(self._iteritems())
+
+    def report(self, keys):
+        return self._safe_call("report", self._report, (keys,))
+
+    def whitelist(self, keys):
+        return self._safe_call("whitelist", self._whitelist, (keys,))
+
+    def __getitem__(self, key):
+        return self._safe_call("getitem", self._really__getitem__, (key,))
+
+    def get_many(self, keys):
+        return self._safe_call("get_many", self._get_many, (keys,))
+
+    def __setitem__(self, key, value):
+        return self._safe_call("setitem", self._set_many, ([(key, value)],))
+
+    def set_many(self, items):
+        return self._safe_call("set_many", self._set_many, (items,))
+
+    def __delitem__(self, key):
+        return self._safe_call("delitem", self._really__delitem__, (key,))
+
+    def increment_many(self, items):
+        return self._safe_call("increment_many", self._increment_many,
+                               (items,))
+
+    def _report(self, keys, db=None):
+        now = encode_date(datetime.datetime.now())
+        self._write(db, "INSERT INTO %s (digest, r_count, wl_count, "
+                        "r_entered, r_updated) VALUES (?, 1, 0, ?, ?) "
+                        "ON CONFLICT (digest) DO UPDATE SET "
+                        "r_count=r_count+1, "
+                        "r_entered=IFNULL(r_entered, excluded.r_entered), "
+                        "r_updated=excluded.r_updated" % self.table_name,
+                    [(key, now, now) for key in keys])
+
+    def _whitelist(self, keys, db=None):
+        now = encode_date(datetime.datetime.now())
+        self._write(db, "INSERT INTO %s (digest, r_count, wl_count, "
+                        "wl_entered, wl_updated) VALUES (?, 0, 1, ?, ?) "
+                        "ON CONFLICT (digest) DO UPDATE SET "
+                        "wl_count=wl_count+1, "
+                        "wl_entered=IFNULL(wl_entered, excluded.wl_entered), "
+                        "wl_updated=excluded.wl_updated" % self.table_name,
+                    [(key, now, now) for key in keys])
+
+    def _really__getitem__(self, key, db=None):
+        """__getitem__ without the exception handling."""
+        row = db.execute("SELECT r_count, wl_count, r_entered, r_updated, "
+                         "wl_entered, wl_updated FROM %s WHERE digest=?" %
+                         self.table_name, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _decode_row(row)
+
+    def _get_many(self, keys, db=None):
+        """get_many without the exception handling."""
+        records = {}
+        for start in range(0, len(keys), self.max_variables):
+            chunk = keys[start:start + self.max_variables]
+            for row in db.execute("SELECT digest, r_count, wl_count, "
+                                  "r_entered, r_updated, wl_entered, "
+                                  "wl_updated FROM %s WHERE digest IN (%s)" %
+                                  (self.table_name,
+                                   ", ".join(["?"] * len(chunk))),
+                                  tuple(chunk)):
+                records[row[0]] = _decode_row(row[1:])
+        return [records.get(key) or Record() for key in keys]
+
+    def _set_many(self, items, db=None):
+        """set_many without the exception handling."""
+        rows = [(key, value.r_count, value.wl_count,
+                 encode_date(value.r_entered), encode_date(value.r_updated),
+                 encode_date(value.wl_entered), encode_date(value.wl_updated))
+                for key, value in items]
+        self._write(db, "INSERT OR REPLACE INTO %s (digest, r_count, "
+                        "wl_count, r_entered, r_updated, wl_entered, "
+                        "wl_updated) VALUES (?, ?, ?, ?, ?, ?, ?)" %
+                        self.table_name, rows)
+
+    def _increment_many(self, items, db=None):
+        """increment_many without the exception handling."""
+        rows = [(key, delta.r_count, delta.wl_count,
+                 encode_date(delta.r_entered), encode_date(delta.r_updated),
+                 encode_date(delta.wl_entered), encode_date(delta.wl_updated))
+                for key, delta in items]
+        self._write(db, "INSERT INTO %s (digest, r_count, wl_count, "
+                        "r_entered, r_updated, wl_entered, wl_updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (digest) DO UPDATE SET "
+                        "r_count=r_count+excluded.r_count, "
+                        "wl_count=wl_count+excluded.wl_count, "
+                        "r_entered=IFNULL(r_entered, excluded.r_entered), "
+                        "r_updated=CASE WHEN excluded.r_count "
+                        "THEN excluded.r_updated ELSE r_updated END, "
+                        "wl_entered=IFNULL(wl_entered, excluded.wl_entered), "
+                        "wl_updated=CASE WHEN excluded.wl_count "
+                        "THEN excluded.wl_updated ELSE wl_updated END" %
+                        self.table_name, rows)
+
+    def _really__delitem__(self, key, db=None):
+        """__delitem__ without the exception handling."""
+        c = db.execute("DELETE FROM %s WHERE digest=?" % self.table_name,
+                       (key,))
+        if not c.rowcount:
+            raise KeyError(key)
+
+    def _expire(self, db=None):
+        """Delete the expired records, a batch at a time."""
+        oldest = encode_date(datetime.datetime.now() -
+                             datetime.timedelta(seconds=self.max_age))
+        expired = 0
+        while True:
+            c = db.execute("DELETE FROM %s WHERE digest IN (SELECT digest "
+                           "FROM %s WHERE r_updated<? LIMIT ?)" %
+                           (self.table_name, self.table_name),
+                           (oldest, self.expire_batch_size))
+            expired += c.rowcount
+            if c.rowcount < self.expire_batch_size:
+                break
+        self.log.debug("expired %s records", expired)
+
+    def start_reorganizing(self):
+        if not self.max_age or self.readonly:
+            return
+        self.log.debug("reorganizing the database")
+        try:
+            self._maintenance_call("reorganize", self._expire)
+        except DatabaseError as e:
+            self.log.warning("Unable to reorganise: %s", e)
+        self.reorganize_timer = threading.Timer(self.reorganize_period,
+                                                self.start_reorganizing)
+        self.reorganize_timer.setDaemon(True)
+        self.reorganize_timer.start()
+
+    def _reorganize(self, db=None):
+        if self.max_age:
+            self._expire(db=db)
+        db.execute("VACUUM")
+
+    def reorganize(self):
+        """Delete all the expired records and compact the database file.
+
+        Writes are blocked until this completes.
+        """
+        return self._maintenance_call("reorganize", self._reorganize)
+
+    def close(self):
+        """Stop the timer and close the connections."""
+        if self.reorganize_timer is not None:
+            self.reorganize_timer.cancel()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    @classmethod
+    def get_prefork_connections(cls, fn, mode, max_age=None):
+        """Yields a number of database connections suitable for a Pyzor
+        pre-fork server.
+        """
+        # Only run the reorganize timer in the first child process.
+        yield functools.partial(cls, fn, mode, max_age=max_age)
+        while True:
+            yield functools.partial(cls, fn, mode, max_age=None)
+
+
+class ThreadedSQLiteDBHandle(SQLiteDBHandle):
+    """Like SQLiteDBHandle, but every thread takes a connection from a pool
+    for each call. If `bound` is set at most that many connections are
+    opened, and the threads wait for a free one.
+    """
+
+    def __init__(self, fn, mode, max_age=None, bound=None):
+        self.bound = bound
+        # The most recently used connections are reused first, so that the
+        # idle ones stay idle.
+        self.pool = Queue.LifoQueue()
+        self.pool_lock = threading.Lock()
+        self.connections = 0
+        SQLiteDBHandle.__init__(self, fn, mode, max_age=max_age)
+
+    def _get_connection(self):
+        try:
+            return self.pool.get_nowait()
+        except Queue.Empty:
+            pass
+        with self.pool_lock:
+            create = not self.bound or self.connections < self.bound
+            if create:
+                self.connections += 1
+        if not create:
+            return self.pool.get()
+        try:
+            return self._get_new_connection()
+        except sqlite3.Error:
+            with self.pool_lock:
+                self.connections -= 1
+            raise
+
+    def _release_connection(self, db):
+        self.pool.put(db)
+
+    def close(self):
+        SQLiteDBHandle.close(self)
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Queue.Empty:
+                break
+
+
+class ProcessSQLiteDBHandle(SQLiteDBHandle):
+    """Like SQLiteDBHandle, but a new connection is used for each call, as
+    the connections cannot be shared with the forked processes.
+    """
+
+    def _get_connection(self):
+        return self._get_new_connection()
+
+    def _release_connection(self, db):
+        db.close()
+
+
+if not _has_sqlite:
+    handle = DBHandle(single_threaded=None,
+                      multi_threaded=None,
+                      multi_processing=None,
+                      prefork=None)
+else:
+    handle = DBHandle(single_threaded=SQLiteDBHandle,
+                      multi_threaded=ThreadedSQLiteDBHandle,
+                      multi_processing=ProcessSQLiteDBHandle,
+                      prefork=SQLiteDBHandle)
@@ -0,0 +1,208 @@
+"""Write-behind buffer for reports and whitelists, that can be placed in
+front of any engine."""
+
+import copy
+import logging
+import threading
+
+from pyzor.engines.common import BaseEngine, Record
+
+__all__ = ["WriteBehindDBHandle"]
+
+
+class WriteBehindDBHandle(BaseEngine):
+    """Wraps another engine and adds up the reports and whitelists for each
+    digest in memory. A background thread writes the accumulated counts to
+    the engine with a single `increment_many` call every `interval`
+    seconds, or as soon as `max_pending` digests are waiting.
+
+    Reads add the pending counts to the records from the engine, so they
+    always include the reports handled by this process. Reports that are
+    still pending are lost if the process is killed, so `interval` is the
+    trade-off between durability and the load on the engine.
+
+    Records written with __setitem__ or set_many replace the stored record
+    immediately, any pending counts for them are added on top.
+    """
+    log = logging.getLogger("pyzord")
+    handles_one_step = True
+    # The number of times a read is retried when it overlaps with a flush.
+    read_attempts = 3
+
+    def __init__(self, engine, interval=1.0, max_pending=10000):
+        self.engine = engine
+        self.interval = interval
+        self.max_pending = max_pending
+        self.absolute_source = engine.absolute_source
+        self.pending = {}
+        # The counts that are being written to the engine.
+        self.flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Incremented when a flush starts and when it ends, so it's odd
+        # while the counts are being written.
+        self._generation = 0
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.thread = threading.Thread(target=self._flush_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __getattr__(self, name):
+        if name == "engine":
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def __iter__(self):
+        return iter(self.engine)
+
+    def iteritems(self):
+        return self.engine.iteritems()
+
+    def items(self):
+        return self.engine.items()
+
+    def _increment(self, keys, increment):
+        with self._lock:
+            pending = self.pending
+            for key in keys:
+                try:
+                    delta = pending[key]
+                except KeyError:
+                    delta = pending[key] = Record()
+                increment(delta)
+            full = len(pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def report(self, keys):
+        self._increment(keys, Record.r_increment)
+
+    def whitelist(self, keys):
+        self._increment(keys, Record.wl_increment)
+
+    def _deltas(self, keys):
+        """Return the counts that are not yet written for these keys. The
+        lock must be held.
+        """
+        deltas = {}
+        # A key can be requested more than once, but its counts must only
+        # be added once.
+        keys = set(keys)
+        for counts in (self.flushing, self.pending):
+            for key in keys:
+                try:
+                    delta = counts[key]
+                except KeyError:
+                    continue
+                deltas.setdefault(key, Record()).add(delta)
+        return deltas
+
+    def _read(self, keys, fetch):
+        """Call fetch() to get the records for these keys from the engine,
+        and return them with the counts that the engine doesn't have yet.
+        """
+        for dummy in range(self.read_attempts):
+            with self._lock:
+                generation = self._generation
+                deltas = self._deltas(keys)
+            if generation % 2:
+                # Wait for the flush in progress to finish, until then
+                # it's not known whether the engine has these counts.
+                with self._flush_lock:
+                    continue
+            records = fetch()
+            if generation == self._generation:
+                return records, deltas
+        # The flushes keep overlapping with the read, settle for counts
+        # that might be off by the ones being written.
+        with self._lock:
+            deltas = self._deltas(keys)
+        return fetch(), deltas
+
+    def __getitem__(self, key):
+        def fetch():
+            try:
+                return self.engine[key]
+            except KeyError:
+                return None
+        record, deltas = self._read((key,), fetch)
+        if key not in deltas:
+            if record is None:
+                raise KeyError(key)
+            return record
+        # The engine's record might be shared, so the counts are added to
+        # a copy of it.
+        record = Record() if record is None else copy.copy(record)
+        record.add(deltas[key])
+        return record
+
+    def get_many(self, keys):
+        records, deltas = self._read(keys,
+                                     lambda: self.engine.get_many(keys))
+        if not deltas:
+            return records
+        merged = []
+        for key, record in zip(keys, records):
+            if key in deltas:
+                record = copy.copy(record)
+                record.add(deltas[key])
+            merged.append(record)
+        return merged
+
+    def __setitem__(self, key, value):
+        self.engine[key] = value
+
+    def set_many(self, items):
+        self.engine.set_many(items)
+
+    def __delitem__(self, key):
+        del self.engine[key]
+
+    def increment_many(self, items):
+        with self._lock:
+            for key, delta in items:
+                self.pending.setdefault(key, Record()).add(delta)
+
+    def flush(self):
+        """Write all the pending counts to the engine now."""
+        with self._flush_lock:
+            with self._lock:
+                if not self.pending:
+                    return
+                self.flushing = self.pending
+                self.pending = {}
+                self._generation += 1
+            try:
+                self.engine.increment_many(self.flushing.items())
+            except Exception as e:
+                self.log.error("Unable to write %s pending records: %s",
+                               len(self.flushing), e)
+                # Keep the counts, they will be written with the next
+                # flush.
+                with self._lock:
+                    for key, delta in self.flushing.items():
+                        self.pending.setdefault(key, Record()).add(delta)
+            finally:
+                with self._lock:
+                    self.flushing = {}
+                    self._generation += 1
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.log.exception("Error while writing pending records")
+
+    def close(self):
+        """Stop the background thread and write the pending counts."""
+        self._stopped = True
+        self._wakeup.set()
+        self.thread.join()
+        self.flush()
+        close = getattr(self.engine, "close", None)
+        if close is not None:
+            close()
@@ -1,5 +1,10 @@
 """This modules contains the various messages used in the pyzor client server
 communication.
+
+The messages only consist of headers, so rather than going through the
+generic (and slow) parser and generator of the email package they are
+read and written by `parse_headers` and `serialize_headers`, which produce
+the same wire format.
 """
 
 import random
@@ -8,6 +13,48 @@ import email.message
 import pyzor
 
 
+def parse_headers(data):
+    """Parse the packet into a list of (name, value) header pairs.
+
+    Lines starting with whitespace are continuations of the previous header.
+    Blank lines are skipped (old versions of the client sent a double \\n
+    after the signature) as well as any lines that aren't headers.
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf8", "replace")
+    headers = []
+    for line in data.split("\n"):
+        line = line.rstrip("\r")
+        if not line:
+            continue
+        if line[0] in " \t":
+            if headers:
+                name, value = headers[-1]
+                headers[-1] = (name, "%s\n%s" % (value, line))
+            continue
+        name, sep, value = line.partition(":")
+        if sep:
+            headers.append((name, value.lstrip(" \t")))
+    return headers
+
+
+def serialize_headers(headers):
+    """Return the wire format for this list of (name, value) header pairs."""
+    return "".join(["%s: %s\n" % header for header in headers]) + "\n"
+
+
+def message_from_bytes(data, _class=None):
+    """Parse the packet and return an instance of _class (Message by
+    default) holding its headers.
+    """
+    if _class is None:
+        _class = Message
+    msg = _class()
+    # Bypass the email policies, the parsed values are used as they are.
+    msg._headers.extend(parse_headers(data))
+    return msg
+
+
 class Message(email.message.Message):
     def __init__(self):
         email.message.Message.__init__(self)
@@ -19,6 +66,11 @@ class Message(email.message.Message):
     def init_for_sending(self):
         self.ensure_complete()
 
+    def as_string(self, *args, **kwargs):
+        # Pyzor messages don't have a body, and don't need any folding or
+        # encoding of the headers.
+        return serialize_headers(self._headers)
+
     def __str__(self):
         # The parent class adds the unix From header.
         return self.as_string()
@@ -73,6 +125,19 @@ class Response(ThreadedMessage):
         return self.get_code(), self.get_diag()
 
 
+class CheckManyResponse(Response):
+    """Response to a CheckManyRequest."""
+
+    def get_counts(self):
+        """Return a list of (count, wl_count) pairs, in the same order as
+        the digests in the request.
+        """
+        counts = self.get_all("Count") or []
+        wl_counts = self.get_all("WL-Count") or []
+        return [(int(count), int(wl_count))
+                for count, wl_count in zip(counts, wl_counts)]
+
+
 class Request(ThreadedMessage):
     """This is the class that should be used to read in Requests of any type.
     Subclasses are responsible for setting 'Op' if they are generating a
@@ -90,6 +155,11 @@ class Request(ThreadedMessage):
 
 class ClientSideRequest(Request):
     op = None
+    # Whether the request can be sent again when no response is received,
+    # without changing the result.
+    idempotent = True
+    # Whether the response can be kept in the client cache (pyzor.cache).
+    cacheable = False
 
     def setup(self):
         Request.setup(self)
@@ -126,6 +196,20 @@ class PongRequest(SimpleDigestBasedRequest):
 
 class CheckRequest(SimpleDigestBasedRequest):
     op = "check"
+    cacheable = True
+
+
+class CheckManyRequest(CheckRequest):
+    """Check request for several digests, the server answers with the counts
+    of all the digests in a single response.
+    """
+
+    cacheable = False
+
+    def __init__(self, digests=()):
+        CheckRequest.__init__(self)
+        for digest in digests:
+            self.add_digest(digest)
 
 
 class InfoRequest(SimpleDigestBasedRequest):
@@ -134,10 +218,12 @@ class InfoRequest(SimpleDigestBasedRequest):
 
 class ReportRequest(SimpleDigestSpecBasedRequest):
     op = "report"
+    idempotent = False
 
 
 class WhitelistRequest(SimpleDigestSpecBasedRequest):
     op = "whitelist"
+    idempotent = False
 
 
 class ThreadId(int):
@@ -0,0 +1,204 @@
+"""Runtime metrics for the pyzord server.
+
+The server counts the requests handled for every operation and response
+code, and keeps latency histograms for each stage of handling a request
+(parsing, authentication and ACL checks, the engine call and serializing
+the response). The hits and misses of the engine read cache are counted
+as well, when it is used.
+
+The schema is fixed, so all the values are stored in a flat array of
+doubles. When the array is shared between processes (for example for the
+PreForkServer) every process is given its own slot to write to, and the
+slots are added together when the metrics are collected.
+
+The metrics can be served in the Prometheus text format from a small HTTP
+server running in a separate thread.
+"""
+
+import bisect
+import logging
+import threading
+import multiprocessing.sharedctypes
+
+try:
+    import BaseHTTPServer
+except ImportError:
+    import http.server as BaseHTTPServer
+
+__all__ = ["Metrics", "MetricsServer"]
+
+OPERATIONS = ("ping", "pong", "check", "report", "whitelist", "info",
+              "other")
+CODES = ("200", "400", "401", "403", "500", "501", "505")
+STAGES = ("parse", "acl", "engine", "serialize")
+CACHE_RESULTS = ("hit", "miss")
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The layout of a slot, see Metrics.
+_HISTOGRAM_SIZE = len(BUCKETS) + 2
+_OPERATION_SIZE = len(CODES) + len(STAGES) * _HISTOGRAM_SIZE
+_CACHE_OFFSET = len(OPERATIONS) * _OPERATION_SIZE
+_SLOT_SIZE = _CACHE_OFFSET + len(CACHE_RESULTS)
+_OPERATION_OFFSETS = dict((op, i * _OPERATION_SIZE)
+                          for i, op in enumerate(OPERATIONS))
+_CODE_OFFSETS = dict((code, i) for i, code in enumerate(CODES))
+_STAGE_OFFSETS = dict((stage, len(CODES) + i * _HISTOGRAM_SIZE)
+                      for i, stage in enumerate(STAGES))
+
+
+class Metrics(object):
+    """Request counters and latency histograms for `slots` processes.
+
+    Every slot holds, for each operation, one counter for each response
+    code followed by a histogram for each stage. A histogram is made of one
+    counter for every bucket, one for the values above the last bucket and
+    the sum of all the values. The slot ends with the cache counters.
+    """
+    def __init__(self, slots=1, lock=None):
+        self.slots = slots
+        self._data = multiprocessing.sharedctypes.RawArray(
+            "d", slots * _SLOT_SIZE)
+        self._base = 0
+        if lock is None:
+            lock = threading.Lock()
+        self._lock = lock
+
+    def select_slot(self, slot):
+        """Write the metrics of this process to `slot`. This should be
+        called in the child process, after forking.
+        """
+        assert 0 <= slot < self.slots
+        self._base = slot * _SLOT_SIZE
+        self._lock = threading.Lock()
+
+    def record(self, opcode, code, timings):
+        """Record a handled request.
+
+        `timings` is a list of (stage, seconds) pairs for the stages that
+        were completed.
+        """
+        data = self._data
+        base = self._base + _OPERATION_OFFSETS.get(
+            opcode, _OPERATION_OFFSETS["other"])
+        with self._lock:
+            if code in _CODE_OFFSETS:
+                data[base + _CODE_OFFSETS[code]] += 1
+            for stage, seconds in timings:
+                offset = base + _STAGE_OFFSETS[stage]
+                data[offset + bisect.bisect_left(BUCKETS, seconds)] += 1
+                data[offset + _HISTOGRAM_SIZE - 1] += seconds
+
+    def record_cache(self, hits, misses):
+        """Count lookups in the engine read cache."""
+        data = self._data
+        offset = self._base + _CACHE_OFFSET
+        with self._lock:
+            data[offset] += hits
+            data[offset + 1] += misses
+
+    def collect(self):
+        """Return the values of all the slots added together."""
+        data = self._data
+        size = _SLOT_SIZE
+        totals = list(data[0:size])
+        for slot in range(1, self.slots):
+            for i, value in enumerate(data[slot * size:(slot + 1) * size]):
+                totals[i] += value
+        return totals
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        totals = self.collect()
+        lines = [
+            "# HELP pyzord_requests_total Requests handled, by operation "
+            "and response code.",
+            "# TYPE pyzord_requests_total counter"]
+        for op in OPERATIONS:
+            base = _OPERATION_OFFSETS[op]
+            for code in CODES:
+                value = totals[base + _CODE_OFFSETS[code]]
+                if value:
+                    lines.append('pyzord_requests_total{op="%s",code="%s"} '
+                                 '%d' % (op, code, value))
+        lines.extend([
+            "# HELP pyzord_request_stage_seconds Time spent in each stage "
+            "of handling a request.",
+            "# TYPE pyzord_request_stage_seconds histogram"])
+        for op in OPERATIONS:
+            for stage in STAGES:
+                offset = _OPERATION_OFFSETS[op] + _STAGE_OFFSETS[stage]
+                counts = totals[offset:offset + len(BUCKETS) + 1]
+                if not any(counts):
+                    continue
+                labels = 'op="%s",stage="%s"' % (op, stage)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, counts):
+                    cumulative += count
+                    lines.append('pyzord_request_stage_seconds_bucket{%s,'
+                                 'le="%g"} %d' % (labels, bound, cumulative))
+                cumulative += counts[-1]
+                lines.append('pyzord_request_stage_seconds_bucket{%s,'
+                             'le="+Inf"} %d' % (labels, cumulative))
+                lines.append('pyzord_request_stage_seconds_sum{%s} %.9g' %
+                             (labels, totals[offset + len(BUCKETS) + 1]))
+                lines.append('pyzord_request_stage_seconds_count{%s} %d' %
+                             (labels, cumulative))
+        lines.extend([
+            "# HELP pyzord_cache_lookups_total Lookups in the engine read "
+            "cache, by result.",
+            "# TYPE pyzord_cache_lookups_total counter"])
+        counts = totals[_CACHE_OFFSET:_CACHE_OFFSET + len(CACHE_RESULTS)]
+        if any(counts):
+            for result, value in zip(CACHE_RESULTS, counts):
+                lines.append('pyzord_cache_lookups_total{result="%s"} %d' %
+                             (result, value))
+        lines.append("")
+        return "\n".join(lines)
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the metrics for any GET request."""
+
+    def do_GET(self):
+        body = self.server.metrics.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", "%d" % len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.log.debug("Metrics request from %s: %s",
+                              self.client_address[0], format % args)
+
+
+class MetricsServer(BaseHTTPServer.HTTPServer):
+    """HTTP server that exposes the metrics, handling the requests in a
+    daemon thread.
+    """
+
+    def __init__(self, address, metrics):
+        self.log = logging.getLogger("pyzord")
+        self.metrics = metrics
+        BaseHTTPServer.HTTPServer.__init__(self, address,
+                                           _MetricsRequestHandler)
+        self.thread = None
+
+    def start(self):
+        """Start serving the metrics in a daemon thread."""
+        self.log.info("Serving metrics on %s:%s", *self.server_address[:2])
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving the metrics and close the socket."""
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
@@ -26,16 +26,25 @@ import socket
 import signal
 import logging
 import threading
+import collections
 import traceback
-import email.message
 
 try:
     import SocketServer
 except ImportError:
     import socketserver as SocketServer
 
+try:
+    import asyncio
+    import concurrent.futures
+    _has_asyncio = True
+except ImportError:
+    _has_asyncio = False
+
 import pyzor.config
 import pyzor.account
+import pyzor.message
+import pyzor.engines.cache
 import pyzor.engines.common
 
 import pyzor.hacks.py26
@@ -43,6 +52,9 @@ import pyzor.hacks.py26
 
 pyzor.hacks.py26.hack_all()
 
+# The most precise clock available, used to time the requests.
+_timer = getattr(time, "perf_counter", time.time)
+
 
 def _eintr_retry(func, *args):
     """restart a system call interrupted by EINTR"""
@@ -59,6 +71,8 @@ class Server(SocketServer.UDPServer):
     thread and single process."""
     max_packet_size = 8192
     time_diff_allowance = 180
+    # A pyzor.metrics.Metrics instance, if the metrics are enabled.
+    metrics = None
 
     def __init__(self, address, database, passwd_fn, access_fn,
                  forwarder=None):
@@ -83,17 +97,28 @@ class Server(SocketServer.UDPServer):
         self.log.debug("Listening on %s", address)
         SocketServer.UDPServer.__init__(self, address, RequestHandler,
                                         bind_and_activate=False)
-        try:
-            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
-        except (AttributeError, socket.error) as e:
-            self.log.debug("Unable to set IPV6_V6ONLY to false %s", e)
         self.server_bind()
         self.server_activate()
 
         # Finally, set signals
         signal.signal(signal.SIGUSR1, self.reload_handler)
+        signal.signal(signal.SIGUSR2, self.reorganize_handler)
         signal.signal(signal.SIGTERM, self.shutdown_handler)
 
+    def server_bind(self):
+        try:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        except (AttributeError, socket.error) as e:
+            self.log.debug("Unable to set IPV6_V6ONLY to false %s", e)
+        SocketServer.UDPServer.server_bind(self)
+
+    def share_metrics(self):
+        """Count the hits and misses of the engine read cache, if there is
+        one, in the server metrics.
+        """
+        if isinstance(self.database, pyzor.engines.cache.CachedDBHandle):
+            self.database.metrics = self.metrics
+
     def load_config(self):
         """Reads the configuration files and loads the accounts and ACLs."""
         self.accounts = pyzor.config.load_passwd_file(self.passwd_fn)
@@ -115,59 +140,255 @@ class Server(SocketServer.UDPServer):
         t = threading.Thread(target=self.load_config)
         t.start()
 
+    def reorganize_database(self):
+        """Run the maintenance of the database, for engines that need it
+        (for example to compact a gdbm file).
+        """
+        reorganize = getattr(self.database, "reorganize", None)
+        if reorganize is None:
+            self.log.info("The database does not need reorganizing.")
+            return
+        start = time.time()
+        reorganize()
+        self.log.info("Database reorganized in %.1f seconds.",
+                      time.time() - start)
+
+    def reorganize_handler(self, *args, **kwargs):
+        """Handler for the SIGUSR2 signal. This should be used to run the
+        database maintenance at a time when the server is not busy.
+        """
+        self.log.info("SIGUSR2 received. Reorganizing the database.")
+        t = threading.Thread(target=self.reorganize_database)
+        t.start()
+
     def handle_error(self, request, client_address):
         self.log.error("Error while processing request from: %s",
                        client_address, exc_info=True)
 
+    def server_close(self):
+        """Close the socket, and the database if it needs closing (for
+        example to write the pending records).
+        """
+        SocketServer.UDPServer.server_close(self)
+        close = getattr(self.database, "close", None)
+        if close is not None:
+            close()
+
+
+class _ReplyQueue(list):
+    """Stands in for the server socket in the request handlers, collecting
+    the replies so that they can be sent together at the end of a batch.
+    """
+
+    def sendto(self, data, address):
+        self.append((data, address))
+
+
+class BatchedServer(Server):
+    """The same as Server, but every time the socket becomes readable it
+    drains up to `batch_size` pending datagrams without blocking, handles
+    them one after the other and then flushes all the replies at once.
+
+    This avoids doing a select() call for every request under high load.
+    """
+
+    def __init__(self, address, database, passwd_fn, access_fn,
+                 batch_size=64, forwarder=None):
+        self.batch_size = batch_size
+        Server.__init__(self, address, database, passwd_fn, access_fn,
+                        forwarder=forwarder)
+        self.socket.setblocking(False)
+
+    def _handle_request_noblock(self):
+        """Handle all the requests that are available (up to batch_size)."""
+        replies = _ReplyQueue()
+        recvfrom = self.socket.recvfrom
+        for dummy in range(self.batch_size):
+            try:
+                packet, client_address = recvfrom(self.max_packet_size)
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                     errno.EINTR):
+                    self.log.error("Error while reading request: %s", e)
+                break
+            try:
+                self.finish_request((packet, replies), client_address)
+            except Exception:
+                self.handle_error((packet, replies), client_address)
+        self.flush_replies(replies)
+
+    def flush_replies(self, replies):
+        """Send all the replies gathered while handling a batch."""
+        sendto = self.socket.sendto
+        for data, client_address in replies:
+            try:
+                sendto(data, client_address)
+            except socket.error as e:
+                self.log.error("Unable to send reply to %s: %s",
+                               client_address, e)
+
 
 class PreForkServer(Server):
     """The same as Server, but prefork itself when starting the self, by
     forking a number of child-processes.
 
-    The parent process will then wait for all his child process to complete.
+    The parent process then supervises the workers: any worker that exits
+    is restarted, and the TERM and USR1 signals are forwarded to all of
+    them.
     """
+    # Workers that exit sooner than this after being started are only
+    # restarted after this many seconds, so that a worker that fails on
+    # start-up is not restarted in a tight loop.
+    respawn_delay = 1
+
     def __init__(self, address, database, passwd_fn, access_fn, prefork=4):
         """The same as Server.__init__ but requires a list of databases
         instead of a single database connection.
         """
         self.pids = None
+        self.stopping = False
         Server.__init__(self, address, database, passwd_fn, access_fn)
         self._prefork = prefork
 
+    def spawn_worker(self, slot, poll_interval=0.5):
+        """Fork a new worker process and return its pid. The slot is used
+        to tell the workers apart, and is kept when a worker is restarted.
+        """
+        database = next(self.database)
+        pid = os.fork()
+        if pid:
+            return pid
+        self.pids = None
+        try:
+            # Create the database in the child process, to prevent issues
+            self.database = database()
+            if self.metrics is not None:
+                self.metrics.select_slot(slot)
+                self.share_metrics()
+            self.setup_worker()
+            Server.serve_forever(self, poll_interval=poll_interval)
+            self.server_close()
+        except Exception:
+            self.log.critical("Worker failure: %s", traceback.format_exc())
+            status = 1
+        else:
+            status = 0
+        # Write out any queued log records.
+        logging.shutdown()
+        os._exit(status)
+
+    def setup_worker(self):
+        """Called in the worker process before it starts serving
+        requests.
+        """
+        pass
+
     def serve_forever(self, poll_interval=0.5):
-        """Fork the current process and wait for all children to finish."""
-        pids = []
-        for dummy in range(self._prefork):
-            database = next(self.database)
-            pid = os.fork()
-            if not pid:
-                # Create the database in the child process, to prevent issues
-                self.database = database()
-                Server.serve_forever(self, poll_interval=poll_interval)
-                os._exit(0)
-            else:
-                pids.append(pid)
-        self.pids = pids
-        for pid in self.pids:
-            _eintr_retry(os.waitpid, pid, 0)
+        """Fork the workers and restart any of them that exits, until the
+        server is shut down.
+        """
+        self.pids = {}
+        started = {}
+        for slot in range(self._prefork):
+            if self.stopping:
+                break
+            self._start_worker(slot, poll_interval)
+            started[slot] = time.time()
+        while self.pids:
+            try:
+                pid, status = _eintr_retry(os.wait)
+            except OSError as e:
+                if e.args[0] != errno.ECHILD:
+                    raise
+                break
+            slot = self.pids.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            self.log.warning("Worker %s exited with status %s, restarting "
+                             "it.", pid, status)
+            if time.time() - started[slot] < self.respawn_delay:
+                time.sleep(self.respawn_delay)
+                if self.stopping:
+                    continue
+            self._start_worker(slot, poll_interval)
+            started[slot] = time.time()
+
+    def _start_worker(self, slot, poll_interval):
+        pid = self.spawn_worker(slot, poll_interval)
+        self.pids[pid] = slot
+        if self.stopping:
+            # The shutdown started while forking, and might have missed
+            # this worker.
+            os.kill(pid, signal.SIGTERM)
+
+    def server_close(self):
+        """If this is the parent process only close the socket, else call
+        the super method.
+        """
+        if self.pids is None:
+            Server.server_close(self)
+        else:
+            SocketServer.UDPServer.server_close(self)
+
+    def _signal_workers(self, signum):
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                self.log.debug("Unable to signal worker %s: %s", pid, e)
 
     def shutdown(self):
         """If this is the parent process send the TERM signal to all children,
         else call the super method.
         """
-        for pid in self.pids or ():
-            os.kill(pid, signal.SIGTERM)
+        self.stopping = True
         if self.pids is None:
             Server.shutdown(self)
+        else:
+            self._signal_workers(signal.SIGTERM)
 
     def load_config(self):
         """If this is the parent process send the USR1 signal to all children,
         else call the super method.
         """
-        for pid in self.pids or ():
-            os.kill(pid, signal.SIGUSR1)
         if self.pids is None:
             Server.load_config(self)
+        else:
+            self._signal_workers(signal.SIGUSR1)
+
+    def reorganize_database(self):
+        """If this is the parent process send the USR2 signal to all
+        children, else call the super method.
+        """
+        if self.pids is None:
+            Server.reorganize_database(self)
+        else:
+            self._signal_workers(signal.SIGUSR2)
+
+
+class ReusePortServer(PreForkServer):
+    """The same as PreForkServer, but every worker binds its own socket
+    with SO_REUSEPORT and the kernel distributes the datagrams between
+    them, instead of waking up all the workers for every packet.
+    """
+
+    def __init__(self, address, database, passwd_fn, access_fn, prefork=4):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT is not available.")
+        PreForkServer.__init__(self, address, database, passwd_fn, access_fn,
+                               prefork=prefork)
+        # The parent only binds its socket to check the address (and to
+        # pick the port), it would otherwise get its share of the packets.
+        self.socket.close()
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        PreForkServer.server_bind(self)
+
+    def setup_worker(self):
+        """Bind a new socket for this worker."""
+        self.socket = socket.socket(self.address_family, self.socket_type)
+        self.server_bind()
 
 
 class ThreadingServer(SocketServer.ThreadingMixIn, Server):
@@ -208,15 +429,201 @@ class ProcessServer(SocketServer.ForkingMixIn, Server):
                         forwarder=forwarding_server)
 
 
+class _AsyncDatagramProtocol(object):
+    """asyncio datagram protocol that passes every packet received to the
+    AsyncServer.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, address):
+        self.server.process_request(data, address)
+
+    def error_received(self, exc):
+        self.server.log.error("Error received on the socket: %s", exc)
+
+    def connection_lost(self, exc):
+        self.server.transport = None
+
+
+class AsyncServer(object):
+    """A version of the pyzord server running on an asyncio event loop.
+
+    The packets are read and the replies sent by the event loop, while the
+    requests are handled by a bounded pool of worker threads. This allows a
+    single process to keep a large number of requests in flight without
+    starting a new thread for every packet. The database engine must be
+    safe to use from multiple threads.
+    """
+    max_packet_size = 8192
+    metrics = None
+    # The maximum number of requests waiting to be handled, any other
+    # packets are dropped until the server catches up.
+    max_pending = 4096
+
+    def __init__(self, address, database, passwd_fn, access_fn,
+                 max_workers=64, forwarder=None):
+        if not _has_asyncio:
+            raise RuntimeError("The asyncio library is not available.")
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+        else:
+            self.address_family = socket.AF_INET
+        self.log = logging.getLogger("pyzord")
+        self.usage_log = logging.getLogger("pyzord-usage")
+        self.database = database
+        self.one_step = getattr(self.database, "handles_one_step", False)
+
+        # Handle configuration files
+        self.passwd_fn = passwd_fn
+        self.access_fn = access_fn
+        self.accounts = {}
+        self.acl = {}
+        self.load_config()
+
+        self.forwarder = forwarder
+
+        self.log.debug("Listening on %s", address)
+        self.socket = socket.socket(self.address_family, socket.SOCK_DGRAM)
+        try:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        except (AttributeError, socket.error) as e:
+            self.log.debug("Unable to set IPV6_V6ONLY to false %s", e)
+        self.socket.bind(address)
+        self.server_address = self.socket.getsockname()
+
+        self.pending = 0
+        self.transport = None
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def load_config(self):
+        """Reads the configuration files and loads the accounts and ACLs."""
+        self.accounts = pyzor.config.load_passwd_file(self.passwd_fn)
+        self.acl = pyzor.config.load_access_file(self.access_fn, self.accounts)
+
+    def reorganize_database(self):
+        """Run the maintenance of the database, for engines that need it
+        (for example to compact a gdbm file).
+        """
+        reorganize = getattr(self.database, "reorganize", None)
+        if reorganize is None:
+            self.log.info("The database does not need reorganizing.")
+            return
+        start = time.time()
+        reorganize()
+        self.log.info("Database reorganized in %.1f seconds.",
+                      time.time() - start)
+
+    def serve_forever(self):
+        """Run the event loop until the server is shut down."""
+        for signum, handler in ((signal.SIGUSR1, self.reload_handler),
+                                (signal.SIGUSR2, self.reorganize_handler),
+                                (signal.SIGTERM, self.shutdown_handler)):
+            try:
+                self.loop.add_signal_handler(signum, handler)
+            except (ValueError, RuntimeError) as e:
+                # Signal handlers can only be set from the main thread.
+                self.log.debug("Unable to set signal handler: %s", e)
+        endpoint = self.loop.create_datagram_endpoint(
+            lambda: _AsyncDatagramProtocol(self), sock=self.socket)
+        transport, dummy = self.loop.run_until_complete(endpoint)
+        try:
+            self.loop.run_forever()
+        finally:
+            transport.close()
+
+    def shutdown(self):
+        """Stop the event loop. This can be called from any thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+        self.loop.close()
+        self.socket.close()
+        close = getattr(self.database, "close", None)
+        if close is not None:
+            close()
+
+    def shutdown_handler(self, *args, **kwargs):
+        """Handler for the SIGTERM signal. This should be used to kill the
+        daemon and ensure proper clean-up.
+        """
+        self.log.info("SIGTERM received. Shutting down.")
+        self.shutdown()
+
+    def reload_handler(self, *args, **kwargs):
+        """Handler for the SIGUSR1 signal. This should be used to reload
+        the configuration files.
+        """
+        self.log.info("SIGUSR1 received. Reloading configuration.")
+        self.executor.submit(self.load_config)
+
+    def reorganize_handler(self, *args, **kwargs):
+        """Handler for the SIGUSR2 signal. This should be used to run the
+        database maintenance at a time when the server is not busy.
+        """
+        self.log.info("SIGUSR2 received. Reorganizing the database.")
+        self.executor.submit(self.reorganize_database)
+
+    def process_request(self, packet, client_address):
+        """Hand the request over to the worker threads, and send the reply
+        from the event loop once it's done.
+        """
+        if self.pending >= self.max_pending:
+            self.log.warning("Too many pending requests, dropping packet "
+                             "from %s", client_address)
+            return None
+        self.pending += 1
+        future = self.loop.run_in_executor(self.executor, self.finish_request,
+                                           packet, client_address)
+        future.add_done_callback(self.send_replies)
+        return future
+
+    def finish_request(self, packet, client_address):
+        """Handle the request in a worker thread and return the replies."""
+        replies = _ReplyQueue()
+        try:
+            RequestHandler((packet, replies), client_address, self)
+        except Exception:
+            self.handle_error((packet, replies), client_address)
+        return replies
+
+    def send_replies(self, future):
+        self.pending -= 1
+        if self.transport is None:
+            return
+        for data, client_address in future.result():
+            self.transport.sendto(data, client_address)
+
+    def handle_error(self, request, client_address):
+        self.log.error("Error while processing request from: %s",
+                       client_address, exc_info=True)
+
+
 class RequestHandler(SocketServer.DatagramRequestHandler):
     """Handle a single pyzord request."""
 
     def __init__(self, *args, **kwargs):
-        self.response = email.message.Message()
+        self.response = pyzor.message.Response()
+        self.opcode = None
+        self.timings = []
+        self._lap_start = _timer()
         SocketServer.DatagramRequestHandler.__init__(self, *args, **kwargs)
 
+    def lap(self, stage):
+        """Record the time spent in `stage` since the previous lap."""
+        now = _timer()
+        self.timings.append((stage, now - self._lap_start))
+        self._lap_start = now
+
     def handle(self):
         """Handle a pyzord operation, cleanly handling any errors."""
+        self._lap_start = _timer()
         self.response["Code"] = "200"
         self.response["Diag"] = "OK"
         self.response["PV"] = "%s" % pyzor.proto_version
@@ -235,8 +642,16 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
         except Exception as e:
             self.handle_error(500, "Internal Server Error: %s" % e)
             self.server.log.error(traceback.format_exc())
-        self.server.log.debug("Sending: %r", self.response.as_string())
-        self.wfile.write(self.response.as_string().encode("utf8"))
+        # Only the serialization is timed, not the logging above.
+        self._lap_start = _timer()
+        response = self.response.as_string()
+        data = response.encode("utf8")
+        self.lap("serialize")
+        self.server.log.debug("Sending: %r", response)
+        self.wfile.write(data)
+        if self.server.metrics is not None:
+            self.server.metrics.record(self.opcode, self.response["Code"],
+                                       self.timings)
 
     def _really_handle(self):
         """handle() without the exception handling."""
@@ -244,10 +659,11 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
 
         # Read the request.
         # Old versions of the client sent a double \n after the signature,
-        # which screws up the RFC5321 format.  Specifically handle that
-        # here - this could be removed in time.
-        request = email.message_from_bytes(
-            self.rfile.read().replace(b"\n\n", b"\n") + b"\n")
+        # which screws up the RFC5321 format. The parser skips any blank
+        # lines, so this is handled there.
+        request = pyzor.message.message_from_bytes(self.rfile.read(),
+                                                   pyzor.message.Request)
+        self.lap("parse")
 
         # Ensure that the response can be paired with the request.
         self.response["Thread"] = request["Thread"]
@@ -278,9 +694,11 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
         # Check that the user has permission to execute the requested
         # operation.
         opcode = request["Op"]
+        self.opcode = opcode
         if opcode not in self.server.acl[user]:
             raise pyzor.AuthorizationError(
                 "User is not authorized to request the operation.")
+        self.lap("acl")
         self.server.log.debug("Got a %s command from %s", opcode,
                               self.client_address[0])
         # Get a handle to the appropriate method to execute this operation.
@@ -295,7 +713,10 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
 
         # Do the requested operation, log what we have done, and return.
         if dispatch and digests:
-            dispatch(self, digests)
+            try:
+                dispatch(self, digests)
+            finally:
+                self.lap("engine")
         self.server.usage_log.info("%s,%s,%s,%r,%s", user,
                                    self.client_address[0], opcode, digests,
                                    self.response["Code"])
@@ -318,16 +739,25 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
     def handle_check(self, digests):
         """Handle the 'check' command.
 
-        This command returns the spam/ham counts for the specified digest.
+        This command returns the spam/ham counts for the specified digests.
+        If there are several digests the counts are repeated in the same
+        order as the digests in the request.
         """
-        digest = digests[0]
-        try:
-            record = self.server.database[digest]
-        except KeyError:
-            record = pyzor.engines.common.Record()
-        self.server.log.debug("Request to check digest %s", digest)
-        self.response["Count"] = "%d" % record.r_count
-        self.response["WL-Count"] = "%d" % record.wl_count
+        self.server.log.debug("Request to check digests %s", digests)
+        for record in self.server.database.get_many(digests):
+            self.response.add_header("Count", "%d" % record.r_count)
+            self.response.add_header("WL-Count", "%d" % record.wl_count)
+
+    def _increment(self, digests, increment):
+        """Read all the records, apply the increment to them and write them
+        back, with a single bulk operation each way.
+        """
+        records = collections.OrderedDict()
+        for digest, record in zip(digests,
+                                  self.server.database.get_many(digests)):
+            # The same digest may appear more than once.
+            increment(records.setdefault(digest, record))
+        self.server.database.set_many(records.items())
 
     def handle_report(self, digests):
         """Handle the 'report' command in a single step.
@@ -337,13 +767,7 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
         if self.server.one_step:
             self.server.database.report(digests)
         else:
-            for digest in digests:
-                try:
-                    record = self.server.database[digest]
-                except KeyError:
-                    record = pyzor.engines.common.Record()
-                record.r_increment()
-                self.server.database[digest] = record
+            self._increment(digests, pyzor.engines.common.Record.r_increment)
         if self.server.forwarder:
             for digest in digests:
                 self.server.forwarder.queue_forward_request(digest)
@@ -356,13 +780,7 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
         if self.server.one_step:
             self.server.database.whitelist(digests)
         else:
-            for digest in digests:
-                try:
-                    record = self.server.database[digest]
-                except KeyError:
-                    record = pyzor.engines.common.Record()
-                record.wl_increment()
-                self.server.database[digest] = record
+            self._increment(digests, pyzor.engines.common.Record.wl_increment)
         if self.server.forwarder:
             for digest in digests:
                 self.server.forwarder.queue_forward_request(digest, True)
@@ -370,17 +788,13 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
     def handle_info(self, digests):
         """Handle the 'info' command.
 
-        This command returns diagnostic data about a digest (timestamps for
-        when the digest was first/last seen as spam/ham, and spam/ham
-        counts).
+        This command returns diagnostic data about the digests (timestamps
+        for when the digest was first/last seen as spam/ham, and spam/ham
+        counts). If there are several digests the fields are repeated in
+        the same order as the digests in the request.
         """
-        digest = digests[0]
-        try:
-            record = self.server.database[digest]
-        except KeyError:
-            record = pyzor.engines.common.Record()
-        self.server.log.debug("Request for information about digest %s",
-                              digest)
+        self.server.log.debug("Request for information about digests %s",
+                              digests)
 
         def time_output(time_obj):
             """Convert a datetime object to a POSIX timestamp.
@@ -391,12 +805,14 @@ class RequestHandler(SocketServer.DatagramRequestHandler):
                 return 0
             return time.mktime(time_obj.timetuple())
 
-        self.response["Entered"] = "%d" % time_output(record.r_entered)
-        self.response["Updated"] = "%d" % time_output(record.r_updated)
-        self.response["WL-Entered"] = "%d" % time_output(record.wl_entered)
-        self.response["WL-Updated"] = "%d" % time_output(record.wl_updated)
-        self.response["Count"] = "%d" % record.r_count
-        self.response["WL-Count"] = "%d" % record.wl_count
+        add_header = self.response.add_header
+        for record in self.server.database.get_many(digests):
+            add_header("Entered", "%d" % time_output(record.r_entered))
+            add_header("Updated", "%d" % time_output(record.r_updated))
+            add_header("WL-Entered", "%d" % time_output(record.wl_entered))
+            add_header("WL-Updated", "%d" % time_output(record.wl_updated))
+            add_header("Count", "%d" % record.r_count)
+            add_header("WL-Count", "%d" % record.wl_count)
 
     dispatches = {
         'ping': None,
@@ -0,0 +1,68 @@
+"""Measure the latency of Client.check calls with the server addresses
+and the sockets reused between the calls, and with a new lookup and a new
+socket for every call.
+
+The requests are answered by a minimal responder running in a thread, so
+the difference is the cost of the lookup and of the socket setup.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import re
+import time
+import socket
+import optparse
+import threading
+
+import pyzor.client
+
+DIGEST = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+
+RESPONSE = "Code: 200\nDiag: OK\nPV: %s\nThread: %s\nCount: 0\nWL-Count: 0\n\n"
+
+
+def respond(sock):
+    """Answer every request received on the socket."""
+    while True:
+        packet, address = sock.recvfrom(8192)
+        thread = re.search(br"Thread: (\d+)", packet).group(1).decode()
+        response = RESPONSE % (pyzor.proto_version, thread)
+        sock.sendto(response.encode(), address)
+
+
+def measure(client, address, calls):
+    start = time.time()
+    for dummy in range(calls):
+        client.check(DIGEST, address)
+    return (time.time() - start) / calls
+
+
+def main():
+    opt = optparse.OptionParser()
+    opt.add_option("--host", dest="host", default="localhost",
+                   help="the name the responder is looked up by")
+    opt.add_option("-c", "--calls", dest="calls", type="int", default=5000)
+    options, args = opt.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    responder = threading.Thread(target=respond, args=(sock,))
+    responder.setDaemon(True)
+    responder.start()
+    address = (options.host, sock.getsockname()[1])
+
+    client = pyzor.client.Client()
+    client.address_ttl = 0
+    client.max_idle_sockets = 0
+    elapsed = measure(client, address, options.calls)
+    print("%-10s %8.1f us/call" % ("new", elapsed * 1e6))
+
+    client = pyzor.client.Client()
+    elapsed = measure(client, address, options.calls)
+    client.close()
+    print("%-10s %8.1f us/call" % ("reused", elapsed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
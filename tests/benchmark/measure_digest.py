@@ -0,0 +1,67 @@
+"""Measure how many lines per second DataDigester.normalize handles,
+compared to applying the patterns one by one.
+
+The corpus is read from the mbox files given as arguments, or is the mbox
+used by the functional tests. Every text line of the messages is
+normalized, the results of both implementations are also compared.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import mailbox
+import optparse
+
+import pyzor.digest
+
+DEFAULT_MBOX = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, "functional", "test_data", "test.mbx")
+
+
+def load_lines(paths):
+    digester = pyzor.digest.DataDigester
+    lines = []
+    for path in paths:
+        for msg in mailbox.mbox(path):
+            for payload in digester.digest_payloads(msg):
+                lines.extend(payload.splitlines())
+    return lines
+
+
+def measure(normalize, lines, repeats):
+    best = None
+    for dummy in range(repeats):
+        start = time.time()
+        for line in lines:
+            normalize(line)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / best
+
+
+def main():
+    opt = optparse.OptionParser(usage="%prog [options] [mbox ...]")
+    opt.add_option("-r", "--repeats", dest="repeats", type="int", default=5)
+    opt.add_option("-m", "--multiply", dest="multiply", type="int",
+                   default=100, help="repeat the corpus this many times")
+    options, args = opt.parse_args()
+
+    lines = load_lines(args or [DEFAULT_MBOX]) * options.multiply
+    digester = pyzor.digest.DataDigester
+    mismatches = sum(1 for line in set(lines)
+                     if digester.normalize(line) !=
+                     digester.normalize_patterns(line))
+
+    before = measure(digester.normalize_patterns, lines, options.repeats)
+    after = measure(digester.normalize, lines, options.repeats)
+    print("lines:           %10d (%d mismatches)" % (len(lines), mismatches))
+    print("patterns:        %10.0f lines/sec" % before)
+    print("single pass:     %10.0f lines/sec" % after)
+    print("speedup:         %10.2fx" % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Measure how many gdbm records per second can be decoded and encoded in
+the text format (version 1) compared to the packed format (version 2).
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import timeit
+import optparse
+
+SETUP = """
+import datetime
+from pyzor.engines.common import Record
+from pyzor.engines.gdbm_ import GdbmDBHandle
+now = datetime.datetime.now()
+record = Record(24, 42, now - datetime.timedelta(days=10),
+                now - datetime.timedelta(days=2),
+                now - datetime.timedelta(days=20), now)
+encoded_1 = GdbmDBHandle.encode_record_1(record).encode("utf8")
+encoded_2 = GdbmDBHandle.encode_record_2(record)
+"""
+
+COMMANDS = (
+    ("decode version 1", "GdbmDBHandle.decode_record(encoded_1)"),
+    ("decode version 2", "GdbmDBHandle.decode_record(encoded_2)"),
+    ("encode version 1", "GdbmDBHandle.encode_record_1(record)"),
+    ("encode version 2", "GdbmDBHandle.encode_record_2(record)"),
+)
+
+
+def measure(cmd, repeats, number):
+    results = timeit.repeat(stmt=cmd, setup=SETUP, repeat=repeats,
+                            number=number)
+    return number / min(results)
+
+
+def main():
+    opt = optparse.OptionParser()
+    opt.add_option("-r", "--repeats", dest="repeats", type="int", default=5)
+    opt.add_option("-n", "--number", dest="number", type="int",
+                   default=20000)
+    options, args = opt.parse_args()
+
+    results = {}
+    for name, cmd in COMMANDS:
+        results[name] = measure(cmd, options.repeats, options.number)
+        print("%s: %10.0f records/sec" % (name, results[name]))
+    print("decode speedup:   %10.2fx" % (results["decode version 2"] /
+                                         results["decode version 1"]))
+
+    namespace = {}
+    exec(SETUP, namespace)
+    print("record size:      %d bytes (version 1), %d bytes (version 2)" %
+          (len(namespace["encoded_1"]), len(namespace["encoded_2"])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measure how many requests per second can be parsed and answered using
+the email package compared to the pyzor.message header codec.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import timeit
+import optparse
+
+SETUP = """
+import email
+import email.message
+import pyzor.message
+packet = (b"Op: check\\n"
+          b"Op-Digest: 2aedaac999d71421c9ee49b9d81f627a7bc570aa\\n"
+          b"Thread: 33715\\n"
+          b"PV: 2.1\\n"
+          b"User: anonymous\\n"
+          b"Time: 1400221786\\n"
+          b"Sig: 1ce0fb3cd8d60bd8dd5f8cab9fc36ba1a5cd64c0\\n\\n")
+"""
+
+EMAIL_CMD = """
+request = email.message_from_bytes(packet.replace(b"\\n\\n", b"\\n") + b"\\n")
+response = email.message.Message()
+response["Code"] = "200"
+response["Diag"] = "OK"
+response["PV"] = "2.1"
+response["Thread"] = request["Thread"]
+request.get_all("Op-Digest")
+response["Count"] = "0"
+response["WL-Count"] = "0"
+response.as_string().encode("utf8")
+"""
+
+CODEC_CMD = """
+request = pyzor.message.message_from_bytes(packet, pyzor.message.Request)
+response = pyzor.message.Response()
+response["Code"] = "200"
+response["Diag"] = "OK"
+response["PV"] = "2.1"
+response["Thread"] = request["Thread"]
+request.get_all("Op-Digest")
+response["Count"] = "0"
+response["WL-Count"] = "0"
+response.as_string().encode("utf8")
+"""
+
+
+def measure(cmd, repeats, number):
+    results = timeit.repeat(stmt=cmd, setup=SETUP, repeat=repeats,
+                            number=number)
+    return number / min(results)
+
+
+def main():
+    opt = optparse.OptionParser()
+    opt.add_option("-r", "--repeats", dest="repeats", type="int", default=5)
+    opt.add_option("-n", "--number", dest="number", type="int",
+                   default=20000)
+    options, args = opt.parse_args()
+
+    before = measure(EMAIL_CMD, options.repeats, options.number)
+    after = measure(CODEC_CMD, options.repeats, options.number)
+    print("email package:  %10.0f requests/sec" % before)
+    print("header codec:   %10.0f requests/sec" % after)
+    print("speedup:        %10.2fx" % (after / before))
+
+
+if __name__ == '__main__':
+    main()
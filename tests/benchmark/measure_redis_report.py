@@ -0,0 +1,107 @@
+"""Compare the round-trips needed to report a batch of digests to redis,
+sending every command separately versus using the pipelined engine.
+
+A local stand-in for the redis connection is used, which simulates the
+network latency by sleeping for the configured RTT on every round-trip.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import time
+import hashlib
+import optparse
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pyzor.engines.redis_
+
+
+class StandInPipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append(name)
+
+    def execute(self):
+        self.conn.round_trip()
+        return [None] * len(self.commands)
+
+
+class StandInRedis(object):
+    """Stand-in for redis.StrictRedis."""
+
+    def __init__(self, rtt, *args, **kwargs):
+        self.rtt = rtt
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+
+    def keys(self, pattern):
+        return []
+
+    def pipeline(self, transaction=True):
+        return StandInPipeline(self)
+
+    def __getattr__(self, name):
+        return lambda *args: self.round_trip()
+
+
+def unpipelined_report(db, keys):
+    """The report implementation issuing one command per round-trip."""
+    now = int(time.time())
+    for key in keys:
+        real_key = db._real_key(key)
+        db.db.hincrby(real_key, "r_count")
+        db.db.hsetnx(real_key, "r_entered", now)
+        db.db.hset(real_key, "r_updated", now)
+        if db.max_age:
+            db.db.expire(real_key, db.max_age)
+
+
+def measure(report, db, keys, repeats):
+    db.db.round_trips = 0
+    start = time.time()
+    for dummy in range(repeats):
+        report(keys)
+    elapsed = (time.time() - start) / repeats
+    return elapsed, db.db.round_trips / repeats
+
+
+def main():
+    opt = optparse.OptionParser()
+    opt.add_option("--rtt", dest="rtt", type="float", default=0.0005,
+                   help="simulated round-trip time (in seconds)")
+    opt.add_option("-d", "--digests", dest="digests", type="int", default=10,
+                   help="number of digests in every report")
+    opt.add_option("-r", "--repeats", dest="repeats", type="int", default=100)
+    opt.add_option("--max-age", dest="max_age", type="int",
+                   default=60 * 60 * 24 * 30 * 4)
+    options, args = opt.parse_args()
+
+    keys = [hashlib.sha1(str(i).encode()).hexdigest()
+            for i in range(options.digests)]
+    with patch("pyzor.engines.redis_.redis", create=True) as mredis:
+        mredis.StrictRedis.side_effect = (
+            lambda *args, **kwargs: StandInRedis(options.rtt))
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None,
+                                                max_age=options.max_age)
+
+    results = (("one command per round-trip",
+                lambda k: unpipelined_report(db, k)),
+               ("pipelined", db.report))
+    for name, report in results:
+        elapsed, round_trips = measure(report, db, keys, options.repeats)
+        print("%-28s %6.1f round-trips %8.3f ms/report" %
+              (name, round_trips, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare reporting hot digests directly to the redis engine with
+reporting them through the write-behind buffer.
+
+The same stand-in redis connection as in measure_redis_report is used,
+simulating the network latency on every round-trip.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import time
+import random
+import hashlib
+import optparse
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pyzor.engines.redis_
+import pyzor.engines.writebehind
+
+from tests.benchmark.measure_redis_report import StandInRedis
+
+
+def measure(db, conn, keys, reports):
+    conn.round_trips = 0
+    rand = random.Random(0)
+    start = time.time()
+    for dummy in range(reports):
+        db.report([rand.choice(keys)])
+    elapsed = time.time() - start
+    return elapsed / reports
+
+
+def main():
+    opt = optparse.OptionParser()
+    opt.add_option("--rtt", dest="rtt", type="float", default=0.0005,
+                   help="simulated round-trip time (in seconds)")
+    opt.add_option("-d", "--digests", dest="digests", type="int", default=20,
+                   help="number of distinct hot digests")
+    opt.add_option("-r", "--reports", dest="reports", type="int",
+                   default=2000)
+    opt.add_option("-i", "--interval", dest="interval", type="float",
+                   default=0.1, help="write-behind interval (in seconds)")
+    options, args = opt.parse_args()
+
+    keys = [hashlib.sha1(str(i).encode()).hexdigest()
+            for i in range(options.digests)]
+    with patch("pyzor.engines.redis_.redis", create=True) as mredis:
+        mredis.StrictRedis.side_effect = (
+            lambda *args, **kwargs: StandInRedis(options.rtt))
+        engine = pyzor.engines.redis_.RedisDBHandle(",,,", None,
+                                                    max_age=3600)
+    conn = engine.db
+
+    elapsed = measure(engine, conn, keys, options.reports)
+    print("%-14s %6d round-trips %8.3f ms/report" %
+          ("direct", conn.round_trips, elapsed * 1000))
+
+    db = pyzor.engines.writebehind.WriteBehindDBHandle(engine,
+                                                       options.interval)
+    elapsed = measure(db, conn, keys, options.reports)
+    db.close()
+    print("%-14s %6d round-trips %8.3f ms/report" %
+          ("write-behind", conn.round_trips, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
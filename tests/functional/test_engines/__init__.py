@@ -14,14 +14,18 @@ import unittest
 def suite():
     """Gather all the tests from this package in a test suite."""
     import test_gdbm
+    import test_lmdb
     import test_mysql
     import test_redis
+    import test_sqlite
 
     test_suite = unittest.TestSuite()
 
     test_suite.addTest(test_gdbm.suite())
+    test_suite.addTest(test_lmdb.suite())
     test_suite.addTest(test_mysql.suite())
     test_suite.addTest(test_redis.suite())
+    test_suite.addTest(test_sqlite.suite())
     return test_suite
 
 if __name__ == '__main__':
@@ -0,0 +1,45 @@
+import unittest
+
+try:
+    import lmdb
+    has_lmdb = True
+except ImportError:
+    has_lmdb = False
+
+from tests.util import *
+
+
+@unittest.skipIf(not has_lmdb, "lmdb library not available")
+class LMDBPyzorTest(PyzorTest, PyzorTestBase):
+    """Test the lmdb engine"""
+    dsn = "pyzord.lmdb"
+    engine = "lmdb"
+
+
+class ThreadsLMDBPyzorTest(LMDBPyzorTest):
+    """Test the lmdb engine with threads activated."""
+    threads = "True"
+
+
+class MaxThreadsLMDBPyzorTest(LMDBPyzorTest):
+    """Test the lmdb engine with with maximum threads."""
+    threads = "True"
+    max_threads = "10"
+
+
+class PreForkLMDBPyzorTest(LMDBPyzorTest):
+    """Test the lmdb engine with pre-forked workers."""
+    prefork = "4"
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(LMDBPyzorTest))
+    test_suite.addTest(unittest.makeSuite(ThreadsLMDBPyzorTest))
+    test_suite.addTest(unittest.makeSuite(MaxThreadsLMDBPyzorTest))
+    test_suite.addTest(unittest.makeSuite(PreForkLMDBPyzorTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+try:
+    import sqlite3
+    has_sqlite = sqlite3.sqlite_version_info >= (3, 24, 0)
+except ImportError:
+    has_sqlite = False
+
+from tests.util import *
+
+
+@unittest.skipIf(not has_sqlite, "sqlite library not available")
+class SQLitePyzorTest(PyzorTest, PyzorTestBase):
+    """Test the sqlite engine"""
+    dsn = "pyzord.sqlite"
+    engine = "sqlite"
+
+
+class ThreadsSQLitePyzorTest(SQLitePyzorTest):
+    """Test the sqlite engine with threads activated."""
+    threads = "True"
+
+
+class MaxThreadsSQLitePyzorTest(SQLitePyzorTest):
+    """Test the sqlite engine with with maximum threads."""
+    threads = "True"
+    max_threads = "10"
+
+
+class PreForkSQLitePyzorTest(SQLitePyzorTest):
+    """Test the sqlite engine with pre-forked workers."""
+    prefork = "4"
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(SQLitePyzorTest))
+    test_suite.addTest(unittest.makeSuite(ThreadsSQLitePyzorTest))
+    test_suite.addTest(unittest.makeSuite(MaxThreadsSQLitePyzorTest))
+    test_suite.addTest(unittest.makeSuite(PreForkSQLitePyzorTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
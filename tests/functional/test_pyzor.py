@@ -177,7 +177,46 @@ class PyzorScriptTest(PyzorTestBase):
     def test_digest(self):
         out = self.check_pyzor("digest", None, input=msg).strip()
         self.assertEqual(out.decode("utf8"), digest)
-        
+
+    def test_mbox_jobs(self):
+        input = "".join("From MAILER-DAEMON Mon Jan  6 15:08:02 2014\n\n"
+                        "Test1 message %d Test2\n\n" % i for i in range(50))
+        self.client_args["-s"] = "mbox"
+        expected = self.check_pyzor("digest", None, input=input)
+        self.assertEqual(len(expected.splitlines()), 50)
+        self.client_args["-j"] = "3"
+        self.assertEqual(self.check_pyzor("digest", None, input=input),
+                         expected)
+
+    def test_maildir_style(self):
+        maildir = os.path.join(self.homedir, "maildir")
+        for subdir in ("new", "cur", "tmp"):
+            os.makedirs(os.path.join(maildir, subdir))
+        try:
+            with open(os.path.join(maildir, "new", "1"), "w") as msgf:
+                msgf.write(msg)
+            self.client_args["-s"] = "maildir"
+            self.client_args["-j"] = "2"
+            out = self.check_pyzor("digest", None, input=maildir + "\n")
+            self.assertEqual(out.decode("utf8").strip(), digest)
+        finally:
+            shutil.rmtree(maildir)
+
+    def test_maildir_missing(self):
+        maildir = os.path.join(self.homedir, "maildir")
+        for subdir in ("new", "cur", "tmp"):
+            os.makedirs(os.path.join(maildir, subdir))
+        try:
+            with open(os.path.join(maildir, "new", "1"), "w") as msgf:
+                msgf.write(msg)
+            self.client_args["-s"] = "maildir"
+            missing = os.path.join(self.homedir, "missing")
+            out = self.check_pyzor("digest", None,
+                                   input="%s\n%s\n" % (missing, maildir))
+            self.assertEqual(out.decode("utf8").strip(), digest)
+        finally:
+            shutil.rmtree(maildir)
+
 
 class MultipleServerPyzorScriptTest(PyzorTestBase):
     password_file = None
@@ -8,10 +8,13 @@ import unittest
 
 def suite():
     """Gather all the tests from this package in a test suite."""
+    import test_cache
     import test_client
     import test_config
     import test_digest
     import test_server
+    import test_message
+    import test_metrics
     import test_account
     import test_forwarder
     import test_engines
@@ -19,10 +22,13 @@ def suite():
     test_suite = unittest.TestSuite()
 
     test_suite.addTest(test_engines.suite())
+    test_suite.addTest(test_cache.suite())
     test_suite.addTest(test_client.suite())
     test_suite.addTest(test_config.suite())
     test_suite.addTest(test_digest.suite())
     test_suite.addTest(test_server.suite())
+    test_suite.addTest(test_message.suite())
+    test_suite.addTest(test_metrics.suite())
     test_suite.addTest(test_account.suite())
     test_suite.addTest(test_forwarder.suite())
     return test_suite
@@ -0,0 +1,167 @@
+"""Test the pyzor.cache module."""
+
+import os
+import shutil
+import unittest
+import tempfile
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pyzor.cache
+
+DIGEST = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+SERVER = "127.0.0.1:24441"
+
+
+class MemoryCacheTest(unittest.TestCase):
+    """Test the MemoryCache class"""
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.now = 1000.0
+        patch("pyzor.cache.time.time", side_effect=lambda: self.now).start()
+        self.cache = self.get_cache()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.cache.close()
+        patch.stopall()
+
+    def get_cache(self):
+        return pyzor.cache.MemoryCache(hit_ttl=300, miss_ttl=60)
+
+    def test_get(self):
+        self.cache.set(SERVER, DIGEST, 24, 42)
+
+        self.assertEqual(self.cache.get(SERVER, DIGEST), (24, 42))
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_get_missing(self):
+        self.cache.set(SERVER, DIGEST, 24, 42)
+
+        self.assertIsNone(self.cache.get("127.0.0.2:24441", DIGEST))
+        self.assertIsNone(self.cache.get(SERVER, "missing"))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_hit_ttl(self):
+        self.cache.set(SERVER, DIGEST, 1, 0)
+
+        self.now += 299
+        self.assertEqual(self.cache.get(SERVER, DIGEST), (1, 0))
+        self.now += 1
+        self.assertIsNone(self.cache.get(SERVER, DIGEST))
+
+    def test_miss_ttl(self):
+        self.cache.set(SERVER, DIGEST, 0, 0)
+
+        self.now += 59
+        self.assertEqual(self.cache.get(SERVER, DIGEST), (0, 0))
+        self.now += 1
+        self.assertIsNone(self.cache.get(SERVER, DIGEST))
+
+    def test_whitelisted_hit(self):
+        self.cache.set(SERVER, DIGEST, 0, 1)
+
+        self.now += 100
+        self.assertEqual(self.cache.get(SERVER, DIGEST), (0, 1))
+
+    def test_replace(self):
+        self.cache.set(SERVER, DIGEST, 0, 0)
+        self.cache.set(SERVER, DIGEST, 5, 0)
+
+        self.assertEqual(self.cache.get(SERVER, DIGEST), (5, 0))
+
+    def test_invalidate(self):
+        self.cache.set(SERVER, DIGEST, 24, 42)
+
+        self.cache.invalidate(SERVER, DIGEST)
+        self.cache.invalidate(SERVER, "missing")
+
+        self.assertIsNone(self.cache.get(SERVER, DIGEST))
+
+    def test_lru(self):
+        cache = pyzor.cache.MemoryCache(max_size=2)
+        cache.set(SERVER, "a", 1, 0)
+        cache.set(SERVER, "b", 1, 0)
+        cache.get(SERVER, "a")
+
+        cache.set(SERVER, "c", 1, 0)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(SERVER, "b"))
+        self.assertEqual(cache.get(SERVER, "a"), (1, 0))
+
+
+@unittest.skipUnless(pyzor.cache._has_sqlite,
+                     "sqlite3 library not available")
+class FileCacheTest(MemoryCacheTest):
+    """Test the FileCache class"""
+
+    def setUp(self):
+        self.homedir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.homedir, "cache.db")
+        MemoryCacheTest.setUp(self)
+
+    def tearDown(self):
+        MemoryCacheTest.tearDown(self)
+        shutil.rmtree(self.homedir)
+
+    def get_cache(self):
+        return pyzor.cache.FileCache(self.fn, hit_ttl=300, miss_ttl=60)
+
+    def test_lru(self):
+        pass
+
+    def test_shared(self):
+        self.cache.set(SERVER, DIGEST, 24, 42)
+        other = self.get_cache()
+        try:
+            self.assertEqual(other.get(SERVER, DIGEST), (24, 42))
+            other.invalidate(SERVER, DIGEST)
+        finally:
+            other.close()
+
+        self.assertIsNone(self.cache.get(SERVER, DIGEST))
+
+    def test_prune(self):
+        self.cache.set(SERVER, "old", 0, 0)
+        self.now += 60
+        with patch("pyzor.cache.random.randrange", return_value=0):
+            self.cache.set(SERVER, DIGEST, 0, 0)
+
+        count = self.cache._db.execute(
+            "SELECT COUNT(*) FROM results").fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_unusable_path(self):
+        path = os.path.join(self.homedir, "missing", "cache.db")
+        with patch("pyzor.cache.logging.getLogger") as get_logger:
+            cache = pyzor.cache.FileCache(path)
+        self.assertTrue(get_logger.return_value.warning.called)
+
+        cache.set(SERVER, DIGEST, 24, 42)
+        self.assertIsNone(cache.get(SERVER, DIGEST))
+        cache.invalidate(SERVER, DIGEST)
+        cache.close()
+
+    def test_error(self):
+        self.cache._db.execute("DROP TABLE results")
+
+        with patch.object(self.cache, "log"):
+            self.cache.set(SERVER, DIGEST, 24, 42)
+            self.assertIsNone(self.cache.get(SERVER, DIGEST))
+            self.assertTrue(self.cache.log.warning.called)
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(MemoryCacheTest))
+    test_suite.addTest(unittest.makeSuite(FileCacheTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import time
 import email
+import socket
+import functools
 import unittest
 
 try:
@@ -8,6 +10,7 @@ except ImportError:
     from mock import Mock, patch, call
 
 
+import pyzor.cache
 import pyzor.client
 import pyzor.account
 
@@ -46,10 +49,16 @@ class TestBase(unittest.TestCase):
         patch.stopall()
 
     def get_requests(self):
+        """Yield the (data, flags, address) arguments of the requests sent
+        on the connected sockets.
+        """
+        address = None
         for mock_call in self.mock_socket.mock_calls:
             name, args, kwargs = mock_call
-            if name == "socket().sendto":
-                yield args, kwargs
+            if name == "socket().connect":
+                address = args[0]
+            elif name == "socket().send":
+                yield (args[0], 0, address), kwargs
 
     def check_request(self):
         """Check if the request sent by the client is equal
@@ -120,6 +129,37 @@ class ClientTest(TestBase):
         self.patch_all()
         self.check_client(None, "check", digest)
 
+    def check_check_many(self, counts):
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        self.patch_all()
+        response = self.mresponse[0].decode().rstrip("\n")
+        for count, wl_count in counts:
+            response += "\nCount: %d\nWL-Count: %d" % (count, wl_count)
+        self.mresponse = (response + "\n\n").encode(), self.mresponse[1]
+        self.mock_socket.socket.return_value.recvfrom.return_value = \
+            self.mresponse
+
+        client = pyzor.client.Client()
+        response = client.check_many(digests)
+
+        args, _ = list(self.get_requests())[0]
+        request = email.message_from_string(args[0].decode())
+        self.assertEqual(request["Op"], "check")
+        self.assertEqual(request.get_all("Op-Digest"), digests)
+        return response
+
+    def test_check_many(self):
+        """Test the client check request with several digests"""
+        response = self.check_check_many([(24, 42), (0, 0)])
+        self.assertIsInstance(response, pyzor.message.CheckManyResponse)
+        self.assertEqual(response.get_counts(), [(24, 42), (0, 0)])
+
+    def test_check_many_missing_counts(self):
+        """Test a check response without the counts for all digests"""
+        self.assertRaises(pyzor.ProtocolError, self.check_check_many,
+                          [(24, 42)])
+
     def test_info(self):
         """Test the client info request"""
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -171,6 +211,290 @@ class ClientTest(TestBase):
         self.mock_socket.assert_has_calls(calls)
 
 
+class ClientSocketTest(TestBase):
+    """Test reusing the sockets and the addresses of the servers."""
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.patch_all({"error": socket.error, "timeout": socket.timeout})
+        self.client = pyzor.client.Client()
+        self.sock = self.mock_socket.socket.return_value
+
+    def test_reuse(self):
+        for dummy in range(3):
+            self.client.ping()
+
+        self.assertEqual(self.mock_socket.socket.call_count, 1)
+        self.assertEqual(self.mock_socket.getaddrinfo.call_count, 1)
+        self.assertEqual(self.sock.send.call_count, 3)
+        self.sock.connect.assert_called_once_with(("127.0.0.1", 24441))
+        self.assertFalse(self.sock.close.called)
+
+    def test_address_expired(self):
+        self.client.ping()
+        expired = time.time() + self.client.address_ttl + 1
+        with patch("pyzor.client.time.time", return_value=expired):
+            self.client.ping()
+
+        self.assertEqual(self.mock_socket.getaddrinfo.call_count, 2)
+        self.assertEqual(self.mock_socket.socket.call_count, 1)
+
+    def test_address_changed(self):
+        self.client.ping()
+        self.mock_socket.getaddrinfo.return_value = [
+            (2, 2, 17, '', ('127.0.0.2', 24441))]
+        expired = time.time() + self.client.address_ttl + 1
+        with patch("pyzor.client.time.time", return_value=expired):
+            self.client.ping()
+
+        self.assertTrue(self.sock.close.called)
+        self.assertEqual(self.mock_socket.socket.call_count, 2)
+        self.sock.connect.assert_called_with(("127.0.0.2", 24441))
+
+    def test_timeout(self):
+        self.sock.recvfrom.side_effect = socket.timeout
+        self.assertRaises(pyzor.TimeoutError, self.client.ping)
+        self.sock.recvfrom.side_effect = None
+        self.client.ping()
+
+        self.assertTrue(self.sock.close.called)
+        self.assertEqual(self.mock_socket.socket.call_count, 2)
+
+    def test_invalid_thread(self):
+        self.thread += 20
+        self.patch_all({"error": socket.error, "timeout": socket.timeout})
+        client = pyzor.client.Client()
+
+        self.assertRaises(pyzor.ProtocolError, client.ping)
+
+        self.assertTrue(self.mock_socket.socket.return_value.close.called)
+        self.assertEqual(client._idle, {})
+
+    def test_send_error(self):
+        self.client.ping()
+        self.sock.send.side_effect = [socket.error("refused"), None]
+        self.client.ping()
+
+        self.assertTrue(self.sock.close.called)
+        self.assertEqual(self.mock_socket.socket.call_count, 2)
+
+    def test_max_idle(self):
+        self.client.max_idle_sockets = 0
+        for dummy in range(2):
+            self.client.ping()
+
+        self.assertEqual(self.mock_socket.socket.call_count, 2)
+        self.assertEqual(self.sock.close.call_count, 2)
+
+    def test_close(self):
+        self.client.ping()
+        self.client.close()
+
+        self.sock.close.assert_called_once_with()
+        self.client.ping()
+        self.assertEqual(self.mock_socket.getaddrinfo.call_count, 2)
+
+
+class ClientRetransmitTest(TestBase):
+    """Test retransmitting the requests."""
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.patch_all({"error": socket.error, "timeout": socket.timeout})
+        self.client = pyzor.client.Client(retries=2)
+        self.sock = self.mock_socket.socket.return_value
+
+    def make_response(self, thread):
+        self.response["Thread"] = str(thread)
+        response = "".join("%s: %s\n" % (key, value)
+                           for key, value in self.response.items())
+        return (response + "\n").encode(), ("127.0.0.1", 24441)
+
+    def test_retransmit(self):
+        self.sock.recvfrom.side_effect = [socket.timeout, self.mresponse]
+
+        self.client.ping()
+
+        self.assertEqual(self.sock.send.call_count, 2)
+        self.assertEqual(self.sock.settimeout.call_args_list,
+                         [call(1), call(2)])
+        self.assertFalse(self.sock.close.called)
+
+    def test_backoff(self):
+        self.sock.recvfrom.side_effect = [socket.timeout, socket.timeout,
+                                          self.mresponse]
+
+        self.client.ping()
+
+        self.assertEqual(self.sock.send.call_count, 3)
+        # The last wait is for the rest of the timeout.
+        self.assertEqual(self.sock.settimeout.call_args_list,
+                         [call(1), call(2), call(2)])
+
+    def test_timeout(self):
+        self.sock.recvfrom.side_effect = socket.timeout
+
+        self.assertRaises(pyzor.TimeoutError, self.client.ping)
+
+        self.assertEqual(self.sock.send.call_count, 3)
+        self.assertTrue(self.sock.close.called)
+
+    def test_no_retries(self):
+        self.client.retries = 0
+        self.sock.recvfrom.side_effect = socket.timeout
+
+        self.assertRaises(pyzor.TimeoutError, self.client.ping)
+
+        self.assertEqual(self.sock.send.call_count, 1)
+        self.sock.settimeout.assert_called_once_with(5)
+
+    def test_report_not_retransmitted(self):
+        self.sock.recvfrom.side_effect = socket.timeout
+
+        self.assertRaises(pyzor.TimeoutError, self.client.report,
+                          "2aedaac999d71421c9ee49b9d81f627a7bc570aa")
+
+        self.assertEqual(self.sock.send.call_count, 1)
+
+    def test_duplicate(self):
+        self.sock.recvfrom.side_effect = [socket.timeout, self.mresponse]
+        self.client.ping()
+        duplicate = self.mresponse
+        self.thread += 1
+        self.patch_all({"error": socket.error, "timeout": socket.timeout})
+        self.mock_socket.socket.return_value = self.sock
+        self.sock.recvfrom.side_effect = [duplicate,
+                                          self.make_response(self.thread)]
+
+        response = self.client.ping()
+
+        self.assertEqual(response.get_thread(), self.thread)
+        self.assertFalse(self.sock.close.called)
+
+    def test_rtt(self):
+        self.client.ping()
+
+        self.assertIn(("public.pyzor.org", 24441), self.client._rtt)
+
+    def test_rtt_retransmitted(self):
+        self.sock.recvfrom.side_effect = [socket.timeout, self.mresponse]
+
+        self.client.ping()
+
+        self.assertEqual(self.client._rtt, {})
+
+    def test_rto(self):
+        address = ("127.0.0.1", 24441)
+        self.assertEqual(self.client._rto(address), 1)
+        self.client._update_rtt(address, 0.1)
+
+        self.assertAlmostEqual(self.client._rto(address), 0.3)
+
+    def test_rtt_update(self):
+        address = ("127.0.0.1", 24441)
+        self.client._update_rtt(address, 0.1)
+        self.client._update_rtt(address, 0.3)
+
+        srtt, rttvar = self.client._rtt[address]
+        self.assertAlmostEqual(srtt, 0.125)
+        self.assertAlmostEqual(rttvar, 0.0875)
+
+    def test_hedge_delay(self):
+        address = ("127.0.0.1", 24441)
+        for i in range(19):
+            self.client._update_rtt(address, (i + 1) / 100.0)
+        self.assertEqual(self.client._hedge_delay(address),
+                         self.client._rto(address))
+
+        self.client._update_rtt(address, 0.2)
+
+        self.assertEqual(self.client._hedge_delay(address), 0.19)
+
+    def test_hedge_delay_window(self):
+        address = ("127.0.0.1", 24441)
+        for dummy in range(self.client.latency_samples):
+            self.client._update_rtt(address, 2)
+        for dummy in range(self.client.latency_samples):
+            self.client._update_rtt(address, 0.1)
+
+        self.assertEqual(self.client._hedge_delay(address), 0.1)
+
+    def test_min_rto(self):
+        address = ("127.0.0.1", 24441)
+        self.client._update_rtt(address, 0.001)
+
+        self.assertEqual(self.client._rto(address), self.client.min_rto)
+
+
+class ClientCacheTest(TestBase):
+    """Test answering the checks from the cache."""
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+    server = "public.pyzor.org:24441"
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.response["Count"] = "3"
+        self.response["WL-Count"] = "0"
+        self.patch_all()
+        self.cache = pyzor.cache.MemoryCache()
+        self.client = pyzor.client.Client(cache=self.cache)
+
+    def test_check(self):
+        for dummy in range(3):
+            response = self.client.check(self.digest)
+            self.assertEqual(response["Count"], "3")
+            self.assertTrue(response.is_ok())
+
+        self.assertEqual(len(list(self.get_requests())), 1)
+        self.assertEqual(self.cache.get(self.server, self.digest), (3, 0))
+
+    def test_check_error(self):
+        self.response["Code"] = "500"
+        self.patch_all()
+
+        self.client.check(self.digest)
+
+        self.assertIsNone(self.cache.get(self.server, self.digest))
+
+    def test_report(self):
+        self.client.check(self.digest)
+
+        self.client.report(self.digest)
+
+        self.assertIsNone(self.cache.get(self.server, self.digest))
+
+    def test_report_other_server(self):
+        self.client.check(self.digest)
+
+        self.client.report(self.digest, ("127.0.0.1", 24441))
+
+        self.assertEqual(self.cache.get(self.server, self.digest), (3, 0))
+
+    def test_whitelist(self):
+        self.client.check(self.digest)
+
+        self.client.whitelist(self.digest)
+
+        self.assertIsNone(self.cache.get(self.server, self.digest))
+
+    def test_batch_report(self):
+        self.cache.set(self.server, self.digest, 1, 0)
+        client = pyzor.client.BatchClient(cache=self.cache, batch_size=1)
+
+        client.report(self.digest)
+
+        self.assertIsNone(self.cache.get(self.server, self.digest))
+
+    def test_check_many_not_cached(self):
+        self.cache.set(self.server, self.digest, 1, 0)
+        self.response["Count"] = "0"
+        self.patch_all()
+
+        response = self.client.check_many([self.digest])
+
+        self.assertEqual(response.get_counts(), [(0, 0)])
+
+
 class BatchClientTest(TestBase):
     def test_report(self):
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -269,6 +593,308 @@ class BatchClientTest(TestBase):
         self.assertEqual(list(self.get_requests()), [])
 
 
+class MockUDPSocket(object):
+    """A socket that answers the requests sent to the `answering`
+    addresses, in the reverse order they were sent.
+    """
+
+    def __init__(self, answering):
+        self.answering = answering
+        self.sent = []
+        self.queued = []
+        self.max_queued = 0
+        # The number of requests lost before reaching the server.
+        self.lost = 0
+        # Address -> response code, if not 200.
+        self.codes = {}
+
+    def sendto(self, data, flags, address):
+        request = email.message_from_string(data.decode())
+        self.sent.append((request, address))
+        if self.lost:
+            self.lost -= 1
+        elif address in self.answering:
+            response = ("Code: %s\nDiag: OK\nPV: %s\nThread: %s\n"
+                        "Op-Digest: %s\nCount: 0\nWL-Count: 0\n\n" % (self.codes.get(address, 200),
+                                                pyzor.proto_version,
+                                                request["Thread"],
+                                                request["Op-Digest"]))
+            self.queued.append((response.encode(), address))
+            self.max_queued = max(self.max_queued, len(self.queued))
+
+    def recvfrom(self, size):
+        return self.queued.pop()
+
+    def close(self):
+        pass
+
+
+class MultiplexerTest(unittest.TestCase):
+    servers = [("127.0.0.1", 24441), ("127.0.0.2", 24441)]
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.now = 1000.0
+        self.sock = MockUDPSocket(self.servers)
+        patch("pyzor.account.sign_msg", return_value="TestSig").start()
+        patch("pyzor.account.hash_key").start()
+        patch("pyzor.client.time.time", side_effect=lambda: self.now).start()
+        patch("pyzor.client.select.select", side_effect=self.select).start()
+        patch("pyzor.client.socket.socket", return_value=self.sock).start()
+        self.getaddrinfo = patch("pyzor.client.socket.getaddrinfo",
+                                 side_effect=self.getaddrinfo).start()
+        self.client = pyzor.client.Client(timeout=5)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def select(self, rlist, wlist, xlist, timeout):
+        if self.sock.queued:
+            return [self.sock], [], []
+        self.now += timeout
+        return [], [], []
+
+    def getaddrinfo(self, host, port, *args):
+        return [(2, 2, 17, "", (host, port))]
+
+    def run_requests(self, digests, servers=None, window=None):
+        if servers is None:
+            servers = self.servers
+        requests = (((digest, server), pyzor.message.CheckRequest(digest),
+                     server)
+                    for digest in digests for server in servers)
+        self.multiplexer = pyzor.client.Multiplexer(self.client, window)
+        results = list(self.multiplexer.run(requests))
+        self.multiplexer.close()
+        return results
+
+    def test_responses(self):
+        digests = ["%040x" % i for i in range(3)]
+
+        results = self.run_requests(digests)
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(self.sock.sent), 6)
+        for (digest, server), response, error in results:
+            self.assertIsNone(error)
+            self.assertEqual(response["Op-Digest"], digest)
+        self.assertEqual(sorted(key for key, _, _ in results),
+                         sorted((digest, server) for digest in digests
+                                for server in self.servers))
+
+    def test_timeout(self):
+        server = ("127.0.0.3", 24441)
+
+        results = self.run_requests(["%040x" % 1], self.servers + [server])
+
+        self.assertEqual([key[1] for key, _, _ in results],
+                         self.servers[::-1] + [server])
+        key, response, error = results[-1]
+        self.assertIsNone(response)
+        self.assertIsInstance(error, pyzor.TimeoutError)
+        self.assertEqual(self.now, 1005.0)
+
+    def test_send_error(self):
+        self.getaddrinfo.side_effect = socket.gaierror("unknown host")
+
+        results = self.run_requests(["%040x" % 1])
+
+        self.assertEqual(len(results), 2)
+        for key, response, error in results:
+            self.assertIsNone(response)
+            self.assertIsInstance(error, pyzor.CommError)
+
+    def test_unique_thread(self):
+        patch("pyzor.message.ThreadId.generate",
+              side_effect=[5, 5, 6]).start()
+
+        results = self.run_requests(["%040x" % 1])
+
+        self.assertEqual([request["Thread"] for request, _ in self.sock.sent],
+                         ["5", "6"])
+        self.assertEqual([error for _, _, error in results], [None, None])
+
+    def test_unexpected(self):
+        self.sock.queued.append((b"Code: 200\nDiag: OK\nPV: 2.1\n"
+                                 b"Thread: 1\n\n", self.servers[0]))
+        patch("pyzor.message.ThreadId.generate", return_value=2).start()
+
+        results = self.run_requests(["%040x" % 1], self.servers[:1])
+
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(results[0][2])
+
+    def test_retransmit(self):
+        self.client.retries = 2
+        self.sock.lost = 2
+
+        results = self.run_requests(["%040x" % 1], self.servers[:1])
+
+        self.assertIsNone(results[0][2])
+        self.assertEqual(len(self.sock.sent), 3)
+        # Retransmitted after one second, then after two more.
+        self.assertEqual(self.now, 1003.0)
+        thread = int(self.sock.sent[0][0]["Thread"])
+        self.assertIn(thread, self.multiplexer._late)
+
+    def test_retransmit_timeout(self):
+        self.client.retries = 2
+        server = ("127.0.0.3", 24441)
+
+        results = self.run_requests(["%040x" % 1], [server])
+
+        self.assertIsInstance(results[0][2], pyzor.TimeoutError)
+        self.assertEqual(len(self.sock.sent), 3)
+        self.assertEqual(self.now, 1005.0)
+
+    def test_report_not_retransmitted(self):
+        self.client.retries = 2
+        self.sock.lost = 1
+        request = pyzor.message.ReportRequest("%040x" % 1)
+        multiplexer = pyzor.client.Multiplexer(self.client)
+
+        results = list(multiplexer.run([(1, request, self.servers[0])]))
+
+        self.assertIsInstance(results[0][2], pyzor.TimeoutError)
+        self.assertEqual(len(self.sock.sent), 1)
+
+    def test_rtt(self):
+        self.run_requests(["%040x" % 1], self.servers[:1])
+
+        self.assertIn(self.servers[0], self.client._rtt)
+
+    def test_late_thread_not_reused(self):
+        self.client.retries = 1
+        self.sock.lost = 1
+        patch("pyzor.message.ThreadId.generate",
+              side_effect=[5, 5, 6]).start()
+        multiplexer = pyzor.client.Multiplexer(self.client)
+
+        for dummy in range(2):
+            list(multiplexer.run([(1, pyzor.message.CheckRequest("%040x" % 1),
+                                   self.servers[0])]))
+
+        self.assertEqual([request["Thread"] for request, _ in self.sock.sent],
+                         ["5", "5", "6"])
+
+    def run_hedged(self, servers):
+        request = functools.partial(pyzor.message.CheckRequest, "%040x" % 1)
+        multiplexer = pyzor.client.Multiplexer(self.client)
+        results = list(multiplexer.run_hedged([(1, request, servers)]))
+        multiplexer.close()
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_hedged(self):
+        key, address, response, error = self.run_hedged(self.servers)
+
+        self.assertEqual(address, self.servers[0])
+        self.assertTrue(response.is_ok())
+        self.assertEqual(len(self.sock.sent), 1)
+
+    def test_hedged_fastest(self):
+        self.client._update_rtt(self.servers[1], 0.1)
+
+        key, address, response, error = self.run_hedged(self.servers)
+
+        self.assertEqual(address, self.servers[1])
+        self.assertEqual([server for _, server in self.sock.sent],
+                         [self.servers[1]])
+
+    def test_hedged_slow(self):
+        slow = ("127.0.0.3", 24441)
+
+        key, address, response, error = self.run_hedged([slow] +
+                                                        self.servers)
+
+        self.assertEqual(address, self.servers[0])
+        self.assertEqual([server for _, server in self.sock.sent],
+                         [slow, self.servers[0]])
+        # Sent to the next server after the initial retransmission timeout.
+        self.assertEqual(self.now, 1001.0)
+
+    def test_hedged_error(self):
+        self.sock.codes[self.servers[0]] = 500
+
+        key, address, response, error = self.run_hedged(self.servers)
+
+        self.assertEqual(address, self.servers[1])
+        self.assertTrue(response.is_ok())
+        self.assertEqual(self.now, 1000.0)
+
+    def test_hedged_all_errors(self):
+        for server in self.servers:
+            self.sock.codes[server] = 500
+
+        key, address, response, error = self.run_hedged(self.servers)
+
+        self.assertEqual(address, self.servers[1])
+        self.assertEqual(response.get_code(), 500)
+        self.assertIsNone(error)
+
+    def test_hedged_timeout(self):
+        slow = [("127.0.0.3", 24441), ("127.0.0.4", 24441)]
+
+        key, address, response, error = self.run_hedged(slow)
+
+        self.assertEqual(address, slow[1])
+        self.assertIsInstance(error, pyzor.TimeoutError)
+        self.assertEqual(len(self.sock.sent), 2)
+        # The first deadline, since the second server was tried after one
+        # second.
+        self.assertEqual(self.now, 1006.0)
+
+    def test_check_hedged(self):
+        address, response = self.client.check_hedged("%040x" % 1,
+                                                     self.servers)
+
+        self.assertEqual(address, self.servers[0])
+        self.assertTrue(response.is_ok())
+
+    def test_check_hedged_error(self):
+        self.assertRaises(pyzor.TimeoutError, self.client.check_hedged,
+                          "%040x" % 1, [("127.0.0.3", 24441)])
+
+    def test_cached(self):
+        self.client.cache = pyzor.cache.MemoryCache()
+
+        for dummy in range(2):
+            results = self.run_requests(["%040x" % 1])
+
+        self.assertEqual(len(self.sock.sent), 2)
+        self.assertEqual([error for _, _, error in results], [None, None])
+        self.assertEqual(self.client.cache.hits, 2)
+
+    def test_cached_hedged(self):
+        self.client.cache = pyzor.cache.MemoryCache()
+        self.client.cache.set("%s:%s" % self.servers[1], "%040x" % 1, 2, 0)
+
+        key, address, response, error = self.run_hedged(self.servers)
+
+        self.assertEqual(address, self.servers[1])
+        self.assertEqual(response["Count"], "2")
+        self.assertEqual(self.sock.sent, [])
+
+    def test_cache_invalidated(self):
+        self.client.cache = pyzor.cache.MemoryCache()
+        self.client.cache.set("%s:%s" % self.servers[0], "%040x" % 1, 2, 0)
+        request = pyzor.message.ReportRequest("%040x" % 1)
+        multiplexer = pyzor.client.Multiplexer(self.client)
+
+        list(multiplexer.run([(1, request, self.servers[0])]))
+
+        self.assertIsNone(self.client.cache.get("%s:%s" % self.servers[0],
+                                                "%040x" % 1))
+
+    def test_window(self):
+        results = self.run_requests(["%040x" % i for i in range(5)],
+                                    window=1)
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.sock.max_queued, 1)
+
+
 class ClientRunnerTest(unittest.TestCase):
 
     def setUp(self):
@@ -371,7 +997,11 @@ def suite():
     """Gather all the tests from this module in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(ClientTest))
+    test_suite.addTest(unittest.makeSuite(ClientSocketTest))
+    test_suite.addTest(unittest.makeSuite(ClientRetransmitTest))
+    test_suite.addTest(unittest.makeSuite(ClientCacheTest))
     test_suite.addTest(unittest.makeSuite(BatchClientTest))
+    test_suite.addTest(unittest.makeSuite(MultiplexerTest))
     test_suite.addTest(unittest.makeSuite(ClientRunnerTest))
 
     return test_suite
@@ -1,3 +1,4 @@
+import io
 import os
 import logging
 import unittest
@@ -249,6 +250,71 @@ class TestLogSetup(unittest.TestCase):
         self.assertEqual(log.handlers[0].level, logging.DEBUG)
         self.assertEqual(log.handlers[1].level, logging.DEBUG)
 
+    def test_logging_queue(self):
+        pyzor.config.setup_logging("pyzor.test5", self.log_file, False,
+                                   queue_size=10)
+        log = logging.getLogger("pyzor.test5")
+        self.assertIsInstance(log.handlers[1], pyzor.config.QueuedHandler)
+        self.assertEqual(log.handlers[1].level, logging.INFO)
+        log.info("test %s", "message")
+        log.handlers[1].flush()
+        log.handlers[1].close()
+        with open(self.log_file) as logf:
+            self.assertIn("INFO test message", logf.read())
+
+
+class TestQueuedHandler(unittest.TestCase):
+    def setUp(self):
+        super(TestQueuedHandler, self).setUp()
+        self.stream = io.StringIO()
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.handler = pyzor.config.QueuedHandler(target, queue_size=5,
+                                                  interval=0.01)
+
+    def tearDown(self):
+        super(TestQueuedHandler, self).tearDown()
+        self.handler.close()
+
+    def get_record(self, message, *args):
+        return logging.makeLogRecord({"levelno": logging.INFO,
+                                      "levelname": "INFO",
+                                      "msg": message, "args": args})
+
+    def test_write(self):
+        for i in range(3):
+            self.handler.handle(self.get_record(u"test %d", i))
+        self.handler.flush()
+        self.assertEqual(self.stream.getvalue(),
+                         u"INFO test 0\nINFO test 1\nINFO test 2\n")
+
+    def test_batch(self):
+        records = [self.get_record(u"test %d", i) for i in range(3)]
+        self.stream.flush = Mock()
+        self.handler.write(records)
+        self.assertEqual(self.stream.flush.call_count, 1)
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 3)
+
+    def test_dropped(self):
+        # Stop the writer thread, so that the queue fills up.
+        self.handler.handle(self.get_record(u"test"))
+        self.handler._stop.set()
+        self.handler.thread.join()
+        for i in range(20):
+            self.handler.handle(self.get_record(u"test %d", i))
+        self.assertEqual(self.handler.dropped, 15)
+        self.handler.flush()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[-1],
+                         u"WARNING 15 log records dropped because the queue "
+                         u"was full")
+
+    def test_close(self):
+        self.handler.handle(self.get_record(u"test"))
+        self.handler.close()
+        self.assertEqual(self.stream.getvalue(), u"INFO test\n")
+
 
 class TestExpandHomeFiles(unittest.TestCase):
     home = "/home/user/pyzor"
@@ -298,6 +364,7 @@ def suite():
     """Gather all the tests from this module in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestLogSetup))
+    test_suite.addTest(unittest.makeSuite(TestQueuedHandler))
     test_suite.addTest(unittest.makeSuite(TestAccessLoad))
     test_suite.addTest(unittest.makeSuite(TestPasswdLoad))
     test_suite.addTest(unittest.makeSuite(TestServersLoad))
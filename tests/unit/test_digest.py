@@ -1,6 +1,7 @@
 """The the pyzor.digest module
 """
 
+import random
 import unittest
 
 import pyzor.digest
@@ -162,6 +163,42 @@ class PreDigestTests(unittest.TestCase):
         self.assertEqual(self.lines, expected)
 
 
+class NormalizeTests(unittest.TestCase):
+    """The single pass normalize() must give the same result as applying
+    the patterns one by one.
+    """
+    lines = ["",
+             "   ",
+             "Test test@example.com Test2",
+             "Test @example a@b @@ x@ @y Test2",
+             "Test http://example.com x:y :y x: 1:ab:c HTTP:x Test2",
+             "ab:cd@ef 0123456789 012345678 abc\x00defghijk",
+             u"\ttabs\tand nbsp\xa0em\u2003space\x1cseparator ",
+             u"case folding \u017f:x \u212a:y \u0130:z",
+             "Email spam, also known as junk email or unsolicited bulk email"]
+
+    def check_normalize(self, line):
+        self.assertEqual(DataDigester.normalize(line),
+                         DataDigester.normalize_patterns(line), repr(line))
+
+    def test_lines(self):
+        for line in self.lines:
+            self.check_normalize(line)
+
+    def test_random(self):
+        chars = u"abcAZ019:@ .\t\x00\xa0\u2003\u017f\u212a\u0130"
+        rand = random.Random(42)
+        for dummy in range(2000):
+            self.check_normalize("".join(rand.choice(chars)
+                                         for dummy in range(30)))
+
+    def test_changed_patterns(self):
+        with patch("pyzor.digest.DataDigester.longstr_ptrn",
+                   re.compile(r'\S{100,}')):
+            self.assertEqual(DataDigester.normalize("a 0123456789 b"),
+                             "a0123456789b")
+
+
 class DigestTests(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
@@ -297,6 +334,7 @@ def suite():
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(HTMLStripperTests))
     test_suite.addTest(unittest.makeSuite(PreDigestTests))
+    test_suite.addTest(unittest.makeSuite(NormalizeTests))
     test_suite.addTest(unittest.makeSuite(DigestTests))
     test_suite.addTest(unittest.makeSuite(MessageDigestTest))
     return test_suite
@@ -10,16 +10,26 @@ import unittest
 def suite():
     """Gather all the tests from this package in a test suite."""
     import test_gdbm
+    import test_cache
+    import test_lmdb
     import test_mysql
     import test_redis
     import test_redis_v0
+    import test_replica
+    import test_sqlite
+    import test_writebehind
 
     test_suite = unittest.TestSuite()
 
     test_suite.addTest(test_gdbm.suite())
+    test_suite.addTest(test_cache.suite())
+    test_suite.addTest(test_lmdb.suite())
     test_suite.addTest(test_mysql.suite())
     test_suite.addTest(test_redis.suite())
     test_suite.addTest(test_redis_v0.suite())
+    test_suite.addTest(test_replica.suite())
+    test_suite.addTest(test_sqlite.suite())
+    test_suite.addTest(test_writebehind.suite())
     return test_suite
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+"""Test the pyzor.engines.cache module."""
+
+import unittest
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+import pyzor.engines.cache
+import pyzor.engines.common
+
+
+class MockEngine(dict, pyzor.engines.common.BaseEngine):
+    """A dictionary based engine that counts the lookups."""
+    handles_one_step = True
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return dict.__getitem__(self, key)
+
+    def report(self, keys):
+        for key in keys:
+            self.setdefault(key, pyzor.engines.common.Record()).r_increment()
+
+    def whitelist(self, keys):
+        for key in keys:
+            self.setdefault(key, pyzor.engines.common.Record()).wl_increment()
+
+
+class CachedDBHandleTest(unittest.TestCase):
+
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.time = 1000
+        patch("pyzor.engines.cache.time.time",
+              side_effect=lambda: self.time).start()
+        self.record = pyzor.engines.common.Record(24, 42)
+        self.engine = MockEngine({self.digest: self.record})
+        self.db = pyzor.engines.cache.CachedDBHandle(self.engine, 2, 60)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_hit(self):
+        self.assertIs(self.db[self.digest], self.record)
+        self.assertIs(self.db[self.digest], self.record)
+        self.assertEqual(self.engine.lookups, 1)
+        self.assertEqual((self.db.hits, self.db.misses), (1, 1))
+
+    def test_metrics(self):
+        self.db.metrics = Mock()
+        self.db[self.digest]
+        self.db.get_many([self.digest, "missing"])
+        self.assertEqual(self.db.metrics.record_cache.call_args_list,
+                         [((0, 1),), ((1, 1),)])
+
+    def test_missing(self):
+        self.assertRaises(KeyError, self.db.__getitem__, "missing")
+        self.assertRaises(KeyError, self.db.__getitem__, "missing")
+        self.assertEqual(self.engine.lookups, 1)
+        self.assertEqual((self.db.hits, self.db.misses), (1, 1))
+
+    def test_expired(self):
+        self.db[self.digest]
+        self.time += 61
+        self.db[self.digest]
+        self.assertEqual(self.engine.lookups, 2)
+        self.assertEqual((self.db.hits, self.db.misses), (0, 2))
+
+    def test_lru(self):
+        self.engine["a"] = self.engine["b"] = pyzor.engines.common.Record()
+        self.db[self.digest]
+        self.db["a"]
+        # Make the first digest the most recently used.
+        self.db[self.digest]
+        self.db["b"]
+        self.engine.lookups = 0
+        self.db[self.digest]
+        self.db["a"]
+        self.assertEqual(self.engine.lookups, 1)
+
+    def test_get_many(self):
+        self.db[self.digest]
+        records = self.db.get_many([self.digest, "missing", "missing"])
+        self.assertIs(records[0], self.record)
+        self.assertEqual(records[1].r_count, 0)
+        self.assertIs(records[1], records[2])
+        self.assertEqual(self.engine.lookups, 2)
+        self.assertEqual((self.db.hits, self.db.misses), (1, 2))
+
+        records = self.db.get_many(["missing"])
+        self.assertEqual(self.engine.lookups, 2)
+        self.assertEqual((self.db.hits, self.db.misses), (2, 2))
+
+    def test_get_many_missing(self):
+        records = self.db.get_many(["missing"])
+        self.assertEqual(records[0].r_count, 0)
+
+        self.assertRaises(KeyError, self.db.__getitem__, "missing")
+        self.assertEqual(self.db.get_many(["missing"])[0].r_count, 0)
+        self.assertEqual(self.engine.lookups, 1)
+
+    def test_set_many(self):
+        self.db[self.digest]
+        record = pyzor.engines.common.Record(1, 2)
+        self.db.set_many([(self.digest, record), ("new", record)])
+        self.assertIs(self.engine[self.digest], record)
+        self.assertIs(self.engine["new"], record)
+        self.assertIs(self.db[self.digest], record)
+        self.assertIs(self.db["new"], record)
+        self.assertEqual(self.engine.lookups, 3)
+
+    def test_report(self):
+        self.assertEqual(self.db[self.digest].r_count, 24)
+        self.db.report([self.digest])
+        self.assertEqual(self.db[self.digest].r_count, 25)
+        self.assertEqual(self.engine.lookups, 2)
+
+    def test_report_new(self):
+        self.assertRaises(KeyError, self.db.__getitem__, "new")
+        self.db.report(["new"])
+        self.assertEqual(self.db["new"].r_count, 1)
+
+    def test_whitelist(self):
+        self.assertEqual(self.db[self.digest].wl_count, 42)
+        self.db.whitelist([self.digest])
+        self.assertEqual(self.db[self.digest].wl_count, 43)
+
+    def test_increment_many(self):
+        self.assertEqual(self.db[self.digest].r_count, 24)
+        delta = pyzor.engines.common.Record(r_count=2)
+        self.db.increment_many([(self.digest, delta)])
+        self.assertEqual(self.db[self.digest].r_count, 26)
+        # One lookup for the increment, and the entry was invalidated.
+        self.assertEqual(self.engine.lookups, 3)
+
+    def test_set(self):
+        self.db[self.digest]
+        record = pyzor.engines.common.Record(1, 2)
+        self.db[self.digest] = record
+        self.assertIs(self.db[self.digest], record)
+        self.assertIs(self.engine[self.digest], record)
+        self.assertEqual(self.db.hits, 1)
+
+    def test_delete(self):
+        self.db[self.digest]
+        del self.db[self.digest]
+        self.assertRaises(KeyError, self.db.__getitem__, self.digest)
+
+    def test_stale_read(self):
+        """A record read before an invalidation is not cached."""
+        generation = self.db._generation
+        self.db.report([self.digest])
+        self.db._store(self.digest, self.record, generation)
+        self.db[self.digest]
+        self.assertEqual(self.db.hits, 0)
+
+    def test_attributes(self):
+        self.assertTrue(self.db.handles_one_step)
+        self.engine.max_age = 3600
+        self.assertEqual(self.db.max_age, 3600)
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(CachedDBHandleTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
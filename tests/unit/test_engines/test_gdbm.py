@@ -10,6 +10,11 @@ from datetime import datetime, timedelta
 import pyzor.engines.gdbm_
 import pyzor.engines.common
 
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
 class MockTimer():
     def __init__(self, *args, **kwargs):
         pass
@@ -21,23 +26,24 @@ class MockTimer():
 class MockGdbmDB(dict):
     """Mock a gdbm database"""
 
+    reorganized = False
+
     def firstkey(self):
         if not self.keys():
             return None
-        self.key_index = 1
-        return list(self.keys())[0]
+        return sorted(self.keys())[0]
 
     def nextkey(self, key):
-        if len(self.keys()) <= self.key_index:
+        keys = sorted(self.keys())
+        try:
+            return keys[keys.index(key) + 1]
+        except (ValueError, IndexError):
             return None
-        else:
-            self.key_index += 1
-            return self.keys()[self.key_index]
 
     def sync(self):
         pass
     def reorganize(self):
-        pass
+        self.reorganized = True
 
 class GdbmTest(unittest.TestCase):
     """Test the GdbmDBHandle class"""
@@ -85,6 +91,12 @@ class GdbmTest(unittest.TestCase):
                                          record.r_updated, record.wl_count,
                                          record.wl_entered, record.wl_updated)).encode("utf8")
 
+    def assert_record(self, record, expected=None):
+        if not expected:
+            expected = self.record
+        for field in pyzor.engines.gdbm_.GdbmDBHandle.fields:
+            self.assertEqual(getattr(record, field), getattr(expected, field))
+
     def test_set_item(self):
         """Test GdbmDBHandle.__setitem__"""
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -92,6 +104,17 @@ class GdbmTest(unittest.TestCase):
         handle = self.handler(None, None, max_age=self.max_age)
         handle[digest] = self.record
 
+        self.assertEqual(self.db[digest][:1], b"\x02")
+        self.assert_record(handle.decode_record(self.db[digest]))
+
+    def test_set_item_version_1(self):
+        """Test GdbmDBHandle.__setitem__ with the text format"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        with patch.object(self.handler, "this_version", '1'):
+            handle[digest] = self.record
+
         self.assertEqual(self.db[digest], self.record_as_str().decode("utf8"))
 
     def test_get_item(self):
@@ -105,6 +128,96 @@ class GdbmTest(unittest.TestCase):
 
         self.assertEqual(self.record_as_str(result), self.record_as_str())
 
+    def test_get_many(self):
+        """Test GdbmDBHandle.get_many"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        self.db[digest] = self.record_as_str()
+
+        result = handle.get_many([digest, "missing"])
+
+        self.assertEqual(self.record_as_str(result[0]), self.record_as_str())
+        self.assertEqual(self.record_as_str(result[1]),
+                         self.record_as_str(pyzor.engines.common.Record()))
+
+    def test_set_many(self):
+        """Test GdbmDBHandle.set_many"""
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        handle.set_many([(digest, self.record) for digest in digests])
+
+        for digest in digests:
+            self.assert_record(handle.decode_record(self.db[digest]))
+
+    def test_get_item_version_0(self):
+        """Test GdbmDBHandle.__getitem__ with a version 0 record"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        self.db[digest] = b"24,1400000000,1400000060"
+
+        result = handle[digest]
+
+        expected = pyzor.engines.common.Record(
+            24, 0, datetime.fromtimestamp(1400000000),
+            datetime.fromtimestamp(1400000060))
+        self.assert_record(result, expected)
+
+    def test_get_item_version_2(self):
+        """Test GdbmDBHandle.__getitem__ with a version 2 record"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        self.db[digest] = handle.encode_record(self.record)
+
+        self.assert_record(handle[digest])
+
+    def test_version_2_no_dates(self):
+        """Test encoding a record without timestamps in version 2"""
+        handle = self.handler(None, None, max_age=self.max_age)
+        record = pyzor.engines.common.Record(r_count=sys.maxsize)
+
+        encoded = handle.encode_record(record)
+
+        self.assertEqual(len(encoded), 49)
+        self.assert_record(handle.decode_record(encoded), record)
+
+    def test_version_2_old_dates(self):
+        """Test encoding timestamps before the epoch in version 2"""
+        handle = self.handler(None, None, max_age=self.max_age)
+        record = pyzor.engines.common.Record(
+            1, 0, datetime(1969, 12, 31, 23, 59, 59, 999999),
+            datetime(1900, 1, 1))
+
+        self.assert_record(handle.decode_record(handle.encode_record(record)),
+                           record)
+
+    def test_decode_invalid(self):
+        """Test decoding an unknown record version"""
+        handle = self.handler(None, None, max_age=self.max_age)
+        self.assertRaises(ValueError, handle.decode_record, b"3,1,2,3,4")
+        self.assertRaises(ValueError, handle.decode_record, b"\x02,1")
+
+    def test_upgrade_on_write(self):
+        """Test that records are written in version 2 after an update"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+        handle = self.handler(None, None, max_age=self.max_age)
+        self.db[digest] = self.record_as_str()
+
+        delta = pyzor.engines.common.Record()
+        delta.r_increment()
+        handle.increment_many([(digest, delta)])
+
+        self.assertEqual(self.db[digest][:1], b"\x02")
+        expected = pyzor.engines.common.Record(
+            self.r_count + 1, self.wl_count, self.entered, delta.r_updated,
+            self.wl_entered, self.wl_updated)
+        self.assert_record(handle[digest], expected)
+
     def test_items(self):
         """Test GdbmDBHandle.items()"""
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -155,6 +268,84 @@ class GdbmTest(unittest.TestCase):
 
         self.assertEqual(self.db[digest], self.record_as_str())
 
+    def add_records(self, count, updated, prefix="0"):
+        digests = [prefix + "%039x" % i for i in range(count)]
+        record = pyzor.engines.common.Record(1, 0, updated, updated)
+        for digest in digests:
+            self.db[digest] = self.handler.encode_record(record)
+        return digests
+
+    def test_expire_incremental(self):
+        """Test that expired records are removed a few keys at a time"""
+        self.add_records(6, datetime.now() - timedelta(days=2))
+        self.add_records(3, datetime.now(), prefix="f")
+
+        with patch.object(self.handler, "expire_batch_size", 4):
+            handle = self.handler(None, None, max_age=3600 * 24)
+            self.assertEqual(len(self.db), 5)
+            handle._really_expire()
+            self.assertEqual(len(self.db), 3)
+            handle._really_expire()
+            self.assertIsNone(handle._expire_cursor)
+            # The next pass starts from the first key.
+            handle._really_expire()
+            self.assertIsNone(handle._expire_cursor)
+            self.assertEqual(len(self.db), 3)
+        self.assertFalse(self.db.reorganized)
+
+    def test_expire_cursor(self):
+        """Test that the expiry continues from where it stopped"""
+        digests = self.add_records(5, datetime.now())
+
+        with patch.object(self.handler, "expire_batch_size", 2):
+            handle = self.handler(None, None, max_age=3600 * 24)
+            self.assertEqual(handle._expire_cursor, digests[2])
+            handle._really_expire()
+            self.assertEqual(handle._expire_cursor, digests[4])
+            # The key at the cursor was removed meanwhile.
+            del self.db[digests[4]]
+            handle._really_expire()
+            self.assertIsNone(handle._expire_cursor)
+
+    def test_expire_whitelisted(self):
+        """Test that records that were only whitelisted don't expire"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        old = datetime.now() - timedelta(days=2)
+        self.db[digest] = self.handler.encode_record(
+            pyzor.engines.common.Record(0, 1, None, None, old, old))
+
+        self.handler(None, None, max_age=3600 * 24)
+
+        self.assertIn(digest, self.db)
+
+    def test_expire_locked(self):
+        """Test that the expiry waits for the requests using the database"""
+        self.add_records(3, datetime.now() - timedelta(days=2))
+        handle = self.handler(None, None, max_age=None)
+        handle.max_age = 3600 * 24
+
+        with handle.db_lock:
+            expire = threading.Thread(target=handle.start_expiring)
+            expire.start()
+            expire.join(0.1)
+            self.assertEqual(len(self.db), 3)
+        expire.join()
+
+        self.assertEqual(len(self.db), 0)
+
+    def test_reorganize(self):
+        """Test GdbmDBHandle.reorganize"""
+        old = datetime.now() - timedelta(days=2)
+        self.add_records(3, old)
+
+        handle = self.handler(None, None, max_age=None)
+        handle.max_age = 3600 * 24
+        handle.reorganize()
+
+        self.assertEqual(len(self.db), 0)
+        self.assertTrue(self.db.reorganized)
+
+
 class ThreadingGdbmTest(GdbmTest):
     """Test the GdbmDBHandle class"""
     handler = pyzor.engines.gdbm_.ThreadedGdbmDBHandle
@@ -0,0 +1,288 @@
+"""Test the pyzor.engines.lmdb_ module."""
+
+import os
+import shutil
+import unittest
+import tempfile
+
+from datetime import datetime, timedelta
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+import pyzor.engines.lmdb_
+import pyzor.engines.common
+
+
+@unittest.skipUnless(pyzor.engines.lmdb_._has_lmdb,
+                     "lmdb library not available")
+class LMDBTest(unittest.TestCase):
+    """Test the LMDBDBHandle class"""
+
+    handler = pyzor.engines.lmdb_.LMDBDBHandle
+
+    max_age = 60 * 60 * 24 * 30 * 4
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.engines.lmdb_.threading.Timer").start()
+        self.homedir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.homedir, "pyzord.lmdb")
+        self.record = pyzor.engines.common.Record(
+            24, 42, datetime.now() - timedelta(days=10),
+            datetime.now() - timedelta(days=2),
+            datetime.now() - timedelta(days=20),
+            datetime.now() - timedelta(days=3))
+        self.handles = []
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        for handle in self.handles:
+            handle.close()
+        shutil.rmtree(self.homedir)
+        patch.stopall()
+
+    def get_handle(self, mode="c", max_age=None):
+        handle = self.handler(self.fn, mode, max_age=max_age)
+        self.handles.append(handle)
+        return handle
+
+    def close_handle(self, handle):
+        self.handles.remove(handle)
+        handle.close()
+
+    def assert_record(self, record, expected=None):
+        if not expected:
+            expected = self.record
+        for field in ("r_count", "r_entered", "r_updated",
+                      "wl_count", "wl_entered", "wl_updated"):
+            self.assertEqual(getattr(record, field), getattr(expected, field))
+
+    def add_records(self, handle, count, updated, prefix="0"):
+        digests = [prefix + "%039x" % i for i in range(count)]
+        record = pyzor.engines.common.Record(1, 0, updated, updated)
+        handle.set_many([(digest, record) for digest in digests])
+        return digests
+
+    def test_set_get(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        self.assert_record(handle[self.digest])
+
+    def test_get_missing(self):
+        handle = self.get_handle()
+        self.assertRaises(KeyError, handle.__getitem__, self.digest)
+
+    def test_get_many(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        result = handle.get_many([self.digest, "missing"])
+
+        self.assert_record(result[0])
+        self.assert_record(result[1], pyzor.engines.common.Record())
+
+    def test_set_many(self):
+        digests = [self.digest, "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        handle = self.get_handle()
+
+        handle.set_many([(digest, self.record) for digest in digests])
+
+        for digest in digests:
+            self.assert_record(handle[digest])
+
+    def test_del_item(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        del handle[self.digest]
+
+        self.assertRaises(KeyError, handle.__getitem__, self.digest)
+        self.assertRaises(KeyError, handle.__delitem__, self.digest)
+
+    def test_items(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        self.assertEqual(list(handle), [self.digest])
+        key, record = handle.items()[0]
+        self.assertEqual(key, self.digest)
+        self.assert_record(record)
+
+    def test_items_invalid(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        with handle.env.begin(write=True) as txn:
+            txn.put(b"invalid", b"1,2,3")
+
+        with patch.object(handle, "log"):
+            self.assertEqual([key for key, record in handle.items()],
+                             [self.digest])
+
+    def test_report(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        handle.report([self.digest, "missing"])
+
+        self.assertEqual(handle[self.digest].r_count, 25)
+        self.assertEqual(handle[self.digest].wl_count, 42)
+        self.assertEqual(handle["missing"].r_count, 1)
+        self.assertEqual(handle["missing"].wl_count, 0)
+
+    def test_whitelist(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        handle.whitelist([self.digest, "missing"])
+
+        self.assertEqual(handle[self.digest].r_count, 24)
+        self.assertEqual(handle[self.digest].wl_count, 43)
+        self.assertEqual(handle["missing"].r_count, 0)
+        self.assertEqual(handle["missing"].wl_count, 1)
+
+    def test_increment_many(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        delta = pyzor.engines.common.Record()
+        delta.r_increment()
+        delta.r_increment()
+
+        handle.increment_many([(self.digest, delta), ("missing", delta)])
+
+        self.assertEqual(handle[self.digest].r_count, 26)
+        self.assertEqual(handle[self.digest].r_entered, self.record.r_entered)
+        self.assertEqual(handle[self.digest].r_updated, delta.r_updated)
+        self.assert_record(handle["missing"], delta)
+
+    def test_readonly(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        self.close_handle(handle)
+        readonly = self.get_handle("r", max_age=self.max_age)
+
+        self.assert_record(readonly[self.digest])
+        with patch.object(readonly, "log"):
+            self.assertRaises(pyzor.engines.common.DatabaseError,
+                              readonly.__setitem__, self.digest, self.record)
+
+    def test_expire_incremental(self):
+        handle = self.get_handle()
+        self.add_records(handle, 6, datetime.now() - timedelta(days=2))
+        fresh = self.add_records(handle, 3, datetime.now(), prefix="f")
+        handle.max_age = 3600 * 24
+        handle.expire_batch_size = 4
+
+        self.assertFalse(handle._expire())
+        self.assertEqual(len(handle.items()), 5)
+        self.assertFalse(handle._expire())
+        self.assertEqual(handle._expire_cursor, fresh[2].encode("utf8"))
+        self.assertTrue(handle._expire())
+        self.assertIsNone(handle._expire_cursor)
+        self.assertEqual(list(handle), fresh)
+
+    def test_expire_on_start(self):
+        handle = self.get_handle()
+        self.add_records(handle, 3, datetime.now() - timedelta(days=2))
+        self.close_handle(handle)
+
+        handle = self.get_handle(max_age=3600 * 24)
+
+        self.assertEqual(list(handle), [])
+
+    def test_expire_whitelisted(self):
+        handle = self.get_handle()
+        old = datetime.now() - timedelta(days=2)
+        handle[self.digest] = pyzor.engines.common.Record(0, 1, None, None,
+                                                          old, old)
+        handle.max_age = 3600 * 24
+
+        self.assertTrue(handle._expire())
+        self.assertEqual(list(handle), [self.digest])
+
+    def test_reorganize(self):
+        handle = self.get_handle()
+        self.add_records(handle, 10, datetime.now() - timedelta(days=2))
+        fresh = self.add_records(handle, 3, datetime.now(), prefix="f")
+        handle.max_age = 3600 * 24
+        handle.expire_batch_size = 4
+
+        handle.reorganize()
+
+        self.assertEqual(list(handle), fresh)
+
+    def test_fork(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        # Stands for the environment inherited from the parent process,
+        # that must not be used, or even closed, by the child.
+        handle.env.close()
+        inherited = handle._env = Mock()
+
+        with patch("pyzor.engines.lmdb_.os.getpid",
+                   return_value=handle.pid + 1):
+            handle.report([self.digest])
+            self.assertIsNot(handle.env, inherited)
+            self.assertEqual(handle[self.digest].r_count, 25)
+        handle.pid = os.getpid()
+
+        self.assertFalse(inherited.method_calls)
+        self.assertIn(inherited, pyzor.engines.lmdb_._inherited_envs)
+        pyzor.engines.lmdb_._inherited_envs.remove(inherited)
+
+    def test_prefork_connections(self):
+        connections = self.handler.get_prefork_connections(
+            self.fn, "c", max_age=self.max_age)
+        self.assertEqual(next(connections).keywords["max_age"], self.max_age)
+        self.assertIsNone(next(connections).keywords["max_age"])
+        self.assertIsNone(next(connections).keywords["max_age"])
+
+
+class ThreadedLMDBTest(LMDBTest):
+    """Test the ThreadedLMDBDBHandle class"""
+    handler = pyzor.engines.lmdb_.ThreadedLMDBDBHandle
+
+
+class ProcessLMDBTest(LMDBTest):
+    """Test the ProcessLMDBDBHandle class"""
+    handler = pyzor.engines.lmdb_.ProcessLMDBDBHandle
+
+    def test_maintenance_closes(self):
+        handle = self.get_handle(max_age=self.max_age)
+        self.assertIsNone(handle._env)
+        handle.reorganize()
+        self.assertIsNone(handle._env)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork not available")
+    def test_forked_request(self):
+        writer = self.get_handle()
+        writer[self.digest] = self.record
+        self.close_handle(writer)
+        handle = self.get_handle(max_age=self.max_age)
+
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                handle.report([self.digest])
+                status = 0
+            finally:
+                os._exit(status)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+        self.assertEqual(handle[self.digest].r_count, 25)
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(LMDBTest))
+    test_suite.addTest(unittest.makeSuite(ThreadedLMDBTest))
+    test_suite.addTest(unittest.makeSuite(ProcessLMDBTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 """Test the pyzor.engines.mysql module."""
 
+import time
+import logging
 import unittest
 import threading
 
@@ -16,6 +18,8 @@ class MockTimer():
         pass
     def setDaemon(self, daemon):
         pass
+    def cancel(self):
+        pass
 
 def make_MockMySQL(result, queries):
     class MockCursor():
@@ -31,6 +35,8 @@ def make_MockMySQL(result, queries):
             return [result]
         def execute(self, query, args=None):
             queries.append((query, args))
+        def executemany(self, query, args):
+            queries.append((query, list(args)))
         def close(self):
             pass
     class MockDB():
@@ -38,6 +44,8 @@ def make_MockMySQL(result, queries):
             return MockCursor()
         def close(self):
             pass
+        def ping(self):
+            pass
         def commit(self):
             pass
         def autocommit(self, value):
@@ -100,12 +108,88 @@ class MySQLTest(unittest.TestCase):
 
     def test_reconnect(self):
         """Test MySQLDBHandle.__init__"""
-        expected = "DELETE FROM testtable WHERE r_updated<%s"
+        expected = ("SHOW INDEX FROM testtable WHERE Column_name='r_updated' "
+                    "AND Seq_in_index=1", None)
 
-        self.handler("testhost,testuser,testpass,testdb,testtable", None,
-                     max_age=self.max_age)
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+        # The expiry is run in the background.
+        self.assertFalse(self.queries)
+        handle.expire_pause = 0
+        handle.start_reorganizing()
+
+        self.assertEqual(self.queries[0], expected)
 
-        self.assertEqual(self.queries[0][0], expected)
+    def test_error(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+        handle.log = logging.getLogger("pyzor-test")
+        handle.log.disabled = True
+        handle.pool.log = handle.log
+
+        def fail(*args, **kwargs):
+            raise pyzor.engines.mysql.MySQLdb.Error("gone away")
+        handle._report = fail
+
+        self.assertRaises(pyzor.engines.common.DatabaseError, handle.report,
+                          ["2aedaac999d71421c9ee49b9d81f627a7bc570aa"])
+        self.assertEqual(handle.pool.stats()["broken"], 1)
+
+    def test_get_item_missing(self):
+        """A missing digest must not keep the connection"""
+        pyzor.engines.mysql.MySQLdb = make_MockMySQL(None, self.queries)
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+
+        self.assertRaises(KeyError, handle.__getitem__, "missing")
+        stats = handle.pool.stats()
+        self.assertEqual(stats["broken"], 0)
+        self.assertEqual(stats["idle"], stats["size"])
+        self.assertRaises(KeyError, handle.__getitem__, "missing")
+
+    def test_replication_lag(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=None)
+        self.assertEqual(self.replication_lag(handle, ("primary", 7)), 7)
+        self.assertEqual(self.queries[-1], ("SHOW REPLICA STATUS", None))
+
+    def test_replication_lag_old(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=None)
+        status = (("Master_Host",), ("Seconds_Behind_Master",))
+        self.assertEqual(self.replication_lag(handle, ("primary", None),
+                                              status, old=True), None)
+        self.assertEqual(self.queries[-1], ("SHOW SLAVE STATUS", None))
+
+    def test_replication_lag_primary(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=None)
+        self.assertEqual(self.replication_lag(handle, None), 0)
+
+    def replication_lag(self, handle, row, description=None, old=False):
+        """Call replication_lag with a cursor that returns this row."""
+        queries = self.queries
+
+        class StatusCursor(object):
+            def __init__(self):
+                self.description = description or (("Source_Host",),
+                                                   ("Seconds_Behind_Source",))
+            def execute(self, query, args=None):
+                queries.append((query, args))
+                if old and "REPLICA" in query:
+                    raise pyzor.engines.mysql.MySQLdb.Error("syntax")
+            def fetchone(self):
+                return row
+            def close(self):
+                pass
+
+        class StatusDB(object):
+            def cursor(self):
+                return StatusCursor()
+            def close(self):
+                pass
+
+        return handle._replication_lag(db=StatusDB())
 
     def test_no_reorganize(self):
         self.handler("testhost,testuser,testpass,testdb,testtable", None,
@@ -129,7 +213,7 @@ class MySQLTest(unittest.TestCase):
                               None, max_age=self.max_age)
 
         handle[digest] = self.record
-        self.assertEqual(self.queries[1], expected)
+        self.assertEqual(self.queries[0], expected)
 
     def test_get_item(self):
         """Test MySQLDBHandle.__getitem__"""
@@ -141,9 +225,67 @@ class MySQLTest(unittest.TestCase):
                               None, max_age=self.max_age)
 
         result = handle[digest]
-        self.assertEqual(self.queries[1], expected)
+        self.assertEqual(self.queries[0], expected)
         self.assertEqual(self.record_unpack(result), self.record_unpack())
 
+    def test_get_many(self):
+        """Test MySQLDBHandle.get_many"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        missing = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+        expected = ("SELECT digest, r_count, wl_count, r_entered, r_updated, "
+                    "wl_entered, wl_updated FROM testtable WHERE digest IN "
+                    "(%s, %s)", (missing, digest))
+        pyzor.engines.mysql.MySQLdb = make_MockMySQL(
+            (digest,) + self.response, self.queries)
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+
+        result = handle.get_many([missing, digest])
+        self.assertEqual(self.queries[0], expected)
+        self.assertEqual(self.record_unpack(result[0]),
+                         self.record_unpack(pyzor.engines.common.Record()))
+        self.assertEqual(self.record_unpack(result[1]), self.record_unpack())
+
+    def test_set_many(self):
+        """Test MySQLDBHandle.set_many"""
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        expected = ("INSERT INTO testtable (digest, r_count, wl_count, "
+                    "r_entered, r_updated, wl_entered, wl_updated) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s) ON "
+                    "DUPLICATE KEY UPDATE r_count=VALUES(r_count), "
+                    "wl_count=VALUES(wl_count), r_entered=VALUES(r_entered), "
+                    "r_updated=VALUES(r_updated), "
+                    "wl_entered=VALUES(wl_entered), "
+                    "wl_updated=VALUES(wl_updated)",
+                    [(digest,) + self.record_unpack() for digest in digests])
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+
+        handle.set_many([(digest, self.record) for digest in digests])
+        self.assertEqual(self.queries[0], expected)
+
+    def test_increment_many(self):
+        """Test MySQLDBHandle.increment_many"""
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        expected = ("INSERT INTO testtable (digest, r_count, wl_count, "
+                    "r_entered, r_updated, wl_entered, wl_updated) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s) ON "
+                    "DUPLICATE KEY UPDATE r_count=r_count+VALUES(r_count), "
+                    "wl_count=wl_count+VALUES(wl_count), "
+                    "r_entered=IFNULL(r_entered, VALUES(r_entered)), "
+                    "r_updated=IF(VALUES(r_count), VALUES(r_updated), "
+                    "r_updated), "
+                    "wl_entered=IFNULL(wl_entered, VALUES(wl_entered)), "
+                    "wl_updated=IF(VALUES(wl_count), VALUES(wl_updated), "
+                    "wl_updated)",
+                    [(digest,) + self.record_unpack()])
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+
+        handle.increment_many([(digest, self.record)])
+        self.assertEqual(self.queries[0], expected)
+
     def test_del_item(self):
         """Test MySQLDBHandle.__detitem__"""
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -152,7 +294,7 @@ class MySQLTest(unittest.TestCase):
         handle = self.handler("testhost,testuser,testpass,testdb,testtable",
                               None, max_age=self.max_age)
         del handle[digest]
-        self.assertEqual(self.queries[1], expected)
+        self.assertEqual(self.queries[0], expected)
 
     def test_items(self):
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -162,7 +304,7 @@ class MySQLTest(unittest.TestCase):
         handle = self.handler("testhost,testuser,testpass,testdb,testtable",
                               None, max_age=self.max_age)
         handle.items()
-        self.assertEqual(self.queries[1], expected)
+        self.assertEqual(self.queries[0], expected)
 
     def test_iter(self):
         digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
@@ -174,18 +316,389 @@ class MySQLTest(unittest.TestCase):
         for d in handle:
             pass
 
-        self.assertEqual(self.queries[1], expected)
+        self.assertEqual(self.queries[0], expected)
+
+
+def make_ScriptedMySQL(responses, queries):
+    """A MySQLdb replacement that answers each query with the next
+    (rows, rowcount) pair from `responses`.
+    """
+    class MockCursor():
+        rowcount = -1
+        rows = ()
+        def execute(self, query, args=None):
+            queries.append((query, args))
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            self.rows, self.rowcount = response
+        def fetchone(self):
+            return self.rows[0] if self.rows else None
+        def fetchall(self):
+            return list(self.rows)
+        def close(self):
+            pass
+    class MockDB():
+        def cursor(self, *args, **kwargs):
+            return MockCursor()
+        def close(self):
+            pass
+        def ping(self):
+            pass
+        def autocommit(self, value):
+            pass
+    class MockMysql():
+        @staticmethod
+        def connect(*args, **kwargs):
+            return MockDB()
+        class Error(Exception):
+            pass
+    return MockMysql
+
+
+class MySQLExpireTest(unittest.TestCase):
+    """Test the chunked expiry of the MySQLDBHandle class"""
+
+    max_age = 60 * 60 * 24
+    handler = pyzor.engines.mysql.MySQLDBHandle
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.real_timer = threading.Timer
+        threading.Timer = MockTimer
+        self.real_mysql = getattr(pyzor.engines.mysql, "MySQLdb", None)
+        self.queries = []
+        self.responses = []
+        pyzor.engines.mysql.MySQLdb = make_ScriptedMySQL(self.responses,
+                                                         self.queries)
+        self.handle = self.handler(
+            "testhost,testuser,testpass,testdb,testtable", None,
+            max_age=self.max_age)
+        self.handle.expire_batch_size = 2
+        self.handle.expire_pause = 0
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        threading.Timer = self.real_timer
+        pyzor.engines.mysql.MySQLdb = self.real_mysql
+
+    def test_expire_by_key(self):
+        self.responses.extend([
+            ((), 0),  # no r_updated index
+            ((("b",),), 1), ((), 1),
+            ((("d",),), 1), ((), 2),
+            ((), 0), ((), 1),
+        ])
+
+        self.assertEqual(self.handle.expire(), 4)
+
+        breakpoint = self.queries[2][1][2]
+        self.assertEqual(self.queries[1:], [
+            ("SELECT digest FROM testtable WHERE digest>%s ORDER BY digest "
+             "LIMIT 1, 1", ("",)),
+            ("DELETE FROM testtable WHERE digest>%s AND digest<=%s AND "
+             "r_updated<%s", ("", "b", breakpoint)),
+            ("SELECT digest FROM testtable WHERE digest>%s ORDER BY digest "
+             "LIMIT 1, 1", ("b",)),
+            ("DELETE FROM testtable WHERE digest>%s AND digest<=%s AND "
+             "r_updated<%s", ("b", "d", breakpoint)),
+            ("SELECT digest FROM testtable WHERE digest>%s ORDER BY digest "
+             "LIMIT 1, 1", ("d",)),
+            ("DELETE FROM testtable WHERE digest>%s AND r_updated<%s",
+             ("d", breakpoint)),
+        ])
+        self.assertLess(breakpoint, datetime.now() - timedelta(hours=23))
+
+    def test_expire_indexed(self):
+        self.responses.extend([
+            ((("testtable",),), 1),
+            ((("a",), ("c",)), 2), ((), 2),
+            ((("e",),), 1), ((), 1),
+        ])
+
+        self.assertEqual(self.handle.expire(), 3)
+
+        breakpoint = self.queries[1][1][0]
+        self.assertEqual(self.queries[1:], [
+            ("SELECT digest FROM testtable WHERE r_updated<%s LIMIT 2",
+             (breakpoint,)),
+            ("DELETE FROM testtable WHERE digest IN (%s, %s) AND "
+             "r_updated<%s", ("a", "c", breakpoint)),
+            ("SELECT digest FROM testtable WHERE r_updated<%s LIMIT 2",
+             (breakpoint,)),
+            ("DELETE FROM testtable WHERE digest IN (%s) AND r_updated<%s",
+             ("e", breakpoint)),
+        ])
+
+    def test_expire_counters(self):
+        self.responses.extend([((("testtable",),), 1),
+                               ((("a",),), 1), ((), 1),
+                               ((("testtable",),), 1),
+                               ((("b",),), 1), ((), 1)])
+
+        self.handle.expire()
+        self.handle.expire()
+
+        self.assertEqual(self.handle.expired_count, 2)
+        self.assertGreaterEqual(self.handle.expire_time, 0)
+
+    def test_expire_error(self):
+        self.responses.extend([
+            ((), 0),
+            ((("b",),), 1),
+            ((), 3),
+            pyzor.engines.mysql.MySQLdb.Error("gone away"),
+        ])
+        self.handle.log = logging.getLogger("pyzor-test")
+        self.handle.log.disabled = True
+
+        self.assertEqual(self.handle.expire(), 3)
+        self.assertEqual(self.handle.expired_count, 3)
+
+
+class MockConnection(object):
+    def __init__(self, error):
+        self.error = error
+        self.alive = True
+        self.closed = False
+        self.pings = 0
+    def ping(self):
+        self.pings += 1
+        if not self.alive:
+            raise self.error("gone away")
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Test the ConnectionPool class"""
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.timers = []
+        test = self
+
+        class RecordingTimer(MockTimer):
+            def __init__(self, interval, function):
+                self.function = function
+                test.timers.append(self)
+        self.real_timer = threading.Timer
+        threading.Timer = RecordingTimer
+        self.real_mysql = getattr(pyzor.engines.mysql, "MySQLdb", None)
+        pyzor.engines.mysql.MySQLdb = make_MockMySQL(None, [])
+        self.connections = []
+        self.fail = False
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        threading.Timer = self.real_timer
+        pyzor.engines.mysql.MySQLdb = self.real_mysql
+
+    def connect(self):
+        if self.fail:
+            raise pyzor.engines.mysql.MySQLdb.Error("refused")
+        db = MockConnection(pyzor.engines.mysql.MySQLdb.Error)
+        self.connections.append(db)
+        return db
+
+    def get_pool(self, **kwargs):
+        pool = pyzor.engines.mysql.ConnectionPool(self.connect, **kwargs)
+        pool.log = logging.getLogger("pyzor-test")
+        pool.log.disabled = True
+        return pool
+
+    def test_min_size(self):
+        pool = self.get_pool(min_size=3)
+        self.assertEqual(len(self.connections), 3)
+        self.assertEqual(pool.stats()["idle"], 3)
+
+    def test_reuse(self):
+        pool = self.get_pool(min_size=1)
+        for dummy in range(3):
+            pool.release(pool.acquire())
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(pool.stats()["checkouts"], 3)
+
+    def test_grow(self):
+        pool = self.get_pool(min_size=1)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()["size"], 2)
+
+    def test_pre_ping(self):
+        pool = self.get_pool(min_size=1, ping_after=1)
+        db = pool.acquire()
+        pool.release(db)
+        self.assertIs(pool.acquire(), db)
+        self.assertEqual(db.pings, 0)
+        pool.release(db)
+        pool._idle[-1] = (db, time.time() - 2)
+
+        self.assertIs(pool.acquire(), db)
+        self.assertEqual(db.pings, 1)
+
+    def test_pre_ping_broken(self):
+        pool = self.get_pool(min_size=1, ping_after=0)
+        db = self.connections[0]
+        db.alive = False
+
+        new_db = pool.acquire()
+
+        self.assertIsNot(new_db, db)
+        self.assertTrue(db.closed)
+        self.assertEqual(pool.stats()["size"], 1)
+        self.assertEqual(pool.stats()["broken"], 1)
+
+    def test_release_broken(self):
+        pool = self.get_pool(min_size=1)
+        db = pool.acquire()
+
+        pool.release(db, broken=True)
+
+        self.assertTrue(db.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+        # The connection is replaced in the background.
+        self.timers[-1].function()
+        self.assertEqual(pool.stats()["size"], 1)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_retry_period(self):
+        self.fail = True
+        pool = self.get_pool(min_size=1)
+        self.fail = False
+
+        self.assertRaises(pyzor.engines.common.DatabaseError, pool.acquire)
+        pool._retry_after = 0
+        pool.release(pool.acquire())
+        self.assertEqual(pool.stats()["size"], 1)
+
+    def test_connect_error(self):
+        pool = self.get_pool(min_size=0)
+        self.fail = True
+        self.assertRaises(pyzor.engines.mysql.MySQLdb.Error, pool.acquire)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_idle_timeout(self):
+        pool = self.get_pool(min_size=1, idle_timeout=300)
+        dbs = [pool.acquire() for dummy in range(3)]
+        for db in dbs:
+            pool.release(db)
+        pool._idle[0] = (pool._idle[0][0], time.time() - 400)
+        pool._idle[1] = (pool._idle[1][0], time.time() - 400)
+
+        pool._maintain()
+
+        self.assertEqual([db.closed for db in dbs], [True, True, False])
+        self.assertEqual(pool.stats()["size"], 1)
+
+    def test_idle_timeout_min_size(self):
+        pool = self.get_pool(min_size=1, idle_timeout=300)
+        pool._idle[0] = (pool._idle[0][0], time.time() - 400)
+        pool._maintain()
+        self.assertFalse(self.connections[0].closed)
+
+    def test_no_idle(self):
+        pool = self.get_pool(min_size=0, idle_timeout=0)
+        db = pool.acquire()
+        pool.release(db)
+        self.assertTrue(db.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_fair_queue(self):
+        pool = self.get_pool(min_size=1, max_size=1)
+        db = pool.acquire()
+        order = []
+
+        def worker(name):
+            conn = pool.acquire()
+            order.append(name)
+            pool.release(conn)
+
+        threads = []
+        for name in range(3):
+            thread = threading.Thread(target=worker, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while pool.stats()["waiting"] <= name:
+                time.sleep(0.001)
+        pool.release(db)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, [0, 1, 2])
+        stats = pool.stats()
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(stats["waits"], 3)
+        self.assertGreater(stats["wait_time"], 0)
+        self.assertGreaterEqual(stats["wait_time"], stats["max_wait_time"])
+
+    def test_wait_broken(self):
+        pool = self.get_pool(min_size=1, max_size=1)
+        db = pool.acquire()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.acquire()))
+        thread.start()
+        while not pool.stats()["waiting"]:
+            time.sleep(0.001)
+
+        pool.release(db, broken=True)
+        thread.join()
+
+        self.assertIs(result[0], self.connections[1])
+        self.assertEqual(pool.stats()["size"], 1)
+
+    def test_timeout(self):
+        pool = self.get_pool(min_size=1, max_size=1, checkout_timeout=0.01)
+        pool.acquire()
+        self.assertRaises(pyzor.engines.common.DatabaseError, pool.acquire)
+        self.assertEqual(pool.stats()["timeouts"], 1)
+        self.assertEqual(pool.stats()["waiting"], 0)
+
+    def test_close(self):
+        pool = self.get_pool(min_size=1)
+        db = pool.acquire()
+        idle = pool.acquire()
+        pool.release(idle)
+
+        pool.close()
+        pool.release(db)
+
+        self.assertTrue(idle.closed)
+        self.assertTrue(db.closed)
+        self.assertEqual(pool.stats()["size"], 0)
 
 
 class ThreadedMySQLTest(MySQLTest):
     """Test the GdbmDBHandle class"""
     handler = pyzor.engines.mysql.ThreadedMySQLDBHandle
 
+    def test_pool_bound(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age, bound=3)
+        self.assertEqual(handle.pool.min_size, 3)
+        self.assertEqual(handle.pool.max_size, 3)
+        self.assertEqual(handle.pool.stats()["idle"], 3)
+
+    def test_pool_unbound(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+        self.assertIsNone(handle.pool.max_size)
+        self.assertEqual(handle.pool.idle_timeout, 300)
+
 
 class ProcessesMySQLTest(MySQLTest):
     """Test the GdbmDBHandle class"""
     handler = pyzor.engines.mysql.ProcessMySQLDBHandle
 
+    def test_pool_no_idle(self):
+        handle = self.handler("testhost,testuser,testpass,testdb,testtable",
+                              None, max_age=self.max_age)
+        self.assertEqual(handle.pool.stats()["size"], 0)
+        handle["2aedaac999d71421c9ee49b9d81f627a7bc570aa"] = self.record
+        self.assertEqual(handle.pool.stats()["size"], 0)
+        self.assertEqual(handle.pool.stats()["opened"], 1)
+
 
 def suite():
     """Gather all the tests from this module in a test suite."""
@@ -193,6 +706,8 @@ def suite():
     test_suite.addTest(unittest.makeSuite(MySQLTest))
     test_suite.addTest(unittest.makeSuite(ThreadedMySQLTest))
     test_suite.addTest(unittest.makeSuite(ProcessesMySQLTest))
+    test_suite.addTest(unittest.makeSuite(MySQLExpireTest))
+    test_suite.addTest(unittest.makeSuite(ConnectionPoolTest))
     return test_suite
 
 if __name__ == '__main__':
@@ -215,6 +215,133 @@ class RedisTest(unittest.TestCase):
         expected = ("pyzord.digest_v1.%s" % digest,)
         self.mredis.StrictRedis.return_value.delete.assert_called_with(*expected)
 
+    def test_get_many(self):
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        conn = self.mredis.StrictRedis.return_value
+        conn.pipeline.return_value.execute.return_value = ["r1", "r2"]
+
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None)
+        result = db.get_many(digests)
+
+        expected = [call.hgetall("pyzord.digest_v1.%s" % digest)
+                    for digest in digests]
+        expected.append(call.execute())
+        self.assertEqual(result, ["r1", "r2"])
+        conn.pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(conn.pipeline.return_value.mock_calls, expected)
+        self.assertFalse(conn.hgetall.called)
+
+    def test_set_many(self):
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None,
+                                                max_age=self.max_age)
+        db.set_many([(digest, "record %s" % digest) for digest in digests])
+
+        expected = []
+        for digest in digests:
+            key = "pyzord.digest_v1.%s" % digest
+            expected.extend([call.hmset(key, "record %s" % digest),
+                             call.expire(key, self.max_age)])
+        expected.append(call.execute())
+        conn = self.mredis.StrictRedis.return_value
+        self.assertEqual(conn.pipeline.return_value.mock_calls, expected)
+        self.assertFalse(conn.hmset.called)
+
+    def check_increment(self, method, prefix, max_age=None):
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        patch("pyzor.engines.redis_.time.time", return_value=1400221786).start()
+
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None, max_age=max_age)
+        getattr(db, method)(digests)
+
+        expected = []
+        for digest in digests:
+            key = "pyzord.digest_v1.%s" % digest
+            expected.extend([call.hincrby(key, "%s_count" % prefix),
+                             call.hsetnx(key, "%s_entered" % prefix,
+                                         1400221786),
+                             call.hset(key, "%s_updated" % prefix,
+                                       1400221786)])
+            if max_age:
+                expected.append(call.expire(key, max_age))
+        expected.append(call.execute())
+
+        conn = self.mredis.StrictRedis.return_value
+        conn.pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(conn.pipeline.return_value.mock_calls, expected)
+        self.assertFalse(conn.hincrby.called)
+
+    def test_report(self):
+        self.check_increment("report", "r")
+
+    def test_report_max_age(self):
+        self.check_increment("report", "r", self.max_age)
+
+    def test_whitelist(self):
+        self.check_increment("whitelist", "wl")
+
+    def test_whitelist_max_age(self):
+        self.check_increment("whitelist", "wl", self.max_age)
+
+    def test_increment_many(self):
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        entered = datetime(2014, 4, 23, 15, 41, 30)
+        updated = datetime(2014, 4, 25, 17, 22, 25)
+        entered_st = int(time.mktime(entered.timetuple()))
+        updated_st = int(time.mktime(updated.timetuple()))
+
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None,
+                                                max_age=self.max_age)
+        db.increment_many([
+            (digests[0], pyzor.engines.common.Record(
+                r_count=3, r_entered=entered, r_updated=updated)),
+            (digests[1], pyzor.engines.common.Record(
+                wl_count=2, wl_entered=entered, wl_updated=updated))])
+
+        keys = ["pyzord.digest_v1.%s" % digest for digest in digests]
+        expected = [call.hincrby(keys[0], "r_count", 3),
+                    call.hsetnx(keys[0], "r_entered", entered_st),
+                    call.hset(keys[0], "r_updated", updated_st),
+                    call.expire(keys[0], self.max_age),
+                    call.hincrby(keys[1], "wl_count", 2),
+                    call.hsetnx(keys[1], "wl_entered", entered_st),
+                    call.hset(keys[1], "wl_updated", updated_st),
+                    call.expire(keys[1], self.max_age),
+                    call.execute()]
+        conn = self.mredis.StrictRedis.return_value
+        self.assertEqual(conn.pipeline.return_value.mock_calls, expected)
+
+    def test_replication_lag(self):
+        conn = self.mredis.StrictRedis.return_value
+        conn.info.return_value = {"role": "slave",
+                                  "master_link_status": "up",
+                                  "master_last_io_seconds_ago": 3}
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None)
+
+        self.assertEqual(db.replication_lag(), 3)
+        conn.info.assert_called_with("replication")
+
+    def test_replication_lag_link_down(self):
+        conn = self.mredis.StrictRedis.return_value
+        conn.info.return_value = {"role": "slave",
+                                  "master_link_status": "down",
+                                  "master_last_io_seconds_ago": -1}
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None)
+
+        self.assertIsNone(db.replication_lag())
+
+    def test_replication_lag_primary(self):
+        conn = self.mredis.StrictRedis.return_value
+        conn.info.return_value = {"role": "master"}
+        db = pyzor.engines.redis_.RedisDBHandle(",,,", None)
+
+        self.assertEqual(db.replication_lag(), 0)
+
 def suite():
     """Gather all the tests from this module in a test suite."""
     test_suite = unittest.TestSuite()
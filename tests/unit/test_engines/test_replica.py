@@ -0,0 +1,223 @@
+"""Test the pyzor.engines.replica module."""
+
+import unittest
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+import pyzor.engines.replica
+import pyzor.engines.common
+
+
+class MockEngine(dict, pyzor.engines.common.BaseEngine):
+    """A dictionary based engine that can fail, and has a replication
+    lag.
+    """
+    handles_one_step = True
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.lookups = 0
+        self.lag = 0
+        self.failing = False
+
+    def _check(self):
+        if self.failing:
+            raise pyzor.engines.common.DatabaseError("unavailable")
+
+    def __getitem__(self, key):
+        self._check()
+        self.lookups += 1
+        return dict.__getitem__(self, key)
+
+    def replication_lag(self):
+        self._check()
+        return self.lag
+
+    def report(self, keys):
+        for key in keys:
+            self.setdefault(key, pyzor.engines.common.Record()).r_increment()
+
+    def whitelist(self, keys):
+        for key in keys:
+            self.setdefault(key, pyzor.engines.common.Record()).wl_increment()
+
+
+class ReplicatedDBHandleTest(unittest.TestCase):
+
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.timer = patch("pyzor.engines.replica.threading.Timer").start()
+        self.primary = MockEngine()
+        self.replicas = [MockEngine(), MockEngine()]
+        for engine in [self.primary] + self.replicas:
+            engine[self.digest] = pyzor.engines.common.Record(1)
+        self.handle = pyzor.engines.replica.ReplicatedDBHandle(
+            self.primary, self.replicas, max_lag=10)
+        self.handle.log = Mock()
+        # The first check, that is run by the timer.
+        self.handle.check_replicas()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def lookups(self):
+        return [engine.lookups
+                for engine in [self.primary] + self.replicas]
+
+    def test_round_robin(self):
+        for dummy in range(4):
+            self.handle[self.digest]
+        self.assertEqual(self.lookups(), [0, 2, 2])
+        self.assertEqual(self.handle.replica_reads, 4)
+
+    def test_get_many(self):
+        result = self.handle.get_many([self.digest, "missing"])
+        self.assertEqual([record.r_count for record in result], [1, 0])
+        self.assertEqual(self.lookups(), [0, 2, 0])
+
+    def test_missing(self):
+        self.assertRaises(KeyError, self.handle.__getitem__, "missing")
+        self.assertEqual(self.lookups(), [0, 1, 0])
+        self.assertEqual(self.handle.primary_reads, 0)
+
+    def test_writes(self):
+        self.handle.report([self.digest])
+        self.handle.whitelist(["other"])
+        self.handle["new"] = pyzor.engines.common.Record(5)
+        self.handle.increment_many([("new", pyzor.engines.common.Record(1))])
+        self.handle.set_many([("many", pyzor.engines.common.Record(2))])
+        del self.handle["other"]
+
+        self.assertEqual(self.primary[self.digest].r_count, 2)
+        self.assertEqual(self.primary["new"].r_count, 6)
+        self.assertEqual(self.primary["many"].r_count, 2)
+        self.assertNotIn("other", self.primary)
+        for replica in self.replicas:
+            self.assertEqual(list(replica), [self.digest])
+            self.assertEqual(replica[self.digest].r_count, 1)
+
+    def test_failover(self):
+        self.replicas[0].failing = True
+
+        for dummy in range(3):
+            self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [0, 0, 3])
+        self.assertEqual(self.handle.failovers, 1)
+
+    def test_failover_retry(self):
+        self.replicas[0].failing = True
+        self.handle[self.digest]
+        self.replicas[0].failing = False
+
+        with patch("pyzor.engines.replica.time.time",
+                   return_value=self.handle._failed_until[0] + 1):
+            self.handle[self.digest]
+            self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [0, 1, 2])
+
+    def test_failover_primary(self):
+        for replica in self.replicas:
+            replica.failing = True
+
+        self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [1, 0, 0])
+        self.assertEqual(self.handle.primary_reads, 1)
+        self.assertEqual(self.handle.failovers, 2)
+
+    def test_stale(self):
+        self.replicas[1].lag = 11
+        self.handle.check_replicas()
+
+        for dummy in range(3):
+            self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [0, 3, 0])
+
+    def test_stale_unknown(self):
+        self.replicas[0].lag = None
+        self.replicas[1].failing = True
+        self.handle.check_replicas()
+
+        self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [1, 0, 0])
+
+    def test_catch_up(self):
+        self.replicas[1].lag = 11
+        self.handle.check_replicas()
+        self.replicas[1].lag = 2
+        self.handle.check_replicas()
+
+        for dummy in range(2):
+            self.handle[self.digest]
+
+        self.assertEqual(self.lookups(), [0, 1, 1])
+
+    def test_check_error(self):
+        self.replicas[0].replication_lag = Mock(side_effect=ValueError)
+        self.timer.reset_mock()
+        self.handle.check_replicas()
+
+        self.handle[self.digest]
+
+        self.assertTrue(self.handle.log.error.called)
+        self.assertEqual(self.lookups(), [0, 0, 1])
+        self.timer.assert_called_with(self.handle.check_period,
+                                      self.handle.check_replicas)
+
+    def test_first_check(self):
+        self.timer.reset_mock()
+        self.replicas[0].replication_lag = Mock(return_value=0)
+        handle = pyzor.engines.replica.ReplicatedDBHandle(
+            self.primary, self.replicas, max_lag=10)
+
+        self.timer.assert_called_with(0, handle.check_replicas)
+        self.assertFalse(self.replicas[0].replication_lag.called)
+        # The replicas are not used until the first check is done.
+        handle[self.digest]
+        self.assertEqual(self.lookups(), [1, 0, 0])
+
+    def test_check_scheduled(self):
+        self.timer.assert_called_with(self.handle.check_period,
+                                      self.handle.check_replicas)
+        self.assertTrue(self.timer.return_value.start.called)
+
+    def test_no_lag_check(self):
+        self.timer.reset_mock()
+        self.replicas[0].lag = None
+        handle = pyzor.engines.replica.ReplicatedDBHandle(
+            self.primary, self.replicas, max_lag=0)
+
+        handle[self.digest]
+
+        self.assertFalse(self.timer.called)
+        self.assertEqual(self.lookups(), [0, 1, 0])
+
+    def test_close(self):
+        for engine in [self.primary] + self.replicas:
+            engine.close = Mock()
+
+        self.handle.close()
+
+        self.assertTrue(self.timer.return_value.cancel.called)
+        for engine in [self.primary] + self.replicas:
+            engine.close.assert_called_with()
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(ReplicatedDBHandleTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
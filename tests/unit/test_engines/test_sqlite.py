@@ -0,0 +1,313 @@
+"""Test the pyzor.engines.sqlite module."""
+
+import os
+import shutil
+import unittest
+import tempfile
+import threading
+
+from datetime import datetime, timedelta
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pyzor.engines.sqlite
+import pyzor.engines.common
+
+
+@unittest.skipUnless(pyzor.engines.sqlite._has_sqlite,
+                     "sqlite3 library not available")
+class SQLiteTest(unittest.TestCase):
+    """Test the SQLiteDBHandle class"""
+
+    handler = pyzor.engines.sqlite.SQLiteDBHandle
+
+    max_age = 60 * 60 * 24 * 30 * 4
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.engines.sqlite.threading.Timer").start()
+        self.homedir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.homedir, "pyzord.sqlite")
+        self.record = pyzor.engines.common.Record(
+            24, 42, datetime.now() - timedelta(days=10),
+            datetime.now() - timedelta(days=2),
+            datetime.now() - timedelta(days=20),
+            datetime.now() - timedelta(days=3))
+        self.handles = []
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        for handle in self.handles:
+            handle.close()
+        shutil.rmtree(self.homedir)
+        patch.stopall()
+
+    def get_handle(self, mode="c", max_age=None):
+        handle = self.handler(self.fn, mode, max_age=max_age)
+        self.handles.append(handle)
+        return handle
+
+    def assert_record(self, record, expected=None):
+        if not expected:
+            expected = self.record
+        for field in ("r_count", "r_entered", "r_updated",
+                      "wl_count", "wl_entered", "wl_updated"):
+            self.assertEqual(getattr(record, field), getattr(expected, field))
+
+    def add_records(self, handle, count, updated, prefix="0"):
+        digests = [prefix + "%039x" % i for i in range(count)]
+        record = pyzor.engines.common.Record(1, 0, updated, updated)
+        handle.set_many([(digest, record) for digest in digests])
+        return digests
+
+    def test_wal(self):
+        handle = self.get_handle()
+        db = handle._get_new_connection()
+        try:
+            mode = db.execute("PRAGMA journal_mode").fetchone()[0]
+        finally:
+            db.close()
+        self.assertEqual(mode, "wal")
+
+    def test_expire_index(self):
+        handle = self.get_handle()
+        db = handle._get_new_connection()
+        try:
+            plan = db.execute("EXPLAIN QUERY PLAN SELECT digest FROM digests "
+                              "WHERE r_updated<?", (0,)).fetchall()
+        finally:
+            db.close()
+        self.assertIn("digests_r_updated", str(plan))
+
+    def test_set_get(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        self.assert_record(handle[self.digest])
+
+    def test_set_replace(self):
+        handle = self.get_handle()
+        handle[self.digest] = pyzor.engines.common.Record(1, 1)
+        handle[self.digest] = self.record
+        self.assert_record(handle[self.digest])
+
+    def test_get_missing(self):
+        handle = self.get_handle()
+        self.assertRaises(KeyError, handle.__getitem__, self.digest)
+
+    def test_get_many(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        result = handle.get_many([self.digest, "missing"])
+
+        self.assert_record(result[0])
+        self.assert_record(result[1], pyzor.engines.common.Record())
+
+    def test_get_many_chunks(self):
+        handle = self.get_handle()
+        digests = self.add_records(handle, 7, datetime.now())
+        handle.max_variables = 3
+
+        result = handle.get_many(digests + ["missing"])
+
+        self.assertEqual([record.r_count for record in result],
+                         [1] * 7 + [0])
+
+    def test_set_many(self):
+        digests = [self.digest, "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        handle = self.get_handle()
+
+        handle.set_many([(digest, self.record) for digest in digests])
+
+        for digest in digests:
+            self.assert_record(handle[digest])
+
+    def test_del_item(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        del handle[self.digest]
+
+        self.assertRaises(KeyError, handle.__getitem__, self.digest)
+        self.assertRaises(KeyError, handle.__delitem__, self.digest)
+
+    def test_items(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        self.assertEqual(list(handle), [self.digest])
+        key, record = handle.items()[0]
+        self.assertEqual(key, self.digest)
+        self.assert_record(record)
+
+    def test_report(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        handle.report([self.digest, "missing"])
+
+        result = handle[self.digest]
+        self.assertEqual(result.r_count, 25)
+        self.assertEqual(result.r_entered, self.record.r_entered)
+        self.assertGreater(result.r_updated, self.record.r_updated)
+        self.assertEqual(result.wl_count, 42)
+        result = handle["missing"]
+        self.assertEqual((result.r_count, result.wl_count), (1, 0))
+        self.assertIsNotNone(result.r_entered)
+        self.assertIsNone(result.wl_entered)
+
+    def test_whitelist(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+
+        handle.whitelist([self.digest, "missing"])
+
+        result = handle[self.digest]
+        self.assertEqual(result.r_count, 24)
+        self.assertEqual(result.wl_count, 43)
+        self.assertEqual(result.wl_entered, self.record.wl_entered)
+        self.assertGreater(result.wl_updated, self.record.wl_updated)
+        result = handle["missing"]
+        self.assertEqual((result.r_count, result.wl_count), (0, 1))
+        self.assertIsNone(result.r_entered)
+        self.assertIsNotNone(result.wl_entered)
+
+    def test_increment_many(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        delta = pyzor.engines.common.Record()
+        delta.r_increment()
+        delta.r_increment()
+
+        handle.increment_many([(self.digest, delta), ("missing", delta)])
+
+        expected = pyzor.engines.common.Record(
+            26, 42, self.record.r_entered, delta.r_updated,
+            self.record.wl_entered, self.record.wl_updated)
+        self.assert_record(handle[self.digest], expected)
+        self.assert_record(handle["missing"], delta)
+
+    def test_error(self):
+        handle = self.get_handle()
+        handle.table_name = "missing"
+        with patch.object(handle, "log"):
+            self.assertRaises(pyzor.engines.common.DatabaseError,
+                              handle.report, [self.digest])
+            self.assertRaises(pyzor.engines.common.DatabaseError,
+                              handle.__getitem__, self.digest)
+
+    def test_readonly(self):
+        handle = self.get_handle()
+        handle[self.digest] = self.record
+        readonly = self.get_handle("r", max_age=self.max_age)
+
+        self.assert_record(readonly[self.digest])
+        self.assertEqual([key for key, record in readonly.items()],
+                         [self.digest])
+
+    def test_expire(self):
+        old = datetime.now() - timedelta(days=2)
+        handle = self.get_handle()
+        self.add_records(handle, 7, old)
+        fresh = self.add_records(handle, 3, datetime.now(), prefix="f")
+        handle[self.digest] = pyzor.engines.common.Record(0, 1, None, None,
+                                                          old, old)
+        with patch.object(self.handler, "expire_batch_size", 3):
+            self.get_handle(max_age=3600 * 24)
+
+        self.assertEqual(sorted(handle), [self.digest] + fresh)
+
+    def test_reorganize(self):
+        handle = self.get_handle()
+        self.add_records(handle, 10, datetime.now() - timedelta(days=2))
+        fresh = self.add_records(handle, 3, datetime.now(), prefix="f")
+        handle.max_age = 3600 * 24
+
+        handle.reorganize()
+
+        self.assertEqual(list(handle), fresh)
+
+    def test_reorganize_connection(self):
+        handle = self.get_handle()
+        handle.max_age = 3600 * 24
+        used = []
+        real_reorganize = handle._reorganize
+
+        def reorganize(db=None):
+            used.append(db)
+            return real_reorganize(db=db)
+
+        with patch.object(handle, "_reorganize", side_effect=reorganize):
+            handle.reorganize()
+
+        # The timer and signal threads must not share the connection used
+        # by the requests.
+        self.assertIsNot(used[0], handle.db)
+        self.assertRaises(pyzor.engines.sqlite.sqlite3.ProgrammingError,
+                          used[0].execute, "SELECT 1")
+
+    def test_prefork_connections(self):
+        connections = self.handler.get_prefork_connections(
+            self.fn, "c", max_age=self.max_age)
+        self.assertEqual(next(connections).keywords["max_age"], self.max_age)
+        self.assertIsNone(next(connections).keywords["max_age"])
+        self.assertIsNone(next(connections).keywords["max_age"])
+
+
+class ThreadedSQLiteTest(SQLiteTest):
+    """Test the ThreadedSQLiteDBHandle class"""
+    handler = pyzor.engines.sqlite.ThreadedSQLiteDBHandle
+
+    def test_pool_reuse(self):
+        handle = self.get_handle()
+        for dummy in range(3):
+            handle.report([self.digest])
+        self.assertEqual(handle.connections, 1)
+        self.assertEqual(handle[self.digest].r_count, 3)
+
+    def test_pool_bound(self):
+        handle = self.handler(self.fn, "c", bound=2)
+        self.handles.append(handle)
+        busy = threading.Event()
+        release = threading.Event()
+        real_report = handle._report
+
+        def slow_report(keys, db=None):
+            busy.set()
+            release.wait()
+            real_report(keys, db=db)
+        handle._report = slow_report
+
+        threads = [threading.Thread(target=handle.report,
+                                    args=([self.digest],))
+                   for dummy in range(4)]
+        for thread in threads:
+            thread.start()
+        busy.wait()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(handle.connections, 2)
+        self.assertEqual(handle[self.digest].r_count, 4)
+
+
+class ProcessSQLiteTest(SQLiteTest):
+    """Test the ProcessSQLiteDBHandle class"""
+    handler = pyzor.engines.sqlite.ProcessSQLiteDBHandle
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(SQLiteTest))
+    test_suite.addTest(unittest.makeSuite(ThreadedSQLiteTest))
+    test_suite.addTest(unittest.makeSuite(ProcessSQLiteTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Test the pyzor.engines.writebehind module."""
+
+import time
+import unittest
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+import pyzor.engines.common
+import pyzor.engines.writebehind
+
+from pyzor.engines.common import Record
+
+
+class MockEngine(dict, pyzor.engines.common.BaseEngine):
+    """A dictionary based engine that counts the bulk increments."""
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.increments = []
+
+    def increment_many(self, items):
+        items = list(items)
+        self.increments.append(items)
+        pyzor.engines.common.BaseEngine.increment_many(self, items)
+
+
+class WriteBehindDBHandleTest(unittest.TestCase):
+
+    digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+    digest2 = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.engine = MockEngine()
+        self.handle = pyzor.engines.writebehind.WriteBehindDBHandle(
+            self.engine, interval=3600)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.handle.close()
+        patch.stopall()
+
+    def test_report(self):
+        self.handle.report([self.digest, self.digest2, self.digest])
+        self.assertEqual(self.engine, {})
+        self.assertEqual(self.handle[self.digest].r_count, 2)
+        self.assertEqual(self.handle[self.digest2].r_count, 1)
+
+        self.handle.flush()
+        self.assertEqual(len(self.engine.increments), 1)
+        self.assertEqual(self.engine[self.digest].r_count, 2)
+        self.assertEqual(self.engine[self.digest2].r_count, 1)
+        self.assertEqual(self.handle[self.digest].r_count, 2)
+        self.assertEqual(self.handle.pending, {})
+
+    def test_whitelist(self):
+        self.engine[self.digest] = Record(r_count=3)
+        self.handle.whitelist([self.digest])
+        record = self.handle.get_many([self.digest])[0]
+        self.assertEqual((record.r_count, record.wl_count), (3, 1))
+        self.assertIsNotNone(record.wl_entered)
+
+        self.handle.flush()
+        record = self.engine[self.digest]
+        self.assertEqual((record.r_count, record.wl_count), (3, 1))
+
+    def test_coalesce(self):
+        for dummy in range(5):
+            self.handle.report([self.digest])
+        self.handle.whitelist([self.digest])
+        self.handle.flush()
+        (key, delta), = self.engine.increments[0]
+        self.assertEqual((key, delta.r_count, delta.wl_count),
+                         (self.digest, 5, 1))
+
+    def test_get_many_duplicates(self):
+        self.handle.report([self.digest, self.digest])
+        records = self.handle.get_many([self.digest, self.digest])
+        self.assertEqual([record.r_count for record in records], [2, 2])
+
+        # Some counts being flushed, and some still pending.
+        with self.handle._lock:
+            self.handle.flushing = self.handle.pending
+            self.handle.pending = {}
+        self.handle.report([self.digest])
+        records = self.handle.get_many([self.digest, self.digest2,
+                                        self.digest])
+        self.assertEqual([record.r_count for record in records], [3, 0, 3])
+        self.assertEqual(self.handle[self.digest].r_count, 3)
+
+    def test_missing(self):
+        self.assertRaises(KeyError, self.handle.__getitem__, self.digest)
+        record = self.handle.get_many([self.digest])[0]
+        self.assertEqual((record.r_count, record.wl_count), (0, 0))
+
+    def test_flush_empty(self):
+        self.handle.flush()
+        self.assertEqual(self.engine.increments, [])
+
+    def test_max_pending(self):
+        self.handle.max_pending = 2
+        self.handle.report([self.digest])
+        self.assertEqual(self.engine.increments, [])
+        self.handle.report([self.digest2])
+        for dummy in range(100):
+            if self.engine.increments:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.engine[self.digest2].r_count, 1)
+
+    def test_flush_error(self):
+        self.handle.report([self.digest])
+        with patch.object(self.engine, "increment_many",
+                          side_effect=pyzor.engines.common.DatabaseError):
+            self.handle.flush()
+        self.handle.report([self.digest])
+        self.assertEqual(self.handle[self.digest].r_count, 2)
+        self.handle.flush()
+        self.assertEqual(self.engine[self.digest].r_count, 2)
+
+    def test_read_during_flush(self):
+        self.handle.report([self.digest])
+        real_get_many = self.engine.get_many
+        flushed = []
+
+        def get_many(keys):
+            # The counts are written between taking the snapshot of the
+            # pending counts and reading the engine.
+            if not flushed:
+                flushed.append(True)
+                self.handle.flush()
+            return real_get_many(keys)
+
+        with patch.object(self.engine, "get_many", side_effect=get_many):
+            record = self.handle.get_many([self.digest])[0]
+        self.assertEqual(record.r_count, 1)
+
+    def test_close(self):
+        self.handle.report([self.digest])
+        self.engine.close = Mock()
+        self.handle.close()
+        self.assertEqual(self.engine[self.digest].r_count, 1)
+        self.engine.close.assert_called_once_with()
+        self.assertFalse(self.handle.thread.is_alive())
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(WriteBehindDBHandleTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
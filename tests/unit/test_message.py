@@ -0,0 +1,118 @@
+"""Test the pyzor.message module."""
+
+import email
+import unittest
+import email.message
+
+import pyzor
+import pyzor.account
+import pyzor.message
+
+
+class HeaderCodecTest(unittest.TestCase):
+    """Test the header parser and serializer against the email package."""
+
+    packet = (b"Op: check\n"
+              b"Op-Digest: 2aedaac999d71421c9ee49b9d81f627a7bc570aa\n"
+              b"Thread: 33715\n"
+              b"PV: 2.1\n"
+              b"User: anonymous\n"
+              b"Time: 1400221786\n"
+              b"Sig: 1ce0fb3cd8d60bd8dd5f8cab9fc36ba1a5cd64c0\n\n")
+
+    def test_parse(self):
+        expected = email.message_from_bytes(self.packet)._headers
+        result = pyzor.message.parse_headers(self.packet)
+        self.assertEqual(result, expected)
+
+    def test_parse_multiple(self):
+        packet = (b"Op: report\nOp-Digest: abc\nOp-Digest: def\n"
+                  b"Op-Spec: 20,3,60,3\n")
+        msg = pyzor.message.message_from_bytes(packet)
+        self.assertEqual(msg.get_all("Op-Digest"), ["abc", "def"])
+        self.assertEqual(msg["op-spec"], "20,3,60,3")
+
+    def test_parse_double_newline(self):
+        packet = b"Op: ping\nPV: 2.1\n\nThread: 1024\n\n"
+        result = pyzor.message.parse_headers(packet)
+        self.assertEqual(result, [("Op", "ping"), ("PV", "2.1"),
+                                  ("Thread", "1024")])
+
+    def test_parse_crlf(self):
+        packet = b"Op: ping\r\nPV: 2.1\r\n"
+        result = pyzor.message.parse_headers(packet)
+        self.assertEqual(result, [("Op", "ping"), ("PV", "2.1")])
+
+    def test_parse_continuation(self):
+        packet = b"Diag: Not\n  implemented\nCode: 501\n"
+        expected = email.message_from_bytes(packet)._headers
+        result = pyzor.message.parse_headers(packet)
+        self.assertEqual(result, expected)
+
+    def test_parse_invalid_line(self):
+        packet = b"Op: ping\ngarbage\nPV: 2.1\n"
+        result = pyzor.message.parse_headers(packet)
+        self.assertEqual(result, [("Op", "ping"), ("PV", "2.1")])
+
+    def test_serialize(self):
+        headers = [("Code", "200"), ("Diag", "OK"), ("PV", "2.1"),
+                   ("Thread", "33715"), ("Count", "0"), ("WL-Count", "0")]
+        expected = email.message.Message()
+        for name, value in headers:
+            expected[name] = value
+        result = pyzor.message.serialize_headers(headers)
+        self.assertEqual(result, expected.as_string())
+
+    def test_roundtrip(self):
+        msg = pyzor.message.message_from_bytes(self.packet,
+                                               pyzor.message.Request)
+        self.assertIsInstance(msg, pyzor.message.Request)
+        self.assertEqual(msg.as_string().encode("utf8"), self.packet)
+
+    def test_signature(self):
+        """The signature is computed over the same string as with the email
+        package.
+        """
+        hashed_key = pyzor.account.hash_key(
+            "cf88277c5d4abdc0a3f56f416011966d04a3f462", "anonymous")
+        expected = pyzor.account.sign_msg(
+            hashed_key, 1400221786, email.message_from_bytes(self.packet))
+        msg = pyzor.message.message_from_bytes(self.packet,
+                                               pyzor.message.Request)
+        result = pyzor.account.sign_msg(hashed_key, 1400221786, msg)
+        self.assertEqual(result, expected)
+
+
+class CheckManyTest(unittest.TestCase):
+    digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+               "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+
+    def test_request(self):
+        msg = pyzor.message.CheckManyRequest(self.digests)
+        self.assertEqual(msg.get_op(), "check")
+        self.assertEqual(msg.get_all("Op-Digest"), self.digests)
+        self.assertEqual(msg.digest_count, 2)
+
+    def test_counts(self):
+        packet = (b"Code: 200\nDiag: OK\nPV: 2.1\nThread: 1024\n"
+                  b"Count: 24\nWL-Count: 42\nCount: 0\nWL-Count: 0\n\n")
+        msg = pyzor.message.message_from_bytes(
+            packet, pyzor.message.CheckManyResponse)
+        self.assertEqual(msg.get_counts(), [(24, 42), (0, 0)])
+
+    def test_no_counts(self):
+        packet = b"Code: 403\nDiag: Forbidden\nPV: 2.1\nThread: 1024\n\n"
+        msg = pyzor.message.message_from_bytes(
+            packet, pyzor.message.CheckManyResponse)
+        self.assertEqual(msg.get_counts(), [])
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(HeaderCodecTest))
+    test_suite.addTest(unittest.makeSuite(CheckManyTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Test the pyzor.metrics module
+"""
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+import pyzor.metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def get_lines(self, metrics):
+        return metrics.render().splitlines()
+
+    def test_empty(self):
+        metrics = pyzor.metrics.Metrics()
+        lines = self.get_lines(metrics)
+        self.assertEqual([line for line in lines
+                          if not line.startswith("#")], [])
+
+    def test_requests(self):
+        metrics = pyzor.metrics.Metrics()
+        metrics.record("check", "200", [])
+        metrics.record("check", "200", [])
+        metrics.record("report", "403", [])
+        lines = self.get_lines(metrics)
+        self.assertIn('pyzord_requests_total{op="check",code="200"} 2', lines)
+        self.assertIn('pyzord_requests_total{op="report",code="403"} 1',
+                      lines)
+
+    def test_unknown_operation(self):
+        metrics = pyzor.metrics.Metrics()
+        metrics.record(None, "400", [("parse", 0.001)])
+        metrics.record("nosuchop", "501", [])
+        lines = self.get_lines(metrics)
+        self.assertIn('pyzord_requests_total{op="other",code="400"} 1', lines)
+        self.assertIn('pyzord_requests_total{op="other",code="501"} 1', lines)
+        self.assertIn('pyzord_request_stage_seconds_count{op="other",'
+                      'stage="parse"} 1', lines)
+
+    def test_histogram(self):
+        metrics = pyzor.metrics.Metrics()
+        metrics.record("check", "200", [("engine", 0.001),
+                                        ("engine", 0.003),
+                                        ("engine", 10)])
+        lines = self.get_lines(metrics)
+        labels = 'op="check",stage="engine"'
+        self.assertIn('pyzord_request_stage_seconds_bucket{%s,le="0.0005"} 0'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_bucket{%s,le="0.001"} 1'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_bucket{%s,le="0.005"} 2'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_bucket{%s,le="2.5"} 2'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_bucket{%s,le="+Inf"} 3'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_sum{%s} 10.004'
+                      % labels, lines)
+        self.assertIn('pyzord_request_stage_seconds_count{%s} 3'
+                      % labels, lines)
+        self.assertNotIn('pyzord_request_stage_seconds_count{op="check",'
+                         'stage="parse"} 0', lines)
+
+    def test_cache(self):
+        metrics = pyzor.metrics.Metrics(2)
+        self.assertNotIn('pyzord_cache_lookups_total{result="hit"} 0',
+                         self.get_lines(metrics))
+        metrics.record_cache(3, 1)
+        metrics.select_slot(1)
+        metrics.record_cache(2, 0)
+        lines = self.get_lines(metrics)
+        self.assertIn('pyzord_cache_lookups_total{result="hit"} 5', lines)
+        self.assertIn('pyzord_cache_lookups_total{result="miss"} 1', lines)
+
+    def test_slots(self):
+        metrics = pyzor.metrics.Metrics(3)
+        for slot in range(3):
+            metrics.select_slot(slot)
+            metrics.record("check", "200", [("parse", 0.001)])
+        lines = self.get_lines(metrics)
+        self.assertIn('pyzord_requests_total{op="check",code="200"} 3', lines)
+        self.assertIn('pyzord_request_stage_seconds_count{op="check",'
+                      'stage="parse"} 3', lines)
+
+    def test_server(self):
+        metrics = pyzor.metrics.Metrics()
+        metrics.record("ping", "200", [])
+        server = pyzor.metrics.MetricsServer(("127.0.0.1", 0), metrics)
+        server.start()
+        try:
+            response = urlopen("http://127.0.0.1:%s/metrics" %
+                               server.server_address[1])
+            self.assertEqual(response.info()["Content-Type"],
+                             pyzor.metrics.CONTENT_TYPE)
+            self.assertEqual(response.read().decode("utf8"), metrics.render())
+        finally:
+            server.stop()
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(MetricsTest))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,12 @@
 import io
 import sys
 import time
+import errno
+import signal
+import socket
 import logging
 import unittest
+import itertools
 try:
     import socketserver as SocketServer
 except ImportError:
@@ -13,11 +17,12 @@ except ImportError:
 from datetime import datetime, timedelta
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import Mock, patch
 except ImportError:
-    from mock import patch
+    from mock import Mock, patch
 
 import pyzor.server
+import pyzor.engines.cache
 import pyzor.engines.common
 
 
@@ -31,12 +36,27 @@ class MockServer():
         self.usage_log.addHandler(logging.NullHandler())
         self.forwarder = None
         self.one_step = False
+        self.metrics = None
+
+
+class MockEngine(pyzor.engines.common.BaseEngine):
+    """Exposes a dictionary as an engine."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def __setitem__(self, key, value):
+        self.records[key] = value
 
 
 class MockDatagramRequestHandler():
     """ Mock the SocketServer.DatagramRequestHand."""
 
-    def __init__(self, headers, database=None, acl=None, accounts=None):
+    def __init__(self, headers, database=None, acl=None, accounts=None,
+                 metrics=None):
         """Initiates an request handler and set's the data in `headers` as
         the request. Also set's the database, acl and accounts for the
         MockServer.
@@ -46,13 +66,18 @@ class MockDatagramRequestHandler():
         self.rfile = io.BytesIO()
         self.wfile = io.BytesIO()
         for i, j in headers.items():
-            self.rfile.write(("%s: %s\n" % (i, j)).encode("utf8"))
+            if not isinstance(j, list):
+                j = [j]
+            for value in j:
+                self.rfile.write(("%s: %s\n" % (i, value)).encode("utf8"))
         self.rfile.seek(0)
         self.packet = None
         self.client_address = ["127.0.0.1"]
 
         # Setup MockServer data
         self.server = MockServer()
+        if database is not None:
+            database = MockEngine(database)
         self.server.database = database
         if acl:
             self.server.acl = acl
@@ -61,6 +86,7 @@ class MockDatagramRequestHandler():
                                                       "ping", "pong", "info",
                                                       "whitelist",)}
         self.server.accounts = accounts
+        self.server.metrics = metrics
 
         self.handle()
 
@@ -163,6 +189,24 @@ class RequestHandlerTest(unittest.TestCase):
 
         self.check_response(handler)
 
+    def test_check_many(self):
+        """Tests the check command handler with several digests"""
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+                   "a9993e364706816aba3e25717850c26c9cd0d89d"]
+        database = {digests[0]: pyzor.engines.common.Record(24, 42),
+                    digests[2]: pyzor.engines.common.Record(1, 2)}
+
+        self.request["Op"] = "check"
+        self.request["Op-Digest"] = digests
+        handler = pyzor.server.RequestHandler(self.request, database)
+
+        handler.wfile.seek(0)
+        response = pyzor.message.message_from_bytes(
+            handler.wfile.read(), pyzor.message.CheckManyResponse)
+        self.assertEqual(response.head_tuple(), (200, "OK"))
+        self.assertEqual(response.get_counts(), [(24, 42), (0, 0), (1, 2)])
+
     def test_info(self):
         """Tests the info command handler"""
         entered = datetime.now() - timedelta(days=10)
@@ -249,6 +293,24 @@ class RequestHandlerTest(unittest.TestCase):
         self.check_response(handler)
         self.assertEqual(database[digest].wl_count, 1)
 
+    def test_report_many(self):
+        """Tests the report command handler with several digests"""
+        digests = ["2aedaac999d71421c9ee49b9d81f627a7bc570aa",
+                   "da39a3ee5e6b4b0d3255bfef95601890afd80709"]
+        database = {digests[0]: pyzor.engines.common.Record(24, 42)}
+
+        self.request["Op"] = "report"
+        self.request["Op-Digest"] = [digests[0], digests[1], digests[0]]
+        with patch.object(MockEngine, "set_many",
+                          autospec=True,
+                          side_effect=MockEngine.set_many) as set_many:
+            handler = pyzor.server.RequestHandler(self.request, database)
+
+        self.check_response(handler)
+        self.assertEqual(database[digests[0]].r_count, 26)
+        self.assertEqual(database[digests[1]].r_count, 1)
+        self.assertEqual(set_many.call_count, 1)
+
     def test_handle_no_version(self):
         """Tests handling an request with no version specified"""
         self.request["Op"] = "ping"
@@ -372,6 +434,70 @@ class RequestHandlerTest(unittest.TestCase):
 
         self.check_response(handler)
 
+    def test_metrics(self):
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        database = {digest: pyzor.engines.common.Record(24, 42)}
+        metrics = Mock()
+
+        self.request["Op"] = "check"
+        self.request["Op-Digest"] = digest
+        pyzor.server.RequestHandler(self.request, database, metrics=metrics)
+
+        (opcode, code, timings), kwargs = metrics.record.call_args
+        self.assertEqual((opcode, code), ("check", "200"))
+        self.assertEqual([stage for stage, seconds in timings],
+                         ["parse", "acl", "engine", "serialize"])
+
+    def test_metrics_error(self):
+        metrics = Mock()
+
+        self.request["Op"] = "report"
+        self.request["Op-Digest"] = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        acl = {pyzor.anonymous_user: ("check",)}
+        pyzor.server.RequestHandler(self.request, acl=acl, metrics=metrics)
+
+        (opcode, code, timings), kwargs = metrics.record.call_args
+        self.assertEqual((opcode, code), ("report", "403"))
+        self.assertEqual([stage for stage, seconds in timings],
+                         ["parse", "serialize"])
+
+    def test_metrics_engine_error(self):
+        metrics = Mock()
+        database = Mock()
+        database.get_many.side_effect = Exception("test")
+
+        self.request["Op"] = "check"
+        self.request["Op-Digest"] = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        with patch.object(logging.getLogger("pyzord"), "error"):
+            pyzor.server.RequestHandler(self.request, database,
+                                        metrics=metrics)
+
+        (opcode, code, timings), kwargs = metrics.record.call_args
+        self.assertEqual((opcode, code), ("check", "500"))
+        self.assertEqual([stage for stage, seconds in timings],
+                         ["parse", "acl", "engine", "serialize"])
+
+    def test_metrics_serialize(self):
+        """The usage log is not timed as serialization"""
+        now = [0]
+        digest = "2aedaac999d71421c9ee49b9d81f627a7bc570aa"
+        database = {digest: pyzor.engines.common.Record(24, 42)}
+        metrics = Mock()
+
+        def log(*args):
+            now[0] += 10
+
+        self.request["Op"] = "check"
+        self.request["Op-Digest"] = digest
+        with patch("pyzor.server._timer", side_effect=lambda: now[0]), \
+                patch.object(logging.getLogger("pyzord-usage"), "info",
+                             side_effect=log):
+            pyzor.server.RequestHandler(self.request, database,
+                                        metrics=metrics)
+
+        (opcode, code, timings), kwargs = metrics.record.call_args
+        self.assertEqual(dict(timings)["serialize"], 0)
+
 
 class ServerTest(unittest.TestCase):
     def setUp(self):
@@ -386,12 +512,251 @@ class ServerTest(unittest.TestCase):
         pyzor.server.Server(("127.0.0.1", 24441), {}, "passwd_fn", "access_fn",
                             None)
 
+    def test_reorganize(self):
+        database = Mock()
+        server = pyzor.server.Server(("127.0.0.1", 0), database, "passwd_fn",
+                                     "access_fn")
+        server.log.addHandler(logging.NullHandler())
+        try:
+            server.reorganize_database()
+        finally:
+            server.server_close()
+        database.reorganize.assert_called_once_with()
+
+    def test_reorganize_not_needed(self):
+        server = pyzor.server.Server(("127.0.0.1", 0), {}, "passwd_fn",
+                                     "access_fn")
+        server.log.addHandler(logging.NullHandler())
+        try:
+            server.reorganize_database()
+        finally:
+            server.server_close()
+
+    def test_share_metrics(self):
+        database = pyzor.engines.cache.CachedDBHandle(Mock())
+        server = pyzor.server.Server(("127.0.0.1", 0), database, "passwd_fn",
+                                     "access_fn")
+        try:
+            server.metrics = Mock()
+            server.share_metrics()
+        finally:
+            server.server_close()
+        self.assertIs(database.metrics, server.metrics)
+
+
+class BatchedServerTest(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.config").start()
+        self.server = pyzor.server.BatchedServer(("127.0.0.1", 0), {},
+                                                 "passwd_fn", "access_fn",
+                                                 batch_size=3)
+        self.server.log.addHandler(logging.NullHandler())
+        self.server.usage_log.addHandler(logging.NullHandler())
+        self.server.acl = {pyzor.anonymous_user: ("ping",)}
+        self.real_socket = self.server.socket
+        self.server.socket = Mock()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.real_socket.close()
+        patch.stopall()
+
+    def get_packet(self, thread):
+        return ("Op: ping\nPV: %s\nThread: %s\n" %
+                (pyzor.proto_version, thread)).encode("utf8")
+
+    def test_non_blocking(self):
+        self.assertEqual(self.real_socket.gettimeout(), 0.0)
+
+    def test_batch(self):
+        packets = [(self.get_packet(thread), ("127.0.0.1", thread))
+                   for thread in (1024, 1025)]
+        self.server.socket.recvfrom.side_effect = packets + [
+            socket.error(errno.EAGAIN, "Resource temporarily unavailable")]
+
+        self.server._handle_request_noblock()
+
+        sent = self.server.socket.sendto.call_args_list
+        self.assertEqual(len(sent), 2)
+        for (data, address), thread in zip((c[0] for c in sent),
+                                           (1024, 1025)):
+            self.assertEqual(address, ("127.0.0.1", thread))
+            self.assertIn(("Thread: %s" % thread).encode("utf8"), data)
+            self.assertIn(b"Code: 200", data)
+
+    def test_batch_size(self):
+        packets = [(self.get_packet(thread), ("127.0.0.1", thread))
+                   for thread in range(1024, 1030)]
+        self.server.socket.recvfrom.side_effect = packets
+
+        self.server._handle_request_noblock()
+        self.assertEqual(self.server.socket.sendto.call_count, 3)
+        self.server._handle_request_noblock()
+        self.assertEqual(self.server.socket.sendto.call_count, 6)
+
+
+class PreForkServerTest(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.config").start()
+        self.server = pyzor.server.PreForkServer(("127.0.0.1", 0),
+                                                 itertools.repeat(Mock()),
+                                                 "passwd_fn", "access_fn",
+                                                 prefork=2)
+        self.server.log.addHandler(logging.NullHandler())
+        self.server.respawn_delay = 0
+        self.fork = patch("pyzor.server.os.fork",
+                          side_effect=[100, 101, 102]).start()
+        self.kill = patch("pyzor.server.os.kill").start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.server_close()
+        patch.stopall()
+
+    def supervise(self, *events):
+        """Run the supervisor, os.wait() returns the events in turn and a
+        None event shuts the server down.
+        """
+        events = list(events)
+
+        def wait():
+            event = events.pop(0)
+            while event is None:
+                self.server.shutdown()
+                event = events.pop(0)
+            return event
+        patch("pyzor.server.os.wait", side_effect=wait).start()
+        self.server.serve_forever()
+        self.assertEqual(events, [])
+        self.assertEqual(self.server.pids, {})
+
+    def test_shutdown(self):
+        self.supervise(None, (100, 0), (101, 0))
+        self.assertEqual(self.fork.call_count, 2)
+        self.kill.assert_any_call(100, signal.SIGTERM)
+        self.kill.assert_any_call(101, signal.SIGTERM)
+
+    def test_respawn(self):
+        self.supervise((100, 256), None, (101, 0), (102, 0))
+        self.assertEqual(self.fork.call_count, 3)
+        self.kill.assert_any_call(101, signal.SIGTERM)
+        self.kill.assert_any_call(102, signal.SIGTERM)
+
+    def test_no_children(self):
+        patch("pyzor.server.os.wait",
+              side_effect=OSError(errno.ECHILD, "No child processes")).start()
+        self.server.serve_forever()
+        self.assertEqual(self.fork.call_count, 2)
+
+    def test_reload(self):
+        self.server.pids = {100: 0, 101: 1}
+        self.server.load_config()
+        self.kill.assert_any_call(100, signal.SIGUSR1)
+        self.kill.assert_any_call(101, signal.SIGUSR1)
+
+    def test_reorganize(self):
+        self.server.pids = {100: 0, 101: 1}
+        self.server.reorganize_database()
+        self.kill.assert_any_call(100, signal.SIGUSR2)
+        self.kill.assert_any_call(101, signal.SIGUSR2)
+
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"),
+                     "SO_REUSEPORT is not available")
+class ReusePortServerTest(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.config").start()
+        self.server = pyzor.server.ReusePortServer(("127.0.0.1", 0),
+                                                   itertools.repeat(Mock()),
+                                                   "passwd_fn", "access_fn",
+                                                   prefork=2)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.server_close()
+        patch.stopall()
+
+    def test_parent_socket(self):
+        self.assertRaises(socket.error, self.server.socket.getsockname)
+
+    def test_worker_sockets(self):
+        sockets = []
+        try:
+            for dummy in range(2):
+                self.server.setup_worker()
+                sockets.append(self.server.socket)
+            for sock in sockets:
+                self.assertEqual(sock.getsockname(),
+                                 self.server.server_address)
+                self.assertTrue(sock.getsockopt(socket.SOL_SOCKET,
+                                                socket.SO_REUSEPORT))
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+@unittest.skipUnless(pyzor.server._has_asyncio, "asyncio is not available")
+class AsyncServerTest(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("pyzor.config").start()
+        self.server = pyzor.server.AsyncServer(("127.0.0.1", 0), {},
+                                               "passwd_fn", "access_fn",
+                                               max_workers=2)
+        self.server.log.addHandler(logging.NullHandler())
+        self.server.usage_log.addHandler(logging.NullHandler())
+        self.server.acl = {pyzor.anonymous_user: ("ping",)}
+        self.server.transport = Mock()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.server_close()
+        patch.stopall()
+
+    def get_packet(self, thread):
+        return ("Op: ping\nPV: %s\nThread: %s\n" %
+                (pyzor.proto_version, thread)).encode("utf8")
+
+    def run_requests(self, *requests):
+        futures = [self.server.process_request(packet, address)
+                   for packet, address in requests]
+        for future in futures:
+            if future is not None:
+                self.server.loop.run_until_complete(future)
+        # Let the done callbacks run.
+        self.server.loop.run_until_complete(pyzor.server.asyncio.sleep(0))
+
+    def test_process_request(self):
+        address = ("127.0.0.1", 1234)
+        self.run_requests((self.get_packet(1024), address))
+
+        sent = self.server.transport.sendto.call_args_list
+        self.assertEqual(len(sent), 1)
+        data, got_address = sent[0][0]
+        self.assertEqual(got_address, address)
+        self.assertIn(b"Thread: 1024", data)
+        self.assertIn(b"Code: 200", data)
+        self.assertEqual(self.server.pending, 0)
+
+    def test_max_pending(self):
+        self.server.max_pending = 1
+        self.run_requests((self.get_packet(1024), ("127.0.0.1", 1234)),
+                          (self.get_packet(1025), ("127.0.0.1", 1235)))
+        self.assertEqual(self.server.transport.sendto.call_count, 1)
+
 
 def suite():
     """Gather all the tests from this module in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(RequestHandlerTest))
     test_suite.addTest(unittest.makeSuite(ServerTest))
+    test_suite.addTest(unittest.makeSuite(BatchedServerTest))
+    test_suite.addTest(unittest.makeSuite(PreForkServerTest))
+    test_suite.addTest(unittest.makeSuite(ReusePortServerTest))
+    test_suite.addTest(unittest.makeSuite(AsyncServerTest))
     return test_suite
 
 if __name__ == '__main__':